@@ -0,0 +1,182 @@
+import asyncio
+import itertools
+import json
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+from . import config
+from .logger import logger
+
+_websockets = False # Not imported yet; None once known to be missing
+
+
+def load_websockets():
+    """
+    Returns the optional `websockets` module used by the CDP engine, or
+    None when it is not installed. Imported on first use.
+    """
+    global _websockets
+    if _websockets is False:
+        try:
+            import websockets
+            _websockets = websockets
+        except ImportError:
+            _websockets = None
+    return _websockets
+
+
+class CdpError(Exception):
+    """A DevTools command failed, timed out or the connection was lost."""
+
+
+def browser_websocket_url(port, timeout=None):
+    """
+    Returns the browser-level DevTools WebSocket URL of the Chrome listening
+    on `port`, waiting up to `timeout` seconds for it to come up.
+    """
+    url = f"http://127.0.0.1:{port}/json/version"
+    deadline = time.monotonic() + (timeout if timeout is not None else config.CDP_CONNECT_TIMEOUT)
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=2) as response:
+                return json.loads(response.read())["webSocketDebuggerUrl"]
+        except (urllib.error.URLError, OSError, ValueError, KeyError) as e:
+            if time.monotonic() >= deadline:
+                raise CdpError(f"Port {port} 沒有可連線的 Chrome DevTools: {e}") from e
+            time.sleep(0.5)
+
+
+class CdpConnection:
+    """
+    One WebSocket to a browser's DevTools endpoint. Commands are matched to
+    their responses by id; events are dispatched to listeners registered
+    per (session, method). Tabs are attached in flat mode, so every tab of
+    the browser shares this socket and one event loop drives them all.
+    """
+
+    def __init__(self, websocket):
+        self._ws = websocket
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._listeners = defaultdict(list)
+        self._reader = None
+        self.closed = False
+
+    @classmethod
+    async def connect(cls, port):
+        websockets = load_websockets()
+        if websockets is None:
+            raise CdpError("CDP 引擎需要 websockets 套件 (pip install websockets)。")
+        url = await asyncio.to_thread(browser_websocket_url, port)
+        # Responses such as page snapshots or response bodies can be large.
+        websocket = await websockets.connect(url, max_size=None, ping_interval=None)
+        connection = cls(websocket)
+        connection._reader = asyncio.create_task(connection._read_loop())
+        return connection
+
+    async def send(self, method, params=None, session_id=None, timeout=None):
+        """Sends a command and returns its result; raises CdpError on a protocol error or timeout."""
+        if self.closed:
+            raise CdpError("DevTools 連線已關閉。")
+        message_id = next(self._ids)
+        message = {"id": message_id, "method": method, "params": params or {}}
+        if session_id is not None:
+            message["sessionId"] = session_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        try:
+            try:
+                await self._ws.send(json.dumps(message))
+            except Exception as e:
+                raise CdpError(f"無法送出 {method}: {e}") from e
+            return await asyncio.wait_for(future, timeout or config.CDP_COMMAND_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise CdpError(f"{method} 逾時。") from None
+        finally:
+            self._pending.pop(message_id, None)
+
+    def on(self, method, callback, session_id=None):
+        """Calls `callback(params)` for every `method` event; returns a function that removes the listener."""
+        key = (session_id, method)
+        self._listeners[key].append(callback)
+        return lambda: self._listeners[key].remove(callback) if callback in self._listeners[key] else None
+
+    def expect(self, method, predicate=None, session_id=None):
+        """
+        Returns a future for the next `method` event matching `predicate`.
+        Register it before sending the command that triggers the event.
+        """
+        future = asyncio.get_running_loop().create_future()
+
+        def listener(params):
+            if not future.done() and (predicate is None or predicate(params)):
+                future.set_result(params)
+
+        remove = self.on(method, listener, session_id)
+        future.add_done_callback(lambda _: remove())
+        return future
+
+    async def _read_loop(self):
+        try:
+            async for raw in self._ws:
+                message = json.loads(raw)
+                if "id" in message:
+                    future = self._pending.get(message["id"])
+                    if future is None or future.done():
+                        continue
+                    if "error" in message:
+                        future.set_exception(CdpError(message["error"].get("message", str(message["error"]))))
+                    else:
+                        future.set_result(message.get("result", {}))
+                    continue
+                key = (message.get("sessionId"), message.get("method"))
+                for callback in list(self._listeners.get(key, ())):
+                    try:
+                        callback(message.get("params", {}))
+                    except Exception as e:
+                        logger.warning(f"處理 DevTools 事件 {key[1]} 時發生錯誤: {e}")
+        except Exception as e:
+            logger.warning(f"DevTools 連線中斷: {e}")
+        finally:
+            self.closed = True
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(CdpError("DevTools 連線已關閉。"))
+
+    async def close(self):
+        self.closed = True
+        await self._ws.close()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+
+class CdpSession:
+    """A page target attached to a `CdpConnection` (flat mode)."""
+
+    def __init__(self, connection, session_id, target_id):
+        self.connection = connection
+        self.session_id = session_id
+        self.target_id = target_id
+
+    @classmethod
+    async def open_page(cls, connection, url="about:blank"):
+        target = await connection.send("Target.createTarget", {"url": url})
+        attached = await connection.send("Target.attachToTarget", {"targetId": target["targetId"], "flatten": True})
+        return cls(connection, attached["sessionId"], target["targetId"])
+
+    async def send(self, method, params=None, timeout=None):
+        return await self.connection.send(method, params, session_id=self.session_id, timeout=timeout)
+
+    def on(self, method, callback):
+        return self.connection.on(method, callback, session_id=self.session_id)
+
+    def expect(self, method, predicate=None):
+        return self.connection.expect(method, predicate, session_id=self.session_id)
+
+    async def close(self):
+        try:
+            await self.connection.send("Target.closeTarget", {"targetId": self.target_id})
+        except CdpError:
+            pass # The tab or the browser is already gone.
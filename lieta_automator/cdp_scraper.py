@@ -0,0 +1,526 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+from . import chrome_launcher, config, progress
+from .cdp import CdpConnection, CdpError, CdpSession
+from .changes import ChangeDetector
+from .logger import logger
+from .pipeline import DownloadJob, PostProcessingPipeline, reset_download_dir
+from .planner import TimingHistory
+from .tickers import normalize
+from .tvcode import TvCodeSink
+
+# The same elements the Selenium scraper looks for.
+MODEL_BUTTON = ("css", 'button[role="combobox"]')
+TICKER_INPUT = ("css", 'input[placeholder="Ticker"]')
+SUBMIT_BUTTON = ("css", 'button[type="submit"]')
+CHART = ("css", "svg.main-svg")
+DOWNLOAD_BUTTON = ("xpath", "//button[contains(., '下載')]")
+
+
+def model_option(model):
+    return ("xpath", f"//div[contains(text(), '{model}')]")
+
+
+def tv_code_paragraph(ticker):
+    return ("xpath", f"//p[contains(text(), '{ticker.upper()}:')]")
+
+
+def _element_js(locator):
+    kind, query = locator
+    if kind == "css":
+        return f"document.querySelector({json.dumps(query)})"
+    return (f"document.evaluate({json.dumps(query)}, document, null, "
+            f"XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue")
+
+
+def _wait_script(locator, timeout, text=None, enabled=False):
+    """
+    A page script that resolves to true as soon as the element exists (and
+    contains `text` / is enabled and visible), or to false after `timeout`
+    seconds. A MutationObserver re-checks on every DOM change, so nothing
+    polls over the wire.
+    """
+    return f"""
+(() => {{
+  const text = {json.dumps(text)}, enabled = {json.dumps(enabled)};
+  const find = () => {{
+    const el = {_element_js(locator)};
+    if (!el) return false;
+    if (text !== null && !(el.textContent || "").includes(text)) return false;
+    if (enabled && (el.disabled || !el.getClientRects().length)) return false;
+    return true;
+  }};
+  if (find()) return true;
+  return new Promise(resolve => {{
+    const observer = new MutationObserver(() => {{
+      if (find()) {{ observer.disconnect(); clearTimeout(timer); resolve(true); }}
+    }});
+    observer.observe(document.documentElement, {{childList: true, subtree: true, characterData: true, attributes: true}});
+    const timer = setTimeout(() => {{ observer.disconnect(); resolve(false); }}, {int(timeout * 1000)});
+  }});
+}})()"""
+
+
+class CdpTab:
+    """A browser tab driven over the DevTools protocol: navigation, DOM waits, clicks and typing."""
+
+    def __init__(self, session, index):
+        self.session = session
+        self.index = index
+
+    @property
+    def target_id(self):
+        return self.session.target_id
+
+    @classmethod
+    async def open(cls, connection, index, on_network_event=None):
+        session = await CdpSession.open_page(connection)
+        await session.send("Page.enable")
+        await session.send("Runtime.enable")
+        if on_network_event is not None:
+            for method in ("Network.requestWillBeSent", "Network.responseReceived",
+                           "Network.loadingFinished", "Network.loadingFailed"):
+                session.on(method, lambda params, method=method: on_network_event(session, method, params))
+            await session.send("Network.enable")
+        return cls(session, index)
+
+    async def evaluate(self, expression, await_promise=False, timeout=None):
+        result = await self.session.send("Runtime.evaluate", {
+            "expression": expression, "awaitPromise": await_promise, "returnByValue": True,
+        }, timeout=timeout)
+        if "exceptionDetails" in result:
+            details = result["exceptionDetails"]
+            raise CdpError(details.get("exception", {}).get("description") or details.get("text", "script error"))
+        return result.get("result", {}).get("value")
+
+    async def navigate(self, url):
+        """Opens `url` and waits for the page's load event."""
+        loaded = self.session.expect("Page.loadEventFired")
+        try:
+            result = await self.session.send("Page.navigate", {"url": url})
+            if result.get("errorText"):
+                raise CdpError(f"無法開啟 {url}: {result['errorText']}")
+            await asyncio.wait_for(loaded, config.CDP_NAVIGATION_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise CdpError(f"載入 {url} 逾時。") from None
+        finally:
+            loaded.cancel()
+
+    async def wait_for(self, locator, timeout, text=None, enabled=False):
+        """Returns True once the element is there (see `_wait_script`), False after `timeout` seconds."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                return bool(await self.evaluate(_wait_script(locator, remaining, text, enabled),
+                                                await_promise=True, timeout=remaining + config.CDP_COMMAND_TIMEOUT))
+            except CdpError as e:
+                # A navigation destroys the page's context mid-wait; wait again in the new one.
+                if "context" not in str(e).lower():
+                    raise
+                await asyncio.sleep(0.2)
+
+    async def click(self, locator):
+        clicked = await self.evaluate(
+            f"(() => {{ const el = {_element_js(locator)}; if (!el) return false; el.click(); return true; }})()")
+        if not clicked:
+            raise CdpError(f"找不到元素 {locator[1]}")
+
+    async def type_text(self, locator, text):
+        """Replaces the value of an input with `text`, typed through CDP input events."""
+        focused = await self.evaluate(
+            f"(() => {{ const el = {_element_js(locator)}; if (!el) return false; el.focus(); el.select(); return true; }})()")
+        if not focused:
+            raise CdpError(f"找不到輸入欄位 {locator[1]}")
+        await self.session.send("Input.insertText", {"text": text})
+
+    async def text_of(self, locator):
+        return await self.evaluate(
+            f"(() => {{ const el = {_element_js(locator)}; return el ? el.innerText : null; }})()")
+
+    async def current_url(self):
+        return await self.evaluate("location.href")
+
+    async def close(self):
+        await self.session.close()
+
+
+class CdpScraper:
+    """
+    Scraper engine that drives Chrome over the DevTools protocol with
+    asyncio instead of Selenium: no chromedriver process, no thread per
+    worker and no polling waits. One browser connection serves several
+    tabs (`CDP_TABS_PER_BROWSER`), each working through a shared queue of
+    tickers. Implements the same `run_automation(tickers, model,
+    destination_path)` contract as `LietaScraper` and records the same
+    timing samples and progress events. Needs the optional `websockets`
+    package.
+    """
+
+    def __init__(self, download_path, port, pipeline=None, tv_code_sink=None, tabs=None, on_progress=None,
+                 on_login_required=None):
+        self.download_path = download_path
+        self.port = port
+        self.pipeline = pipeline
+        self.tv_code_sink = tv_code_sink
+        self.tabs = tabs or config.CDP_TABS_PER_BROWSER
+        self.failed_tickers = []
+        self.timings = []
+        # Records Network.* events of every tab for `replay.HarRecorder`.
+        self.capture_network = False
+        self._network_events = deque()
+        self._bodies = {}
+        self._body_tasks = set()
+        self._downloads = {}        # download guid -> future of its final state
+        self._download_waiters = {} # frame id -> future of its next Browser.downloadWillBegin
+        # Same callbacks as `runner.AutomationRun`; all tabs report under this browser's port.
+        self.on_progress = on_progress
+        self.on_login_required = on_login_required
+
+    # --- Contract shared with LietaScraper ---
+
+    def run_automation(self, tickers, model, destination_path):
+        """Processes `tickers` for `model`; returns the failed items as "TICKER (model)" labels."""
+        self.failed_tickers = []
+        logger.info(f"--- [Port {self.port}|CDP] 開始處理模型: {model} ---")
+        asyncio.run(self.run_automation_async(tickers, model, destination_path))
+        logger.info(f"--- [Port {self.port}|CDP] 模型 {model} 處理完畢 ---")
+        return self.failed_tickers
+
+    async def run_automation_async(self, tickers, model, destination_path):
+        pending = deque(tickers)
+        tabs = []
+        connection = None
+        self._progress("worker_state", port=self.port, state=progress.STARTING)
+        try:
+            connection = await CdpConnection.connect(self.port)
+            await self._enable_downloads(connection)
+            on_network_event = self._on_network_event if self.capture_network else None
+            for index in range(max(1, min(self.tabs, len(tickers)))):
+                tabs.append(await CdpTab.open(connection, index, on_network_event))
+            if not await self._check_login(tabs[0]):
+                if self.on_login_required:
+                    self.on_login_required()
+                raise CdpError("使用者未登入。請先手動執行一次程式並登入。")
+            logger.info(f"[Port {self.port}|CDP] 以 {len(tabs)} 個分頁處理 {len(tickers)} 個 Tickers。")
+            await asyncio.gather(*(self._tab_worker(tab, model, pending, destination_path) for tab in tabs))
+            if self._body_tasks:
+                await asyncio.gather(*self._body_tasks, return_exceptions=True)
+        except CdpError as e:
+            logger.error(f"[Port {self.port}|CDP] 執行失敗: {e}")
+        finally:
+            for tab in tabs:
+                await tab.close()
+            if connection is not None:
+                # The download behavior applies to the whole browser, which the user keeps using.
+                try:
+                    await connection.send("Browser.setDownloadBehavior", {"behavior": "default"})
+                except CdpError as e:
+                    logger.warning(f"[Port {self.port}|CDP] 無法還原下載設定: {e}")
+                await connection.close()
+            # Whatever no tab got to, e.g. because every tab failed to select the model.
+            for ticker in pending:
+                self.failed_tickers.append(f"{ticker} ({model})")
+                self._progress("item_finished", port=self.port, model=model, ticker=ticker, ok=False, requeued=False,
+                               reason="not_processed")
+            pending.clear()
+            self._progress("worker_state", port=self.port, state=progress.FINISHED)
+        if model == "TV Code":
+            self.flush_tv_code(destination_path)
+
+    def _progress(self, event, **fields):
+        if self.on_progress is None:
+            return
+        try:
+            self.on_progress({"event": event, **fields})
+        except Exception as e:
+            logger.warning(f"進度回報失敗: {e}")
+
+    def flush_tv_code(self, destination_path):
+        try:
+            self._get_tv_code_sink(destination_path).flush()
+        except Exception as e:
+            logger.error(f"[Port {self.port}|CDP] 寫入 TV Code 檔案失敗: {e}", exc_info=True)
+
+    # --- Network capture (same interface as LietaScraper, for replay.HarRecorder) ---
+
+    def start_network_capture(self):
+        self.capture_network = True
+        self._network_events.clear()
+        self._bodies.clear()
+
+    def network_events(self):
+        while self._network_events:
+            yield self._network_events.popleft()
+
+    def response_body(self, request_id):
+        body = self._bodies.pop(request_id, None)
+        if body is None:
+            raise CdpError(f"沒有請求 {request_id} 的回應內容。")
+        return body
+
+    def _on_network_event(self, session, method, params):
+        self._network_events.append((method, params))
+        if method == "Network.loadingFinished":
+            # Fetched right away: Chrome only keeps bodies for a while.
+            task = asyncio.get_running_loop().create_task(self._fetch_body(session, params["requestId"]))
+            self._body_tasks.add(task)
+            task.add_done_callback(self._body_tasks.discard)
+
+    async def _fetch_body(self, session, request_id):
+        try:
+            self._bodies[request_id] = await session.send("Network.getResponseBody", {"requestId": request_id})
+        except CdpError:
+            pass # Bodies of some requests (e.g. preflights, evicted resources) are unavailable.
+
+    # --- Steps ---
+
+    async def _check_login(self, tab):
+        await tab.navigate(config.LIETA_AUTOMATION_URL)
+        # Logged in as soon as the model selector shows; otherwise give a logged-out session time to redirect.
+        await tab.wait_for(MODEL_BUTTON, config.LOGIN_CHECK_TIMEOUT)
+        current_url = await tab.current_url()
+        if not current_url.startswith(config.LIETA_AUTOMATION_URL):
+            logger.warning(f"[Port {self.port}|CDP] 網址不符合預期 ({current_url})，使用者可能尚未登入。")
+            return False
+        return True
+
+    async def _enable_downloads(self, connection):
+        os.makedirs(self.download_path, exist_ok=True)
+        # allowAndName saves each download under its guid, so concurrent tabs never collide.
+        await connection.send("Browser.setDownloadBehavior", {
+            "behavior": "allowAndName", "downloadPath": self.download_path, "eventsEnabled": True,
+        })
+        connection.on("Browser.downloadWillBegin", self._on_download_will_begin)
+        connection.on("Browser.downloadProgress", self._on_download_progress)
+
+    def _on_download_will_begin(self, params):
+        self._downloads[params["guid"]] = asyncio.get_running_loop().create_future()
+        waiter = self._download_waiters.get(params.get("frameId"))
+        if waiter is not None and not waiter.done():
+            waiter.set_result(params)
+
+    def _on_download_progress(self, params):
+        if params.get("state") in ("completed", "canceled"):
+            future = self._downloads.get(params["guid"])
+            if future is not None and not future.done():
+                future.set_result(params["state"])
+
+    async def _tab_worker(self, tab, model, pending, destination_path):
+        if not pending or not await self._select_model(tab, model):
+            return # The other tabs take this tab's share.
+        first_submit = True
+        while pending:
+            ticker = pending.popleft()
+            self._progress("item_started", port=self.port, model=model, ticker=ticker, tab=tab.index)
+            ok = await self._process_ticker(tab, model, ticker, destination_path, first_submit)
+            sample = self.timings[-1] if self.timings else {}
+            self._progress("item_finished", port=self.port, model=model, ticker=ticker, ok=ok, requeued=False,
+                           seconds=sample.get("seconds"), chart_load_seconds=sample.get("chart_load_seconds"),
+                           phases=sample.get("phases"), reason=sample.get("reason"))
+            first_submit = False
+
+    async def _select_model(self, tab, model):
+        label = f"[Port {self.port}|CDP 分頁 {tab.index + 1}]"
+        try:
+            # The tab used for the login check already shows the platform; no need to load it again.
+            if not (await tab.current_url() or "").startswith(config.LIETA_AUTOMATION_URL):
+                await tab.navigate(config.LIETA_AUTOMATION_URL)
+            elif model in (await tab.text_of(MODEL_BUTTON) or ""):
+                logger.info(f"{label} 模型選擇器已是 {model}，略過重新選擇。")
+                return True
+            for attempt in range(2):
+                if not await tab.wait_for(MODEL_BUTTON, config.SELENIUM_TIMEOUT, enabled=True):
+                    raise CdpError("找不到模型選擇器。")
+                await tab.click(MODEL_BUTTON)
+                if not await tab.wait_for(model_option(model), config.SELENIUM_TIMEOUT, enabled=True):
+                    raise CdpError(f"找不到模型選項 {model}。")
+                await tab.click(model_option(model))
+                if await tab.wait_for(MODEL_BUTTON, config.SELENIUM_TIMEOUT, text=model):
+                    logger.info(f"{label} 驗證成功: 目前模型已切換為 {model}")
+                    return True
+                logger.warning(f"{label} 第 {attempt + 1} 次嘗試驗證失敗。")
+                if attempt == 0:
+                    await asyncio.sleep(3)
+            raise CdpError("重試後仍無法成功選擇模型。")
+        except CdpError as e:
+            logger.error(f"{label} 無法選擇模型 {model}。原因: {e}")
+            return False
+
+    async def _submit(self, tab, ticker, first_submit):
+        if not await tab.wait_for(TICKER_INPUT, config.SELENIUM_TIMEOUT, enabled=True):
+            raise CdpError("找不到 Ticker 輸入欄位。")
+        await tab.type_text(TICKER_INPUT, ticker)
+        if first_submit:
+            await asyncio.sleep(1) # Same settling delay as the Selenium engine
+        if not await tab.wait_for(SUBMIT_BUTTON, config.SELENIUM_TIMEOUT, enabled=True):
+            raise CdpError("找不到提交按鈕。")
+        await tab.click(SUBMIT_BUTTON)
+
+    async def _process_ticker(self, tab, model, ticker, destination_path, first_submit):
+        started = time.monotonic()
+        load_seconds, timeouts = None, 0
+        phases, phase = {}, "submit"
+        loaded_locator = tv_code_paragraph(ticker) if model == "TV Code" else CHART
+        try:
+            loaded = False
+            for attempt in range(2):
+                phase = "submit"
+                phase_started = time.monotonic()
+                await self._submit(tab, ticker, first_submit and attempt == 0)
+                submitted = time.monotonic()
+                phases["submit"] = phases.get("submit", 0.0) + submitted - phase_started
+                phase = "chart_load"
+                if await tab.wait_for(loaded_locator, config.CDP_CHART_TIMEOUT):
+                    load_seconds = time.monotonic() - submitted
+                    loaded = True
+                    break
+                timeouts += 1
+                logger.warning(f"[Port {self.port}|CDP] {ticker} 第 {attempt + 1} 次提交在 {config.CDP_CHART_TIMEOUT} 秒後超時。")
+            if not loaded:
+                raise CdpError("重試後仍然無法取得 TV Code。" if model == "TV Code" else "重試後仍然無法載入圖表。")
+
+            if model == "TV Code":
+                phase = "extract"
+                phase_started = time.monotonic()
+                code_text = await tab.text_of(loaded_locator)
+                self._get_tv_code_sink(destination_path).add(ticker, code_text or "")
+                phases["extract"] = time.monotonic() - phase_started
+                logger.info(f"成功: [Port:{self.port}|TV Code] for {ticker.upper()} 已取得。")
+            else:
+                phase = "download"
+                phase_started = time.monotonic()
+                downloaded_path = await self._download(tab)
+                phases["download"] = time.monotonic() - phase_started
+                phase = "finalise"
+                await self._finalise(DownloadJob(downloaded_path, destination_path, model, ticker, port=self.port))
+            self._record_timing(model, ticker, started, load_seconds, timeouts, ok=True, phases=phases)
+            return True
+        except Exception as e:
+            logger.error(f"失敗: [Port:{self.port}|{model}] - {ticker}. 原因: {str(e).splitlines()[0] if str(e) else type(e).__name__}", exc_info=True)
+            self.failed_tickers.append(f"{ticker} ({model})")
+            self._record_timing(model, ticker, started, load_seconds, timeouts, ok=False, phases=phases, reason=phase)
+            return False
+
+    async def _download(self, tab):
+        """Clicks the download button and waits for Chrome's download events; returns the file path."""
+        began = asyncio.get_running_loop().create_future()
+        self._download_waiters[tab.target_id] = began
+        try:
+            if not await tab.wait_for(DOWNLOAD_BUTTON, config.SELENIUM_TIMEOUT, enabled=True):
+                raise CdpError("找不到下載按鈕。")
+            await tab.click(DOWNLOAD_BUTTON)
+            params = await asyncio.wait_for(began, config.CDP_DOWNLOAD_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise CdpError("下載沒有開始。") from None
+        finally:
+            self._download_waiters.pop(tab.target_id, None)
+        guid = params["guid"]
+        try:
+            state = await asyncio.wait_for(self._downloads[guid], config.CDP_DOWNLOAD_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise CdpError(f"下載逾時: {params.get('suggestedFilename', guid)}") from None
+        finally:
+            self._downloads.pop(guid, None)
+        if state != "completed":
+            raise CdpError(f"下載已取消: {params.get('suggestedFilename', guid)}")
+        return os.path.join(self.download_path, guid)
+
+    async def _finalise(self, job):
+        # The pipeline blocks when it is full; keep that off the event loop.
+        if self.pipeline:
+            await asyncio.to_thread(self.pipeline.submit, job)
+        else:
+            inline = PostProcessingPipeline()
+            await asyncio.to_thread(inline.run_job, job)
+            self.failed_tickers.extend(inline.failed_items)
+
+    def _get_tv_code_sink(self, destination_path):
+        if self.tv_code_sink is None:
+            self.tv_code_sink = TvCodeSink(destination_path)
+        return self.tv_code_sink
+
+    def _record_timing(self, model, ticker, started, load_seconds, timeouts, ok, phases=None, reason=None):
+        """Same sample as `LietaScraper._record_timing`, tagged with the engine."""
+        sample = {
+            "event": "ticker_timing",
+            "engine": "cdp",
+            "port": self.port,
+            "model": model,
+            "ticker": ticker.upper(),
+            "seconds": round(time.monotonic() - started, 3),
+            "chart_load_seconds": round(load_seconds, 3) if load_seconds is not None else None,
+            "timeouts": timeouts,
+            "ok": ok,
+        }
+        if load_seconds is not None:
+            phases = dict(phases or {}, chart_load=load_seconds)
+        if phases:
+            sample["phases"] = {name: round(seconds, 3) for name, seconds in phases.items()}
+        if reason is not None:
+            sample["reason"] = reason
+        self.timings.append(sample)
+        logger.info(f"[Port {self.port}|CDP] {ticker.upper()} ({model}) 耗時 {sample['seconds']:.1f} 秒。", extra={"data": sample})
+
+
+def start_primary_chrome():
+    """Makes sure the primary Chrome runs with remote debugging; returns its port."""
+    port = config.PRIMARY_DEBUGGING_PORT
+    if not chrome_launcher.launch_chrome_in_debug_mode(port, config.get_chrome_user_data_dir(0)):
+        raise Exception(f"[Port {port}] 無法啟動 Chrome 偵錯實例。")
+    return port
+
+
+def run_cdp_engine(tickers, models, destination_path, user_settings, record_history=True, on_progress=None,
+                   on_login_required=None):
+    """
+    Runs a job with the CDP engine (`scraper_engine: "cdp"`): one primary
+    Chrome, `cdp_tabs` tabs per model, the usual post-processing pipeline
+    and TV Code files. Returns a `RunResult`. `record_history`,
+    `on_progress` and `on_login_required` are as for `runner.AutomationRun`.
+    """
+    from .runner import RunResult, finish_replication, start_replicator
+    specs = sorted(normalize(tickers), key=lambda spec: -spec.priority)
+    port = start_primary_chrome()
+    download_path = config.get_download_path(destination_path, port, user_settings.get("direct_download", False))
+    reset_download_dir(download_path)
+    changes = ChangeDetector(destination_path) if user_settings.get("detect_changes", True) else None
+    replicator = start_replicator(destination_path, user_settings)
+    pipeline = PostProcessingPipeline(compress=user_settings.get("compress_outputs", False), changes=changes,
+                                      replicator=replicator).start()
+    scraper = CdpScraper(download_path, port, pipeline, TvCodeSink(destination_path, changes=changes),
+                         tabs=user_settings.get("cdp_tabs") or None, on_progress=on_progress,
+                         on_login_required=on_login_required)
+    logger.info(f"--- 自動化開始 (CDP 引擎，每個模型 {scraper.tabs} 個分頁) ---")
+    started = time.monotonic()
+    batches = [(model, [spec.ticker for spec in specs if spec.wants(model)]) for model in models]
+    total = sum(len(names) for _, names in batches)
+    failed = []
+    scraper._progress("run_started", total=total, ports=[port])
+    try:
+        for model, names in batches:
+            if names:
+                failed.extend(scraper.run_automation(names, model, destination_path))
+    finally:
+        pipeline.close()
+        scraper.tv_code_sink.flush()
+        manifest_path = changes.write_manifest() if changes is not None else None
+        if replicator is not None:
+            finish_replication(replicator, destination_path, scraper.tv_code_sink, manifest_path)
+        scraper._progress("run_finished")
+    failed.extend(pipeline.failed_items)
+    if record_history:
+        try:
+            history = TimingHistory.load()
+            history.record_samples(scraper.timings)
+            history.save()
+        except Exception as e:
+            logger.warning(f"無法更新歷史耗時紀錄: {e}")
+    return RunResult(total, failed, 0.0, time.monotonic() - started)
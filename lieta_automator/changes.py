@@ -0,0 +1,241 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import datetime
+
+from . import config
+from .logger import logger
+
+NEW, CHANGED, UNCHANGED = "new", "changed", "unchanged"
+
+_DECODER = json.JSONDecoder()
+# Ids the chart library generates anew for every export.
+_VOLATILE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE)
+
+
+def _read_output(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def _strip_volatile(value):
+    if isinstance(value, dict):
+        return {key: _strip_volatile(item) for key, item in value.items() if key != "uid"}
+    if isinstance(value, list):
+        return [_strip_volatile(item) for item in value]
+    return value
+
+
+def extract_chart_data(html):
+    """
+    Returns the traces of every `Plotly.newPlot(id, data, ...)` call in a
+    saved chart page, without the per-export trace ids, or None if the page
+    has none.
+    """
+    traces = []
+    position = html.find("Plotly.newPlot(")
+    while position != -1:
+        try:
+            index = position + len("Plotly.newPlot(")
+            _, index = _DECODER.raw_decode(html, _skip_space(html, index)) # The target element id
+            index = _skip_space(html, index)
+            if html[index] != ",":
+                raise ValueError("unexpected token")
+            data, _ = _DECODER.raw_decode(html, _skip_space(html, index + 1))
+            if isinstance(data, list):
+                traces.extend(_strip_volatile(data))
+        except (ValueError, IndexError):
+            pass # Not written as JSON literals; the page text is compared instead.
+        position = html.find("Plotly.newPlot(", position + 1)
+    return traces or None
+
+
+def _skip_space(text, index):
+    while index < len(text) and text[index].isspace():
+        index += 1
+    return index
+
+
+def chart_fingerprint(path):
+    """
+    Returns (fingerprint, traces) of a saved chart: a hash of its data
+    traces, or of the page text minus generated ids when no data could be
+    extracted (traces is then None).
+    """
+    html = _read_output(path)
+    traces = extract_chart_data(html)
+    if traces is not None:
+        canonical = json.dumps(traces, sort_keys=True, separators=(",", ":"))
+    else:
+        canonical = " ".join(_VOLATILE.sub("", html).split())
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest(), traces
+
+
+def _flatten(values):
+    for value in values:
+        if isinstance(value, list):
+            yield from _flatten(value)
+        else:
+            yield value
+
+
+def _changed_values(old, new):
+    if isinstance(old, list) and isinstance(new, list):
+        old, new = list(_flatten(old)), list(_flatten(new))
+        return sum(1 for a, b in zip(old, new) if a != b) + abs(len(old) - len(new))
+    return 0 if old == new else 1
+
+
+def compare_traces(old, new):
+    """Summarises how the traces of a chart changed: traces added, removed and changed, and data values changed."""
+    changed, values = [], 0
+    for i, (a, b) in enumerate(zip(old, new)):
+        if a == b:
+            continue
+        changed.append(b.get("name") or a.get("name") or f"trace {i}")
+        values += sum(_changed_values(a.get(key), b.get(key)) for key in ("x", "y", "z"))
+    return {
+        "traces_added": max(0, len(new) - len(old)),
+        "traces_removed": max(0, len(old) - len(new)),
+        "traces_changed": changed,
+        "values_changed": values,
+    }
+
+
+def latest_output(target_dir):
+    """The most recent saved output in a `<model>/<TICKER>` folder, or None."""
+    try:
+        names = [name for name in os.listdir(target_dir) if name.endswith((".html", ".html.gz"))]
+    except OSError:
+        return None
+    # File names start with the save time, so they sort chronologically.
+    return os.path.join(target_dir, max(names)) if names else None
+
+
+def describe_chart_change(new_path, previous_path):
+    """
+    Compares a new chart with the previous output of its (model, ticker).
+    Returns a change record: status, data fingerprint and, for changed
+    charts, a summary of what changed.
+    """
+    fingerprint, traces = chart_fingerprint(new_path)
+    change = {"status": NEW, "data_sha256": fingerprint}
+    if previous_path is None:
+        return change
+    try:
+        previous_fingerprint, previous_traces = chart_fingerprint(previous_path)
+    except OSError as e:
+        logger.warning(f"無法讀取先前的輸出 {previous_path}，視為新資料: {e}")
+        return change
+    change["previous"] = os.path.basename(previous_path)
+    if previous_fingerprint == fingerprint:
+        change["status"] = UNCHANGED
+        return change
+    change["status"] = CHANGED
+    if traces is not None and previous_traces is not None:
+        change["diff"] = compare_traces(previous_traces, traces)
+    return change
+
+
+class ChangeDetector:
+    """
+    Collects the change record of every output saved during a run and
+    publishes them as a manifest, so downstream jobs only reprocess what
+    changed:
+
+        <destination>/changes/<time>_changes.json
+        <destination>/changes/latest_changes.json
+
+    Charts are compared by the post-processing pipeline, TV Code lines by
+    the `TvCodeSink`. Thread safe.
+    """
+
+    def __init__(self, destination_path):
+        self.destination_path = destination_path
+        self.started = datetime.now()
+        self.records = []
+        self._lock = threading.Lock()
+
+    def record(self, model, ticker, change, path=None):
+        entry = {"model": model, "ticker": ticker.upper(), **change}
+        if path is not None:
+            entry["path"] = path
+        with self._lock:
+            self.records.append(entry)
+        if change["status"] != UNCHANGED:
+            logger.info(f"資料變更: {ticker.upper()} ({model}) {'為新資料' if change['status'] == NEW else '已變更'}。")
+        return entry
+
+    def record_tv_code(self, ticker, previous, current):
+        """Compares a TV Code line with the previous one of the ticker (None if there is none)."""
+        if previous is None:
+            change = {"status": NEW}
+        elif previous.strip() == current.strip():
+            change = {"status": UNCHANGED}
+        else:
+            change = {"status": CHANGED, "previous_code": previous.strip(), "code": current.strip()}
+        return self.record("TV Code", ticker, change)
+
+    def record_index_entries(self):
+        """
+        Adds the change records the pipelines of other processes wrote to the
+        output index since the run started (`--coordinator` mode).
+        """
+        index_path = os.path.join(self.destination_path, config.OUTPUT_INDEX_FILENAME)
+        since = self.started.isoformat(timespec="seconds")
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("change") and (entry.get("saved_at") or "") >= since:
+                        self.record(entry["model"], entry["ticker"], dict(entry["change"]), path=entry.get("path"))
+        except OSError as e:
+            logger.warning(f"無法讀取輸出索引 {index_path}: {e}")
+
+    def manifest(self):
+        with self._lock:
+            records = list(self.records)
+        # A ticker re-run within the run counts once, with its last result.
+        latest = {}
+        for entry in records:
+            latest[(entry["model"], entry["ticker"])] = entry
+        by_model = {}
+        for (model, ticker), entry in sorted(latest.items()):
+            by_model.setdefault(model, {NEW: [], CHANGED: [], UNCHANGED: []})[entry["status"]].append(ticker)
+        items = [latest[key] for key in sorted(latest)]
+        return {
+            "run_started": self.started.isoformat(timespec="seconds"),
+            "run_finished": datetime.now().isoformat(timespec="seconds"),
+            "summary": {status: sum(1 for e in items if e["status"] == status) for status in (NEW, CHANGED, UNCHANGED)},
+            "changed_tickers": sorted({e["ticker"] for e in items if e["status"] != UNCHANGED}),
+            "by_model": by_model,
+            "items": items,
+        }
+
+    def write_manifest(self):
+        """Writes this run's manifest and replaces `latest_changes.json`. Returns the manifest path, or None."""
+        manifest = self.manifest()
+        if not manifest["items"]:
+            return None
+        changes_dir = os.path.join(self.destination_path, config.CHANGES_DIRNAME)
+        path = os.path.join(changes_dir, f"{self.started:%Y%m%d_%H%M%S}_changes.json")
+        try:
+            os.makedirs(changes_dir, exist_ok=True)
+            for target in (path, os.path.join(changes_dir, config.CHANGES_LATEST_FILENAME)):
+                temp_path = f"{target}.{os.getpid()}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(manifest, f, ensure_ascii=False, indent=2)
+                os.replace(temp_path, target)
+        except OSError as e:
+            logger.error(f"無法寫入變更清單 {path}: {e}")
+            return None
+        summary = manifest["summary"]
+        logger.info(f"變更清單已寫入 {path}: 新資料 {summary[NEW]}，已變更 {summary[CHANGED]}，未變更 {summary[UNCHANGED]}。")
+        return path
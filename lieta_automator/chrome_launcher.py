@@ -1,21 +1,25 @@
 import os
 import socket
 import subprocess
-import winreg
+import sys
 import shutil
-from . import config
+from . import config, tracing
 from .logger import logger
 
-def _sync_profile_if_new(port: int, dest_profile_dir: str):
+# Chrome writes the port it actually listens on into this file in its profile.
+DEVTOOLS_PORT_FILE = "DevToolsActivePort"
+
+@tracing.traced("sync_profile", cat="launcher")
+def _sync_profile_if_new(dest_profile_dir: str):
     """
     If this is the first time a secondary profile is being used, sync the primary
     profile's data to it to ensure a consistent state (logins, extensions, etc.).
     """
+    source_profile_dir = config.get_chrome_user_data_dir(0)
     # This logic only applies to secondary profiles (not the main one)
-    if port == config.REMOTE_DEBUGGING_PORTS[0]:
+    if os.path.abspath(dest_profile_dir) == os.path.abspath(source_profile_dir):
         return
 
-    source_profile_dir = config.get_chrome_user_data_dir(config.REMOTE_DEBUGGING_PORTS[0])
     sync_marker_file = os.path.join(dest_profile_dir, ".profile_synced")
 
     # Check if the source profile exists and the destination has not been synced before
@@ -41,9 +45,21 @@ def _sync_profile_if_new(port: int, dest_profile_dir: str):
 
 def find_chrome_executable():
     """
-    Finds the path to chrome.exe by checking the Windows Registry.
+    Finds the Chrome executable: the configured path first, then the Windows
+    Registry, or the usual binary names on the PATH elsewhere.
     Returns the path as a string or None if not found.
     """
+    if config.CHROME_EXECUTABLE_PATH and os.path.exists(config.CHROME_EXECUTABLE_PATH):
+        return config.CHROME_EXECUTABLE_PATH
+    if sys.platform != "win32":
+        for name in ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser"):
+            path = shutil.which(name)
+            if path:
+                return path
+        mac_path = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
+        return mac_path if os.path.exists(mac_path) else None
+
+    import winreg
     try:
         for root_key in [winreg.HKEY_LOCAL_MACHINE, winreg.HKEY_CURRENT_USER]:
             try:
@@ -71,6 +87,7 @@ def is_port_in_use(port):
         except socket.error:
             return True
 
+@tracing.traced("launch_chrome", cat="launcher")
 def launch_chrome_in_debug_mode(port: int, user_data_dir: str):
     """
     Ensures a Chrome instance is running in debug mode on a specific port
@@ -78,7 +95,7 @@ def launch_chrome_in_debug_mode(port: int, user_data_dir: str):
     If the port is not in use, it launches a new Chrome instance.
     """
     # Before launching, sync the profile from the main one if it's a new profile
-    _sync_profile_if_new(port, user_data_dir)
+    _sync_profile_if_new(user_data_dir)
 
     logger.info(f"正在檢查 Port {port}...")
     if is_port_in_use(port):
@@ -92,10 +109,24 @@ def launch_chrome_in_debug_mode(port: int, user_data_dir: str):
         return False
 
     logger.info(f"正在為 Port {port} 啟動新的 Chrome 偵錯實例...")
+    if sys.platform != "win32":
+        try:
+            subprocess.Popen(
+                [chrome_path, f"--remote-debugging-port={port}", f"--user-data-dir={user_data_dir}",
+                 *config.CHROME_EXTRA_ARGS, config.LIETA_PLATFORM_URL],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+            )
+            logger.info(f"已成功為 Port {port} 啟動 Chrome。請稍候瀏覽器開啟...")
+            return True
+        except Exception as e:
+            logger.error(f"無法為 Port {port} 自動啟動 Chrome: {e}", exc_info=True)
+            return False
+
     command = [
         f'"{chrome_path}"',  # Enclose the executable path in quotes
         f"--remote-debugging-port={port}",
         f'--user-data-dir="{user_data_dir}"',
+        *config.CHROME_EXTRA_ARGS,
         f'"{config.LIETA_PLATFORM_URL}"'
     ]
     try:
@@ -107,3 +138,41 @@ def launch_chrome_in_debug_mode(port: int, user_data_dir: str):
     except Exception as e:
         logger.error(f"無法為 Port {port} 自動啟動 Chrome: {e}", exc_info=True)
         return False
+
+
+def _read_devtools_active_port(user_data_dir: str):
+    """Returns the debugging port recorded in a profile, or None."""
+    try:
+        with open(os.path.join(user_data_dir, DEVTOOLS_PORT_FILE), "r", encoding="utf-8") as f:
+            return int(f.readline().strip())
+    except (OSError, ValueError):
+        return None
+
+def _find_free_port(taken):
+    port = config.PRIMARY_DEBUGGING_PORT + 1
+    while port in taken or is_port_in_use(port):
+        port += 1
+    return port
+
+def allocate_worker_slots(count: int):
+    """
+    Assigns a debugging port and profile directory to each of `count` workers.
+    - Worker 0 always uses PRIMARY_DEBUGGING_PORT, the instance the user logs in with.
+    - Other workers reuse the port of a Chrome that is still running with their
+      profile (read from DevToolsActivePort), or get the next free port.
+    Returns a list of dicts with 'index', 'port' and 'user_data_dir'.
+    """
+    slots = []
+    taken = set()
+    for index in range(count):
+        user_data_dir = config.get_chrome_user_data_dir(index)
+        if index == 0:
+            port = config.PRIMARY_DEBUGGING_PORT
+        else:
+            port = _read_devtools_active_port(user_data_dir)
+            if port is None or port in taken or not is_port_in_use(port):
+                port = _find_free_port(taken | {config.PRIMARY_DEBUGGING_PORT})
+        taken.add(port)
+        slots.append({'index': index, 'port': port, 'user_data_dir': user_data_dir})
+    logger.info("已分配偵錯埠: " + ", ".join(f"#{slot['index']}={slot['port']}" for slot in slots))
+    return slots
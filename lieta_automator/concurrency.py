@@ -0,0 +1,126 @@
+import statistics
+import threading
+from collections import deque
+
+from . import config
+from .logger import logger
+
+
+class ConcurrencyController:
+    """
+    Additive-increase / multiplicative-decrease control of how many workers
+    may process items at the same time.
+
+    Workers report one sample per item (chart-load latency and whether any
+    submission timed out). After each full window of samples the controller
+    compares the window's median latency with a baseline, a moving average
+    of the medians of earlier windows without timeouts:
+
+    - timeouts above `ADAPTIVE_TIMEOUT_RATE` or latency above
+      `ADAPTIVE_LATENCY_TOLERANCE` x baseline halve the limit;
+    - a window without timeouts and with latency close to the baseline
+      adds one worker.
+
+    Worker indices below the limit (among workers still alive) are active;
+    the others finish their current item and then wait in `wait_for_turn`.
+    """
+
+    def __init__(self, worker_indices, initial_limit, min_limit=1, window=None):
+        self.live_workers = sorted(worker_indices)
+        self.max_limit = len(self.live_workers)
+        self.min_limit = min(min_limit, self.max_limit)
+        self.limit = max(self.min_limit, min(initial_limit, self.max_limit))
+        self.window = window or config.ADAPTIVE_WINDOW
+        self._samples = deque(maxlen=self.window)
+        self._since_decision = 0
+        self._baseline = None
+        self._cond = threading.Condition()
+
+    @property
+    def fixed(self):
+        return self.min_limit == self.max_limit
+
+    def is_active(self, index):
+        with self._cond:
+            return self._is_active_locked(index)
+
+    def _is_active_locked(self, index):
+        return index in self.live_workers and self.live_workers.index(index) < self.limit
+
+    def wait_for_turn(self, index, has_work):
+        """
+        Blocks while this worker is throttled. Returns False once there is no
+        work left, True when the worker may take its next item.
+        """
+        with self._cond:
+            while has_work() and not self._is_active_locked(index):
+                self._cond.wait(timeout=1)
+            return has_work()
+
+    def retire(self, index):
+        """Removes a worker that can no longer run (e.g. its browser failed to start)."""
+        with self._cond:
+            if index in self.live_workers:
+                self.live_workers.remove(index)
+                self.max_limit = len(self.live_workers)
+                self.limit = min(self.limit, self.max_limit)
+            self._cond.notify_all()
+
+    def wake_all(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def record(self, sample):
+        """Feeds a scraper timing sample (see `LietaScraper._record_timing`)."""
+        if self.fixed:
+            return
+        latency = sample.get("chart_load_seconds")
+        # Other failures (e.g. an unknown ticker) say nothing about backend load.
+        timed_out = sample.get("timeouts", 0) > 0
+        with self._cond:
+            self._samples.append((latency, timed_out))
+            self._since_decision += 1
+            if self._since_decision >= self.window:
+                self._decide_locked()
+
+    def _decide_locked(self):
+        self._since_decision = 0
+        latencies = [latency for latency, _ in self._samples if latency is not None]
+        timeout_rate = sum(1 for _, timed_out in self._samples if timed_out) / len(self._samples)
+        median = statistics.median(latencies) if latencies else None
+
+        previous = self.limit
+        congested = timeout_rate > config.ADAPTIVE_TIMEOUT_RATE or (
+            median is not None and self._baseline is not None
+            and median > self._baseline * config.ADAPTIVE_LATENCY_TOLERANCE
+        )
+        # Updated after the decision: one slow window backs off, a lasting change
+        # of the backend's speed moves the baseline within a few windows.
+        if median is not None and timeout_rate == 0:
+            alpha = config.ADAPTIVE_BASELINE_ALPHA
+            self._baseline = median if self._baseline is None else alpha * median + (1 - alpha) * self._baseline
+        if congested:
+            self.limit = max(self.min_limit, int(self.limit * config.ADAPTIVE_DECREASE_FACTOR))
+            reason = "後端變慢或逾時增加"
+        elif timeout_rate == 0 and self.limit < self.max_limit:
+            self.limit += 1
+            reason = "延遲穩定"
+        else:
+            return
+
+        if self.limit != previous:
+            median_text = f"{median:.1f} 秒" if median is not None else "無"
+            baseline_text = f"{self._baseline:.1f} 秒" if self._baseline is not None else "無"
+            logger.info(
+                f"並行控制: {reason}，工作視窗數 {previous} -> {self.limit} "
+                f"(延遲中位數 {median_text}，基準 {baseline_text}，逾時率 {timeout_rate:.0%})",
+                extra={"data": {
+                    "event": "concurrency_decision",
+                    "previous_limit": previous,
+                    "limit": self.limit,
+                    "median_latency": median,
+                    "baseline_latency": self._baseline,
+                    "timeout_rate": round(timeout_rate, 3),
+                }}
+            )
+            self._cond.notify_all()
@@ -12,30 +12,57 @@ else:
 
 # --- Chrome and Selenium Settings ---
 CHROME_EXECUTABLE_PATH = None # Set to a specific path if auto-detection fails
-# A list of ports to allow for concurrent Chrome instances.
-REMOTE_DEBUGGING_PORTS = [9222, 9223, 9224, 9225]
+# Extra command-line switches for launched Chrome instances (e.g. "--headless=new" on a server).
+CHROME_EXTRA_ARGS = []
+# Port of the primary Chrome instance (the one the user logs in with).
+# Additional workers get free ports allocated at launch.
+PRIMARY_DEBUGGING_PORT = 9222
 SELENIUM_TIMEOUT = 10 # seconds
+# Longest wait, after opening the platform page, for a logged-out session to be
+# redirected away; a logged-in page is recognised as soon as the model selector shows.
+LOGIN_CHECK_TIMEOUT = 3
 
-def get_chrome_user_data_dir(port: int) -> str:
+# --- Worker Count Settings ---
+# Hard upper bound on concurrent Chrome workers, whatever the machine offers.
+MAX_WORKERS = 12
+# Memory budget per Chrome worker used when sizing the pool automatically.
+MEMORY_PER_WORKER_MB = 1024
+
+def get_chrome_user_data_dir(worker_index: int) -> str:
     """
-    Generates a unique user data directory path for a given Chrome debugging port.
-    - Port 9222 (the default) uses 'automation_profile'.
-    - Subsequent ports (9223, 9224, ...) use 'automation_profile_2', '_3', etc.
+    Generates a unique user data directory path for a given worker.
+    - Worker 0 (the primary instance) uses 'automation_profile'.
+    - Subsequent workers (1, 2, ...) use 'automation_profile_2', '_3', etc.
     """
-    if port == 9222:
+    if worker_index == 0:
         profile_name = "automation_profile"
     else:
-        # Calculate the suffix based on the port number offset from the base port
-        suffix = port - 9222 + 1
-        profile_name = f"automation_profile_{suffix}"
+        profile_name = f"automation_profile_{worker_index + 1}"
         
     return os.path.join(BASE_DIR, profile_name)
 
 
 # --- Application Settings ---
 TASK_NAME = "LietaAutomatorDailyRun" # The name for the Windows Task Scheduler
-LIETA_PLATFORM_URL = "https://www.lietaresearch.com/"
-LIETA_AUTOMATION_URL = "https://www.lietaresearch.com/platform"
+# Models offered by the platform's model selector, as it names them.
+MODELS = ["Gamma", "Term", "Smile", "TV Code"]
+# Schedule backend: "schtasks", "systemd" or "cron"; None picks one for the OS.
+SCHEDULE_BACKEND = None
+# The LIETA_BASE_URL environment variable (or `--base-url`) points the scraper
+# somewhere else, e.g. at a local replay server (see replay.py).
+DEFAULT_LIETA_BASE_URL = "https://www.lietaresearch.com"
+LIETA_BASE_URL = os.environ.get("LIETA_BASE_URL", DEFAULT_LIETA_BASE_URL).rstrip("/")
+LIETA_PLATFORM_URL = LIETA_BASE_URL + "/"
+LIETA_AUTOMATION_URL = LIETA_BASE_URL + "/platform"
+
+def set_base_url(url: str):
+    """Points every Lieta URL at another origin for this process and the workers it starts."""
+    global LIETA_BASE_URL, LIETA_PLATFORM_URL, LIETA_AUTOMATION_URL
+    LIETA_BASE_URL = url.rstrip("/")
+    LIETA_PLATFORM_URL = LIETA_BASE_URL + "/"
+    LIETA_AUTOMATION_URL = LIETA_BASE_URL + "/platform"
+    os.environ["LIETA_BASE_URL"] = LIETA_BASE_URL
+
 # Define main temp download dir
 TEMP_DOWNLOAD_DIR_NAME = os.path.join(BASE_DIR, "temp_downloads")
 
@@ -46,3 +73,224 @@ def get_temp_download_path_for_port(port: int) -> str:
     """
     return os.path.join(TEMP_DOWNLOAD_DIR_NAME, str(port))
 
+# Hidden folder inside the destination used when downloading straight to the
+# destination volume, so finalising a file is a same-filesystem rename.
+STAGING_DIR_NAME = ".staging"
+
+def get_staging_download_path(destination_path: str, port: int) -> str:
+    """
+    Generates the per-port staging directory that lives on the same volume
+    as the destination folder.
+    """
+    return os.path.join(destination_path, STAGING_DIR_NAME, str(port))
+
+def get_download_path(destination_path: str, port: int, direct_download: bool) -> str:
+    """Picks the download directory for a port based on the direct-download mode."""
+    if direct_download:
+        return get_staging_download_path(destination_path, port)
+    return get_temp_download_path_for_port(port)
+
+
+# --- Log File Settings ---
+# Each launch writes log_<timestamp>.jsonl in BASE_DIR. The file rolls over
+# (to log_<timestamp>.jsonl.1.gz, ...) when it reaches LOG_MAX_BYTES or has
+# been open for LOG_MAX_AGE_HOURS, e.g. in a long-running daemon.
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_MAX_AGE_HOURS = 24
+LOG_BACKUP_COUNT = 5
+# Log files of earlier launches are compressed once idle this long and deleted after LOG_RETENTION_DAYS.
+LOG_RETENTION_DAYS = 30
+
+# --- GUI Log View Settings ---
+# Lines kept in the log view; older lines are dropped (the log file keeps everything).
+GUI_LOG_MAX_LINES = 2000
+# How often the log view drains the log queue, in milliseconds.
+GUI_LOG_POLL_MS = 100
+# Lines below WARNING rendered per poll; the rest are counted as suppressed.
+GUI_LOG_MAX_LINES_PER_POLL = 200
+
+# --- Post-processing Pipeline Settings ---
+# Finalised downloads are moved, hashed and indexed off the browser threads.
+PIPELINE_WORKERS = 2
+# Maximum number of jobs waiting in the pipeline before scrapers are blocked.
+PIPELINE_MAX_PENDING = 16
+# JSONL index of every saved output, written at the root of the destination folder.
+OUTPUT_INDEX_FILENAME = "index.jsonl"
+# Number of buffered TV Code results that triggers a checkpoint write.
+TV_CODE_FLUSH_EVERY = 10
+# Folder (in the destination) for the per-run manifests of new and changed outputs,
+# and the copy of the latest manifest that downstream jobs read.
+CHANGES_DIRNAME = "changes"
+CHANGES_LATEST_FILENAME = "latest_changes.json"
+
+# --- Run Planner Settings ---
+# Historical per-item timings used to balance work across ports.
+TIMING_HISTORY_FILE = os.path.join(BASE_DIR, "run_timings.json")
+# Weight of the newest sample in the moving averages.
+TIMING_HISTORY_ALPHA = 0.3
+# Seconds per ticker assumed for a model before any history exists.
+DEFAULT_MODEL_COSTS = {"Gamma": 45, "Term": 30, "Smile": 30, "TV Code": 15}
+DEFAULT_ITEM_COST = 30
+# Extra seconds a port spends opening the model selector for a new model.
+MODEL_SWITCH_COST = 8
+
+# --- Adaptive Concurrency (AIMD) Settings ---
+# Number of Chrome windows working at the start of a multi-window run.
+ADAPTIVE_INITIAL_WORKERS = 2
+# Item samples evaluated per decision.
+ADAPTIVE_WINDOW = 6
+# Share of items with a timeout in one window that triggers a back-off.
+ADAPTIVE_TIMEOUT_RATE = 0.2
+# Median latency above baseline * tolerance counts as congestion.
+ADAPTIVE_LATENCY_TOLERANCE = 1.5
+# Weight of each timeout-free window's median in the latency baseline (an EWMA), so
+# the baseline follows the backend instead of sticking to one unusually fast window.
+ADAPTIVE_BASELINE_ALPHA = 0.3
+# Multiplier applied to the worker limit on congestion.
+ADAPTIVE_DECREASE_FACTOR = 0.5
+
+# --- Worker Health Settings ---
+# Items between two health checks of a worker's browser.
+RECYCLE_CHECK_EVERY = 5
+# Restart a worker's Chrome when its processes use more than this (needs psutil).
+RECYCLE_RSS_MB = 3072
+# Replace a worker's tab when the page's JS heap grows beyond this.
+RECYCLE_JS_HEAP_MB = 768
+# Restart when recent chart-load latency exceeds the early latency by this factor.
+RECYCLE_LATENCY_RATIO = 2.0
+# Number of items in the early and recent latency windows.
+RECYCLE_LATENCY_WINDOW = 5
+# ...and only when its recent latency also exceeds the median of the other workers'
+# by this factor: a slowdown on every port is the backend's, handled by the AIMD controller.
+RECYCLE_PEER_LATENCY_RATIO = 1.5
+# An item interrupted by a browser crash is re-queued until it has been tried this often.
+MAX_ITEM_ATTEMPTS = 3
+
+# --- Daemon Settings ---
+# Local address of the job API served by `run.py --daemon`. Only bind to loopback.
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = 8765
+# Written by the daemon at start-up (readable by the current user only) and sent by
+# local clients as a bearer token. Every endpoint but GET /metrics requires it.
+DAEMON_TOKEN_FILE = os.path.join(BASE_DIR, "daemon_token")
+# Seconds a client waits when probing whether the daemon is running.
+DAEMON_CONNECT_TIMEOUT = 2
+# Finished jobs kept in memory for status queries.
+DAEMON_JOB_HISTORY = 50
+# Events (log lines, progress) buffered per running job for event-stream readers; a
+# reader that falls further behind skips the oldest. A finished job keeps only its last
+# DAEMON_FINISHED_JOB_EVENTS events.
+DAEMON_JOB_MAX_EVENTS = 2000
+DAEMON_FINISHED_JOB_EVENTS = 100
+
+# --- Replication Settings ---
+# Outputs are copied to `replica_destination` in the background. Files not copied
+# yet are kept in this SQLite outbox, so replication resumes after an interruption.
+REPLICATION_OUTBOX_FILE = os.path.join(BASE_DIR, "replication_outbox.sqlite3")
+# Parallel copies, and files leased from the outbox per batch.
+REPLICATION_WORKERS = 4
+REPLICATION_BATCH_SIZE = 50
+# Seconds between outbox checks while idle, and before a leased file is copied again.
+REPLICATION_POLL_SECONDS = 2
+REPLICATION_LEASE_SECONDS = 600
+# Failed copies are retried after 30 s, 60 s, 120 s, ... up to this many attempts.
+REPLICATION_RETRY_SECONDS = 30
+REPLICATION_MAX_ATTEMPTS = 6
+# Seconds a finished run waits for the outbox to empty; the rest resumes with the next run or `--replicate`.
+REPLICATION_DRAIN_SECONDS = 300
+
+# --- Distributed Execution Settings ---
+# SQLite file shared by the coordinator and its worker processes.
+WORK_QUEUE_FILE = os.path.join(BASE_DIR, "work_queue.sqlite3")
+# Seconds a worker may hold an item before it is handed to another worker.
+QUEUE_LEASE_SECONDS = 600
+# Seconds between two progress checks of the coordinator.
+COORDINATOR_POLL_SECONDS = 5
+# Times the coordinator restarts a crashed worker process.
+MAX_WORKER_RESTARTS = 3
+
+# --- Deadline Settings ---
+# Finished items between two projections of the run's completion time.
+DEADLINE_CHECK_EVERY = 5
+# Ticker file listing the items a run deferred to meet its deadline, written to the destination.
+DEFERRED_TICKERS_FILENAME = "deferred_tickers_{date}.txt"
+
+# --- Market Calendar Settings ---
+# Optional extra closures per exchange: {"NYSE": ["2026-12-24"], "TWSE": [...]}.
+MARKET_HOLIDAYS_FILE = os.path.join(BASE_DIR, "market_holidays.json")
+
+# --- Record & Replay Settings ---
+# Port of the local replay server (`--replay`).
+REPLAY_PORT = 8770
+# Request/response headers whose values are removed from recordings.
+RECORDING_SCRUBBED_HEADERS = {
+    "authorization", "cookie", "set-cookie", "proxy-authorization",
+    "x-csrf-token", "x-xsrf-token", "x-api-key", "x-auth-token",
+}
+# Query parameters and JSON keys whose values are removed (matched as substrings, case-insensitive).
+RECORDING_SCRUBBED_FIELDS = ("token", "password", "secret", "session", "auth", "apikey", "api_key", "signature", "email")
+# URL query and form parameters scrubbed by exact name (OAuth authorization codes).
+RECORDING_SCRUBBED_PARAMS = ("code",)
+
+# --- Soak Test Settings ---
+# How often `--soak` samples memory, in seconds.
+SOAK_SAMPLE_SECONDS = 10
+# Tickers processed before the baseline is taken (browser start-up, caches, history).
+SOAK_WARMUP_TICKERS = 100
+# Largest allowed memory growth per 1,000 tickers, in MB; over budget fails the soak test.
+SOAK_BUDGET_PYTHON_HEAP_MB = 10
+SOAK_BUDGET_PYTHON_RSS_MB = 50
+SOAK_BUDGET_CHROME_RSS_MB = 300
+
+# --- Log Analytics Settings ---
+# Per-file summaries of already analysed log files (`--analyze-logs`).
+LOG_ANALYTICS_CACHE_FILE = os.path.join(BASE_DIR, "log_analytics_cache.json")
+# Minimum samples for a ticker to appear in the slowest-ticker ranking.
+LOG_ANALYTICS_MIN_SAMPLES = 3
+
+# --- Start-up Budget Settings ---
+# Import time allowed for what the GUI loads before its window appears (`--startup-benchmark`).
+STARTUP_IMPORT_BUDGET_MS = 300
+# Modules that must not be imported at start-up; they are loaded on first use.
+STARTUP_FORBIDDEN_IMPORTS = ("selenium", "PIL", "sqlite3", "http.server", "urllib.request", "psutil", "ctypes")
+
+# --- Progress Dashboard Settings ---
+# How often the GUI progress panel refreshes, in milliseconds (independent of the event rate).
+PROGRESS_REFRESH_MS = 500
+# Recent items used for the throughput/ETA moving average.
+PROGRESS_RATE_WINDOW = 20
+# Recent chart loads used for the rolling p50/p95 latency.
+PROGRESS_LATENCY_WINDOW = 100
+
+# --- Metrics Settings ---
+# `--daemon` serves the metrics at http://DAEMON_HOST:DAEMON_PORT/metrics; one-shot runs
+# (`--run-automated`, `--coordinator`) write them here at the end, for node_exporter's
+# textfile collector. Point LIETA_METRICS_TEXTFILE at the collector's directory.
+METRICS_TEXTFILE_PATH = os.environ.get("LIETA_METRICS_TEXTFILE", os.path.join(BASE_DIR, "metrics", "lieta_automator.prom"))
+# Upper bounds (seconds) of the phase and item duration histogram buckets.
+METRICS_SECONDS_BUCKETS = (0.5, 1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300)
+# Minimum seconds between two Chrome RSS measurements of the same port.
+METRICS_RSS_SAMPLE_SECONDS = 30
+
+# --- Profiling Settings ---
+# Where `--profile` writes trace_<time>.json (Chrome trace-event format, open in
+# https://ui.perfetto.dev) and, with `--profile-sample`, the hot-function report.
+PROFILE_DIR = os.path.join(BASE_DIR, "profiles")
+# Spans kept per run; later spans are counted but dropped.
+PROFILE_MAX_EVENTS = 1_000_000
+# Interval of the `--profile-sample` stack sampler, in milliseconds.
+PROFILE_SAMPLE_INTERVAL_MS = 10
+# Functions listed in each ranking of the hot-function report.
+PROFILE_REPORT_TOP = 25
+
+# --- CDP Engine Settings ---
+# `scraper_engine: "cdp"` drives Chrome over the DevTools protocol (needs `websockets`).
+# Tabs the CDP engine works with in parallel per model; `cdp_tabs` in the settings overrides it.
+CDP_TABS_PER_BROWSER = 4
+# Seconds to wait for a DevTools command, a page load and Chrome's DevTools endpoint.
+CDP_COMMAND_TIMEOUT = 30
+CDP_NAVIGATION_TIMEOUT = 30
+CDP_CONNECT_TIMEOUT = 30
+# Seconds to wait for a chart (or TV Code) after submitting, and for a download to finish.
+CDP_CHART_TIMEOUT = 90
+CDP_DOWNLOAD_TIMEOUT = 90
@@ -0,0 +1,457 @@
+import hmac
+import itertools
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import config, settings
+from .logger import logger
+from .metrics import OPENMETRICS_CONTENT_TYPE, PROMETHEUS_CONTENT_TYPE, RunMetrics, wants_openmetrics
+from .resources import resolve_worker_count
+from .runner import AutomationRun, RunResult, WorkerPool
+from .tickers import normalize
+
+# Job lifecycle states.
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Name prefix of the API's request threads.
+_HTTP_THREAD_PREFIX = "daemon-http"
+
+
+class Job:
+    """A ticker list + models + destination submitted to the daemon."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, tickers, models, destination_path):
+        self.id = f"{time.strftime('%Y%m%d%H%M%S')}-{next(self._ids)}"
+        self.tickers = tickers
+        self.models = models
+        self.destination_path = destination_path
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        # The most recent events; `_first_offset` is the stream offset of events[0].
+        self.events = deque(maxlen=config.DAEMON_JOB_MAX_EVENTS)
+        self._first_offset = 0
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def _append_locked(self, event):
+        if len(self.events) == self.events.maxlen:
+            self._first_offset += 1
+        self.events.append(event)
+
+    @property
+    def end_offset(self):
+        return self._first_offset + len(self.events)
+
+    def add_event(self, event):
+        with self._cond:
+            self._append_locked(event)
+            self._cond.notify_all()
+
+    def set_status(self, status, result=None, error=None):
+        with self._cond:
+            self.status = status
+            self.result = result
+            self.error = error
+            self._append_locked({"type": "status", "status": status, **self._result_fields()})
+            if self.finished:
+                # Late readers only need the end of the job.
+                kept = list(self.events)[-config.DAEMON_FINISHED_JOB_EVENTS:]
+                self._first_offset = self.end_offset - len(kept)
+                self.events = deque(kept, maxlen=config.DAEMON_JOB_MAX_EVENTS)
+            self._cond.notify_all()
+
+    def events_since(self, offset, timeout):
+        """
+        Waits up to `timeout` for events after stream offset `offset`;
+        returns (events, next offset, finished). Events already dropped
+        from the buffer are skipped.
+        """
+        with self._cond:
+            if offset >= self.end_offset and not self.finished:
+                self._cond.wait(timeout)
+            start = max(offset - self._first_offset, 0)
+            return list(self.events)[start:], self.end_offset, self.finished
+
+    def _result_fields(self):
+        fields = {}
+        if self.result is not None:
+            fields["result"] = self.result
+        if self.error is not None:
+            fields["error"] = self.error
+        return fields
+
+    def to_dict(self):
+        with self._cond:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "tickers": len(self.tickers),
+                "models": self.models,
+                "destination_path": self.destination_path,
+                **self._result_fields(),
+            }
+
+
+class _JobLogHandler(logging.Handler):
+    """
+    Copies the log records of a running job into the job's event stream:
+    those of the job thread and of the threads it starts (workers,
+    pipeline, replication), not those of the HTTP server's threads or of
+    any other thread that was already running.
+    """
+
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+        self.job_thread = threading.get_ident()
+        self.other_threads = {thread.ident for thread in threading.enumerate()} - {self.job_thread}
+
+    def emit(self, record):
+        if record.thread in self.other_threads or (record.threadName or "").startswith(_HTTP_THREAD_PREFIX):
+            return
+        event = {"type": "log", "level": record.levelname, "message": record.getMessage()}
+        data = getattr(record, "data", None)
+        if data is not None:
+            event["data"] = data
+        self.job.add_event(event)
+
+
+class AutomationDaemon:
+    """
+    Keeps a `WorkerPool` of logged-in Chrome workers warm and runs submitted
+    jobs on it one after the other, so a job does not pay for Chrome launch,
+    WebDriver connection and the login check.
+    """
+
+    def __init__(self, host=None, port=None):
+        self.host = host or config.DAEMON_HOST
+        self.port = port or config.DAEMON_PORT
+        user_settings = settings.load_settings()
+        worker_count = resolve_worker_count(user_settings) if user_settings.get("enable_multi_window", False) else 1
+        self.pool = WorkerPool(worker_count, on_login_required=self._log_login_required)
+        self.jobs = OrderedDict()
+        # Accumulates over every job; served at GET /metrics.
+        self.metrics = RunMetrics()
+        self._pending = deque()
+        self._lock = threading.Condition()
+        self._server = None
+        self.token = None
+
+    def serve_forever(self):
+        logger.info(f"--- 背景服務啟動 (http://{self.host}:{self.port}，{len(self.pool)} 個工作視窗) ---")
+        self.pool.prepare_profiles()
+        # Only the workers active at the start of a run are launched ahead of time;
+        # the others start when the concurrency controller first needs them.
+        user_settings = settings.load_settings()
+        warm = len(self.pool) if not user_settings.get("adaptive_concurrency", True) else min(config.ADAPTIVE_INITIAL_WORKERS, len(self.pool))
+        self.pool.warm_up(warm)
+
+        threading.Thread(target=self._job_loop, daemon=True).start()
+        self.token = _write_token()
+        self._server = ThreadingHTTPServer((self.host, self.port), _make_handler(self))
+        self._server.daemon_threads = True
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            _remove_token(self.token)
+            self.pool.shutdown()
+            logger.info("--- 背景服務已停止 ---")
+
+    def shutdown(self):
+        if self._server:
+            # `shutdown` blocks until serve_forever returns, so it must not run on the server thread.
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+    def submit(self, payload):
+        """Validates a job request and queues it. Raises ValueError on bad input."""
+        tickers = payload.get("tickers")
+        models = payload.get("models")
+        destination_path = payload.get("destination_path")
+        if not isinstance(tickers, list) or not tickers:
+            raise ValueError("tickers 必須為非空的清單。")
+        try:
+            specs = normalize(tickers)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"tickers 格式錯誤: {e}")
+        if not isinstance(models, list) or not models or not all(isinstance(m, str) for m in models):
+            raise ValueError("models 必須為非空的字串清單。")
+        if not isinstance(destination_path, str) or not os.path.isdir(destination_path):
+            raise ValueError(f"儲存路徑不存在: {destination_path}")
+
+        job = Job(specs, models, destination_path)
+        with self._lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > config.DAEMON_JOB_HISTORY:
+                oldest_id, oldest = next(iter(self.jobs.items()))
+                if not oldest.finished:
+                    break
+                del self.jobs[oldest_id]
+            self._pending.append(job)
+            self._lock.notify_all()
+        logger.info(f"已接收工作 {job.id}: {len(job.tickers)} 個 Tickers，模型 {', '.join(models)}。")
+        return job
+
+    def _job_loop(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._lock.wait()
+                job = self._pending.popleft()
+            self._run_job(job)
+
+    def _run_job(self, job):
+        handler = _JobLogHandler(job)
+        logging.getLogger().addHandler(handler)
+        job.set_status(RUNNING)
+        try:
+            run = AutomationRun(
+                job.tickers, job.models, job.destination_path, settings.load_settings(), pool=self.pool,
+                on_progress=lambda event: self._on_progress(job, event)
+            )
+            result = run.execute()
+            self.metrics.record_result(result)
+            job.set_status(DONE, result=result.__dict__)
+            logger.info(f"工作 {job.id} 完成: 總計 {result.total_tasks}，失敗 {len(result.failed_tickers)}。")
+        except Exception as e:
+            logger.error(f"工作 {job.id} 執行失敗: {e}", exc_info=True)
+            self.metrics.record_result(None)
+            job.set_status(FAILED, error=str(e))
+        finally:
+            logging.getLogger().removeHandler(handler)
+
+    def _on_progress(self, job, event):
+        self.metrics.handle(event)
+        job.add_event({"type": "progress", "data": event})
+
+    def _log_login_required(self):
+        logger.error("主要 Chrome 尚未登入 Lieta Research。請在該視窗登入後重新送出工作。")
+
+
+def _write_token():
+    """Writes a new API token to `DAEMON_TOKEN_FILE`, readable by the current user only."""
+    token = secrets.token_urlsafe(32)
+    temp_path = f"{config.DAEMON_TOKEN_FILE}.{os.getpid()}.tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token)
+    os.replace(temp_path, config.DAEMON_TOKEN_FILE)
+    return token
+
+
+def _remove_token(token):
+    # Another daemon may have replaced the file since; only remove our own token.
+    if token is not None and _read_token() == token:
+        try:
+            os.remove(config.DAEMON_TOKEN_FILE)
+        except OSError:
+            pass
+
+
+def _read_token():
+    try:
+        with open(config.DAEMON_TOKEN_FILE, "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _make_handler(daemon):
+    class _RequestHandler(BaseHTTPRequestHandler):
+        def setup(self):
+            # Named so job log handlers can tell request threads from the job's.
+            threading.current_thread().name = f"{_HTTP_THREAD_PREFIX}-{threading.get_ident()}"
+            super().setup()
+
+        def log_message(self, format, *args):
+            pass # Requests are not worth a line each in the application log.
+
+        def _send_json(self, status, body):
+            payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _send_metrics(self):
+            openmetrics = wants_openmetrics(self.headers.get("Accept"))
+            payload = daemon.metrics.render(openmetrics=openmetrics).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _authorized(self, public=False):
+            """
+            Rejects requests made by a web page (they carry an Origin header)
+            and, unless `public`, requests without the daemon's token. Sends
+            the error response and returns False when rejected.
+            """
+            if self.headers.get("Origin") is not None:
+                self._send_json(403, {"error": "不接受來自瀏覽器網頁的請求"})
+                return False
+            if public:
+                return True
+            scheme, _, token = (self.headers.get("Authorization") or "").partition(" ")
+            if scheme.lower() != "bearer" or not daemon.token or not hmac.compare_digest(token.strip(), daemon.token):
+                self._send_json(401, {"error": "缺少或錯誤的存取權杖"})
+                return False
+            return True
+
+        def _job_or_404(self, job_id):
+            job = daemon.jobs.get(job_id)
+            if job is None:
+                self._send_json(404, {"error": f"找不到工作 {job_id}"})
+            return job
+
+        def do_GET(self):
+            parts = [p for p in self.path.split("?")[0].split("/") if p]
+            # Metrics stay readable by scrapers, which have no token.
+            if not self._authorized(public=parts == ["metrics"]):
+                return
+            if parts == ["health"]:
+                self._send_json(200, {"status": "ok", "workers": len(daemon.pool)})
+            elif parts == ["metrics"]:
+                self._send_metrics()
+            elif parts == ["jobs"]:
+                self._send_json(200, [job.to_dict() for job in list(daemon.jobs.values())])
+            elif len(parts) == 2 and parts[0] == "jobs":
+                job = self._job_or_404(parts[1])
+                if job:
+                    self._send_json(200, job.to_dict())
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events":
+                job = self._job_or_404(parts[1])
+                if job:
+                    self._stream_events(job)
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            parts = [p for p in self.path.split("?")[0].split("/") if p]
+            if not self._authorized():
+                return
+            # A page can only send JSON after a CORS preflight, which this server never answers.
+            if (self.headers.get("Content-Type") or "").split(";")[0].strip().lower() != "application/json":
+                self._send_json(415, {"error": "Content-Type 必須為 application/json"})
+                return
+            if parts == ["jobs"]:
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                    job = daemon.submit(payload)
+                except (ValueError, AttributeError) as e:
+                    self._send_json(400, {"error": str(e)})
+                    return
+                self._send_json(202, job.to_dict())
+            elif parts == ["shutdown"]:
+                self._send_json(200, {"status": "stopping"})
+                daemon.shutdown()
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def _stream_events(self, job):
+            """Streams the job's events as JSON lines until it finishes."""
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.end_headers()
+            offset = 0
+            try:
+                while True:
+                    events, offset, finished = job.events_since(offset, timeout=15)
+                    for event in events:
+                        self.wfile.write((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+                    if not events:
+                        self.wfile.write(b"{\"type\": \"heartbeat\"}\n")
+                    self.wfile.flush()
+                    if finished and offset >= job.end_offset:
+                        break
+            except (BrokenPipeError, ConnectionResetError):
+                pass # The client went away; the job keeps running.
+
+    return _RequestHandler
+
+
+# --- Client helpers (used by the GUI, the scheduled task and `--submit`) ---
+
+def _url(path):
+    return f"http://{config.DAEMON_HOST}:{config.DAEMON_PORT}{path}"
+
+
+def _request(path, body=None):
+    headers = {"Authorization": f"Bearer {_read_token() or ''}"}
+    if body is not None:
+        headers["Content-Type"] = "application/json"
+    return urllib.request.Request(_url(path), data=body, headers=headers)
+
+
+def is_daemon_running():
+    if _read_token() is None:
+        return False
+    try:
+        with urllib.request.urlopen(_request("/health"), timeout=config.DAEMON_CONNECT_TIMEOUT) as response:
+            return response.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+def submit_job(tickers, models, destination_path):
+    """Queues a job on the daemon and returns its id. Raises RuntimeError if it is rejected."""
+    body = json.dumps({
+        "tickers": [spec.to_dict() for spec in normalize(tickers)],
+        "models": models,
+        "destination_path": destination_path,
+    }).encode("utf-8")
+    request = _request("/jobs", body)
+    try:
+        with urllib.request.urlopen(request, timeout=config.DAEMON_CONNECT_TIMEOUT * 5) as response:
+            return json.loads(response.read())["id"]
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.loads(e.read() or b"{}").get("error", str(e))) from e
+
+
+def stream_job_events(job_id):
+    """Yields the job's events (dicts) as the daemon reports them."""
+    with urllib.request.urlopen(_request(f"/jobs/{job_id}/events")) as response:
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+
+
+def run_job(tickers, models, destination_path, on_progress=None):
+    """
+    Submits a job, relays the daemon's log lines to the local logger (and
+    its progress events to `on_progress`) and returns the job's
+    `RunResult`. Raises RuntimeError if the job fails.
+    """
+    job_id = submit_job(tickers, models, destination_path)
+    logger.info(f"已將工作送交背景服務 (工作 {job_id})。")
+    for event in stream_job_events(job_id):
+        if event["type"] == "log":
+            logger.log(logging.getLevelName(event["level"]), f"[背景服務] {event['message']}")
+        elif event["type"] == "progress":
+            if on_progress is not None:
+                on_progress(event["data"])
+        elif event["type"] == "status" and event["status"] == DONE:
+            return RunResult(**event["result"])
+        elif event["type"] == "status" and event["status"] == FAILED:
+            raise RuntimeError(event.get("error", "背景服務工作失敗"))
+    raise RuntimeError("與背景服務的連線中斷。")
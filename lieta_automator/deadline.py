@@ -0,0 +1,93 @@
+import threading
+from datetime import datetime, timedelta
+
+from . import config
+from .logger import logger
+
+
+def parse_deadline(value, now=None):
+    """
+    Turns a "HH:MM" setting into the next such moment after `now`, so a run
+    started at 17:00 with a deadline of "08:30" must finish by 08:30 the
+    next morning. Returns None when no deadline is configured.
+    """
+    if not value:
+        return None
+    now = now or datetime.now()
+    try:
+        hour, minute = (int(part) for part in value.split(":"))
+        deadline = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    except ValueError:
+        logger.warning(f"完成期限格式錯誤 (應為 HH:MM): {value}，將不限制完成時間。")
+        return None
+    if deadline <= now:
+        deadline += timedelta(days=1)
+    return deadline
+
+
+class DeadlineGuard:
+    """
+    Keeps a run within its deadline.
+
+    Workers report each finished item. The guard compares the actual seconds
+    with the planner's estimates to get the live speed of the backend, and
+    every `DEADLINE_CHECK_EVERY` items projects the finish time of the work
+    still queued with the current number of active workers. When that lands
+    after the deadline, the lowest-priority items are deferred (removed
+    from the queue) until the projection fits. Deferred items are kept in
+    `deferred` so the run can report them.
+    """
+
+    def __init__(self, deadline, work_queue, active_workers):
+        self.deadline = deadline
+        self.work_queue = work_queue
+        # Callable returning how many workers are currently processing items.
+        self.active_workers = active_workers
+        self.deferred = []
+        self._estimated = 0.0
+        self._actual = 0.0
+        self._since_check = 0
+        self._lock = threading.Lock()
+
+    def record(self, item, sample):
+        if not sample or not sample.get("seconds"):
+            return
+        with self._lock:
+            self._estimated += item.cost
+            self._actual += sample["seconds"]
+            self._since_check += 1
+            if self._since_check < config.DEADLINE_CHECK_EVERY:
+                return
+            self._since_check = 0
+            self._check_locked()
+
+    def _check_locked(self):
+        speed = self._actual / self._estimated if self._estimated > 0 else 1.0
+        workers = max(1, self.active_workers())
+        remaining = self.work_queue.remaining_cost()
+        eta_seconds = remaining * speed / workers
+        seconds_left = (self.deadline - datetime.now()).total_seconds()
+        eta = datetime.now() + timedelta(seconds=eta_seconds)
+        logger.info(
+            f"預估完成時間 {eta:%H:%M} (期限 {self.deadline:%H:%M}，實際速度為預估的 {speed:.2f} 倍，{workers} 個工作視窗)。",
+            extra={"data": {
+                "event": "run_eta",
+                "eta": eta.isoformat(timespec="seconds"),
+                "deadline": self.deadline.isoformat(timespec="seconds"),
+                "remaining_estimated_seconds": round(remaining, 1),
+                "speed_ratio": round(speed, 3),
+                "workers": workers,
+            }}
+        )
+        if eta_seconds <= seconds_left:
+            return
+
+        # Capacity left before the deadline, in the planner's (estimated) seconds.
+        capacity = max(0.0, seconds_left) * workers / speed
+        removed = self.work_queue.defer_until_fits(capacity)
+        if removed:
+            self.deferred.extend(removed)
+            logger.warning(
+                f"為趕上完成期限，延後 {len(removed)} 個低優先項目: " + ", ".join(item.label for item in removed),
+                extra={"data": {"event": "items_deferred", "items": [item.label for item in removed]}}
+            )
@@ -0,0 +1,274 @@
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from . import chrome_launcher, config, tracing
+from .changes import ChangeDetector
+from .logger import logger
+from .pipeline import PostProcessingPipeline, reset_download_dir
+from .planner import TimingHistory, plan_run
+from .resources import resolve_worker_count
+from .runner import RunResult, WorkerPool, finish_replication, start_replicator
+from .supervisor import WorkerSupervisor, latency_ratio
+from .tvcode import TvCodeCollector, TvCodeSink
+from .workqueue import SQLiteWorkQueue
+
+
+def _worker_command(queue_path, run_id, slot):
+    if getattr(sys, 'frozen', False):
+        command = [sys.executable]
+    else:
+        command = [sys.executable, "-m", "lieta_automator.main"]
+    command += [
+        "--worker", "--queue", queue_path, "--run-id", str(run_id),
+        "--worker-index", str(slot['index']), "--port", str(slot['port']),
+    ]
+    if tracing.enabled():
+        # Each worker process writes its own trace next to the coordinator's.
+        command.append("--profile-sample" if tracing.sampling else "--profile")
+    return command
+
+
+class Coordinator:
+    """
+    Runs a ticker list with one OS process per Chrome worker.
+
+    The (model, ticker) items go into a `SQLiteWorkQueue`; the worker
+    processes (`run.py --worker`) pull items from it and report the results
+    back. A worker that crashes is restarted, and one that holds an item
+    past its lease is treated as hung and killed; either way its item is
+    picked up again. TV Code files and the timing history are written once
+    at the end, from the results collected in the queue.
+    """
+
+    def __init__(self, tickers, models, destination_path, user_settings, worker_count=None, queue_path=None,
+                 on_samples=None):
+        self.tickers = tickers
+        self.models = models
+        self.destination_path = destination_path
+        self.user_settings = user_settings
+        self.worker_count = worker_count or resolve_worker_count(user_settings)
+        self.queue_path = os.path.abspath(queue_path or config.WORK_QUEUE_FILE)
+        # Called with the timing samples of the finished items once the run ends (e.g. metrics.RunMetrics).
+        self.on_samples = on_samples
+
+    def execute(self):
+        logger.info(f"--- 自動化開始 (多程序模式，{self.worker_count} 個工作程序) ---")
+        slots = chrome_launcher.allocate_worker_slots(self.worker_count)
+        history = TimingHistory.load()
+        plan = plan_run(self.tickers, self.models, [slot['port'] for slot in slots], history)
+        items = [item for port_items in plan.assignments.values() for item in port_items]
+        queue = SQLiteWorkQueue(self.queue_path)
+        run_id = queue.create_run(items, self.destination_path, self.user_settings)
+        logger.info(f"已建立工作 #{run_id}: {len(items)} 項，佇列檔案 {self.queue_path}。")
+
+        for slot in slots:
+            chrome_launcher._sync_profile_if_new(slot['user_data_dir'])
+
+        changes = ChangeDetector(self.destination_path) if self.user_settings.get("detect_changes", True) else None
+        # The worker processes queue their outputs in the shared outbox; this process copies them.
+        replicator = start_replicator(self.destination_path, self.user_settings)
+        started = time.monotonic()
+        processes = {}
+        restarts = {slot['index']: 0 for slot in slots}
+        try:
+            for slot in slots:
+                processes[slot['index']] = self._spawn(run_id, slot)
+                time.sleep(1) # Stagger the launch slightly
+            self._monitor(queue, run_id, slots, processes, restarts)
+        finally:
+            self._stop(processes)
+
+        actual_makespan = time.monotonic() - started
+        tv_code_sink = self._write_tv_codes(queue, run_id, changes)
+        manifest_path = None
+        if changes is not None:
+            # The worker processes compared the charts and noted the result in the output index.
+            changes.record_index_entries()
+            manifest_path = changes.write_manifest()
+        if replicator is not None:
+            finish_replication(replicator, self.destination_path, tv_code_sink, manifest_path)
+        samples = queue.timings(run_id)
+        try:
+            history.record_samples(samples)
+            history.save()
+        except Exception as e:
+            logger.warning(f"無法更新歷史耗時紀錄: {e}")
+        if self.on_samples is not None:
+            self.on_samples(samples)
+        failed = queue.failed_labels(run_id)
+        queue.close()
+        return RunResult(len(items), failed, plan.predicted_makespan, actual_makespan)
+
+    def _spawn(self, run_id, slot):
+        command = _worker_command(self.queue_path, run_id, slot)
+        logger.info(f"[Port {slot['port']}] 啟動工作程序...")
+        return subprocess.Popen(command, cwd=config.BASE_DIR)
+
+    def _monitor(self, queue, run_id, slots, processes, restarts):
+        last_progress = None
+        while not queue.is_finished(run_id):
+            time.sleep(config.COORDINATOR_POLL_SECONDS)
+
+            # A lease that ran out means the worker is stuck inside a browser call.
+            stuck_pids = {int(worker.split(":")[1]) for worker in queue.expired_workers(run_id) if worker}
+            for process in processes.values():
+                if process.pid in stuck_pids and process.poll() is None:
+                    logger.warning(f"工作程序 {process.pid} 超過租約時間仍未回報，將強制結束。")
+                    process.kill()
+
+            for slot in slots:
+                process = processes[slot['index']]
+                if process.poll() is None or queue.is_finished(run_id):
+                    continue
+                if restarts[slot['index']] >= config.MAX_WORKER_RESTARTS:
+                    continue
+                restarts[slot['index']] += 1
+                logger.warning(
+                    f"[Port {slot['port']}] 工作程序已結束 (代碼 {process.returncode})，"
+                    f"第 {restarts[slot['index']]} 次重新啟動。"
+                )
+                processes[slot['index']] = self._spawn(run_id, slot)
+
+            if all(process.poll() is not None for process in processes.values()):
+                logger.error("所有工作程序皆已結束且無法再重新啟動，剩餘項目將記為失敗。")
+                break
+
+            progress = queue.progress(run_id)
+            if progress != last_progress:
+                logger.info(
+                    f"進度: 完成 {progress['done']}，失敗 {progress['failed']}，"
+                    f"處理中 {progress['leased']}，等待中 {progress['pending']}。"
+                )
+                last_progress = progress
+
+    def _stop(self, processes):
+        # Workers exit by themselves once the queue is empty; give them time to close their browsers.
+        deadline = time.monotonic() + 30
+        for process in processes.values():
+            try:
+                process.wait(timeout=max(0.1, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.terminate()
+
+    def _write_tv_codes(self, queue, run_id, changes=None):
+        codes = queue.results(run_id, "TV Code")
+        if not codes:
+            return None
+        sink = TvCodeSink(self.destination_path, changes=changes)
+        for ticker, code_text in codes:
+            sink.add(ticker, code_text)
+        try:
+            sink.flush()
+        except Exception as e:
+            logger.error(f"寫入 TV Code 檔案失敗: {e}", exc_info=True)
+            for ticker, _ in codes:
+                queue.mark_failed(run_id, "TV Code", ticker, str(e))
+        return sink
+
+
+def run_worker_process(queue_path, run_id, worker_index, port):
+    """
+    Entry point of `run.py --worker`: drives one Chrome instance and pulls
+    items of `run_id` from the shared queue until none are left.
+    Returns the process exit code.
+    """
+    queue = SQLiteWorkQueue(queue_path)
+    run = queue.get_run(run_id)
+    if run is None:
+        logger.error(f"佇列中找不到工作 #{run_id}。")
+        return 2
+    destination_path, user_settings = run
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{port}"
+    slot = {'index': worker_index, 'port': port, 'user_data_dir': config.get_chrome_user_data_dir(worker_index)}
+    pool = WorkerPool(1, slots=[slot])
+    scraper = pool.scrapers[0]
+
+    download_path = config.get_download_path(destination_path, port, user_settings.get("direct_download", False))
+    reset_download_dir(download_path)
+    # Charts are compared here; the coordinator collects the results from the output index.
+    changes = ChangeDetector(destination_path) if user_settings.get("detect_changes", True) else None
+    replicator = start_replicator(destination_path, user_settings, start=False)
+    pipeline = PostProcessingPipeline(compress=user_settings.get("compress_outputs", False), changes=changes,
+                                      replicator=replicator).start()
+    tv_code_sink = TvCodeCollector()
+    scraper.begin_run(download_path, pipeline, tv_code_sink)
+    supervisor = WorkerSupervisor(peer_ratio=lambda _port: _peer_latency_ratio(queue, run_id, worker_id))
+    completed = {}
+    try:
+        pool.start_worker(slot, scraper)
+        supervisor.reset(scraper)
+        while True:
+            item = queue.claim(worker_id, run_id, scraper.current_model)
+            if item is None:
+                if queue.is_finished(run_id):
+                    break
+                # Other workers still hold items; wait in case one of their leases runs out.
+                time.sleep(config.COORDINATOR_POLL_SECONDS)
+                continue
+
+            if scraper.current_model != item.model and not scraper.select_model(item.model):
+                _fail_or_release(queue, pool, slot, scraper, supervisor, item, "無法切換模型")
+                continue
+            ok = scraper.process_ticker(item.model, item.ticker, destination_path)
+            if not ok:
+                _fail_or_release(queue, pool, slot, scraper, supervisor, item, "處理失敗")
+                continue
+
+            sample = scraper.timings[-1] if scraper.timings else {}
+            queue.complete(item, True, seconds=sample.get("seconds"), result=tv_code_sink.take(item.ticker))
+            completed[item.label] = item
+
+            action = supervisor.check(scraper)
+            if action == WorkerSupervisor.TAB:
+                try:
+                    scraper.recycle_tab()
+                except Exception as e:
+                    logger.warning(f"[Port {port}] 更換分頁失敗，改為重新啟動瀏覽器: {e}")
+                    action = WorkerSupervisor.BROWSER
+            if action == WorkerSupervisor.BROWSER:
+                pool.restart_worker(slot, scraper)
+                supervisor.reset(scraper)
+        return 0
+    except Exception as e:
+        logger.error(f"[Port {port}] 工作程序執行失敗: {e}", exc_info=True)
+        return 1
+    finally:
+        pipeline.close()
+        if replicator is not None:
+            replicator.close()
+        for label in pipeline.failed_items:
+            item = completed.get(label)
+            if item is not None:
+                queue.mark_failed(run_id, item.model, item.ticker, "後處理失敗")
+        pool.shutdown()
+        queue.close()
+
+
+def _peer_latency_ratio(queue, run_id, worker_id):
+    """This worker's recent item time relative to the other workers' (from the shared queue)."""
+    recent = queue.recent_seconds(run_id, config.RECYCLE_LATENCY_WINDOW)
+    own = recent.pop(worker_id, None)
+    peers = [statistics.median(samples) for samples in recent.values() if samples]
+    return latency_ratio(statistics.median(own), peers) if own else None
+
+
+def _fail_or_release(queue, pool, slot, scraper, supervisor, item, reason):
+    """
+    Reports a failed item. If the browser died, the item goes back to the
+    queue (the attempt count is kept by the queue) and the browser is
+    restarted; a restart failure ends the worker process.
+    """
+    if scraper.is_alive():
+        queue.complete(item, False, error=reason)
+        return
+    logger.warning(f"[Port {slot['port']}] 瀏覽器已無回應 (處理 {item.label} 時)。")
+    if item.attempts < config.MAX_ITEM_ATTEMPTS:
+        queue.release(item)
+    else:
+        queue.complete(item, False, error=reason)
+    pool.restart_worker(slot, scraper)
+    supervisor.reset(scraper)
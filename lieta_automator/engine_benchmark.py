@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from . import config
+from .logger import logger
+from .supervisor import chrome_process_rss, load_psutil
+from .tickers import normalize
+
+
+class ResourceSampler:
+    """Tracks the peak RSS of this process and of the primary Chrome once a second."""
+
+    def __init__(self, port):
+        self.port = port
+        self.peak_python_rss = None
+        self.peak_chrome_rss = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        psutil = load_psutil()
+        self._process = psutil.Process() if psutil is not None else None
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _loop(self):
+        while not self._stop.wait(1):
+            if self._process is not None:
+                self.peak_python_rss = max(self.peak_python_rss or 0, self._process.memory_info().rss)
+            chrome = chrome_process_rss(self.port)
+            if chrome is not None:
+                self.peak_chrome_rss = max(self.peak_chrome_rss or 0, chrome)
+
+
+def _benchmark_settings(user_settings, **overrides):
+    # A benchmark leaves no trace in production state: no replica copies, no change manifests.
+    return dict(user_settings, replica_destination="", detect_changes=False, **overrides)
+
+
+def _run_selenium(tickers, models, destination_path, user_settings):
+    from .runner import AutomationRun
+    # One window on the primary Chrome, so both engines drive the same browser.
+    settings = _benchmark_settings(user_settings, enable_multi_window=False, scraper_engine="selenium")
+    return AutomationRun(tickers, models, destination_path, settings, record_history=False).execute()
+
+
+def _run_cdp(tickers, models, destination_path, user_settings, tabs):
+    from .cdp_scraper import run_cdp_engine
+    return run_cdp_engine(tickers, models, destination_path, _benchmark_settings(user_settings, cdp_tabs=tabs),
+                          record_history=False)
+
+
+def _measure(name, run):
+    destination_path = tempfile.mkdtemp(prefix="lieta_engine_benchmark_")
+    sampler = ResourceSampler(config.PRIMARY_DEBUGGING_PORT).start()
+    cpu_started, started = time.process_time(), time.monotonic()
+    logger.info(f"--- 引擎效能比較: {name} 開始 ---")
+    try:
+        result = run(destination_path)
+        error = None
+    except Exception as e:
+        logger.error(f"引擎效能比較: {name} 執行失敗: {e}", exc_info=True)
+        result, error = None, str(e)
+    finally:
+        seconds = time.monotonic() - started
+        cpu_seconds = time.process_time() - cpu_started
+        sampler.stop()
+        shutil.rmtree(destination_path, ignore_errors=True)
+    total = result.total_tasks if result else 0
+    failed = len(result.failed_tickers) if result else None
+    succeeded = total - (failed or 0)
+    return {
+        "engine": name,
+        "items": total,
+        "failed": failed,
+        "seconds": round(seconds, 1),
+        "items_per_minute": round(succeeded / seconds * 60, 2) if result and seconds > 0 else None,
+        "python_cpu_seconds": round(cpu_seconds, 2),
+        "peak_python_rss_mb": round(sampler.peak_python_rss / 1024 ** 2, 1) if sampler.peak_python_rss else None,
+        "peak_chrome_rss_mb": round(sampler.peak_chrome_rss / 1024 ** 2, 1) if sampler.peak_chrome_rss else None,
+        "error": error,
+    }
+
+
+def format_results(results):
+    header = f"{'引擎':<22}{'項目':>6}{'失敗':>6}{'秒數':>9}{'項/分':>9}{'CPU 秒':>9}{'Python MB':>11}{'Chrome MB':>11}"
+    lines = [header, "-" * len(header)]
+
+    def cell(value, width):
+        return f"{'-' if value is None else value:>{width}}"
+
+    for r in results:
+        lines.append(f"{r['engine']:<22}{cell(r['items'], 6)}{cell(r['failed'], 6)}{cell(r['seconds'], 9)}"
+                     f"{cell(r['items_per_minute'], 9)}{cell(r['python_cpu_seconds'], 9)}"
+                     f"{cell(r['peak_python_rss_mb'], 11)}{cell(r['peak_chrome_rss_mb'], 11)}")
+    return "\n".join(lines)
+
+
+def run_engine_benchmark(tickers, models, user_settings, tabs=None):
+    """
+    Runs the same items with the Selenium engine (one window), the CDP
+    engine with one tab and the CDP engine with `tabs` tabs, one after the
+    other on the primary Chrome, each into its own temporary destination.
+    Measures wall time, throughput, this process's CPU time and peak
+    memory (psutil, optional). Prints a table, writes
+    engine_benchmark_<time>.json next to the logs and returns the results.
+    """
+    tabs = tabs or config.CDP_TABS_PER_BROWSER
+    logger.info(f"--- 引擎效能比較: {len(tickers)} 個 Tickers x {len(models)} 個模型，目標 {config.LIETA_BASE_URL} ---")
+    runs = [
+        ("selenium", lambda dest: _run_selenium(tickers, models, dest, user_settings)),
+        ("cdp (1 分頁)", lambda dest: _run_cdp(tickers, models, dest, user_settings, 1)),
+    ]
+    if tabs > 1:
+        runs.append((f"cdp ({tabs} 分頁)", lambda dest: _run_cdp(tickers, models, dest, user_settings, tabs)))
+    results = [_measure(name, run) for name, run in runs]
+
+    table = format_results(results)
+    print(table)
+    logger.info("引擎效能比較結果:\n" + table)
+    report_path = os.path.join(config.BASE_DIR, f"engine_benchmark_{datetime.now():%Y%m%d%H%M%S}.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "tickers": [spec.ticker for spec in normalize(tickers)],
+            "models": models,
+            "base_url": config.LIETA_BASE_URL,
+            "results": results,
+        }, f, ensure_ascii=False, indent=2)
+    logger.info(f"--- 引擎效能比較完成，報告: {report_path} ---")
+    return results
@@ -6,15 +6,211 @@ import shutil
 import subprocess
 import sys
 import threading
-import time
 import tkinter as tk
+from collections import deque
 from tkinter import Toplevel, filedialog, messagebox, ttk
 
-from PIL import Image, ImageTk
-
-from . import config, chrome_launcher, settings, scheduler
+from . import config, settings, tracing
+from .progress import ProgressTracker
 from .logger import TkinterLogHandler, logger
-from .scraper import LietaScraper
+from .tickers import load_ticker_file
+
+
+class LogView:
+    """
+    The progress log panel. Records are rendered in batches (one insert per
+    poll), the widget keeps only the last `GUI_LOG_MAX_LINES` lines, and
+    floods are thinned out: repeats of the same message and INFO lines past
+    `GUI_LOG_MAX_LINES_PER_POLL` per poll are replaced by a suppressed count,
+    written at the latest on the next poll without new records. Warnings
+    and errors are never suppressed.
+    """
+
+    LEVELS = {"全部": logging.DEBUG, "資訊": logging.INFO, "警告": logging.WARNING, "錯誤": logging.ERROR}
+
+    def __init__(self, parent, formatter):
+        self.formatter = formatter
+        # Ring buffer of (levelno, line) for re-rendering when the level filter changes.
+        self.lines = deque(maxlen=config.GUI_LOG_MAX_LINES)
+        self.min_level = logging.INFO
+        self._last_message = None
+        self._repeats = 0
+
+        frame = ttk.LabelFrame(parent, text="進度日誌", padding=(10, 5))
+        frame.pack(fill="both", expand=True, padx=5, pady=5)
+        toolbar = ttk.Frame(frame)
+        toolbar.pack(fill="x")
+        ttk.Label(toolbar, text="顯示等級:").pack(side="left")
+        self.level_var = tk.StringVar(value="資訊")
+        level_combo = ttk.Combobox(toolbar, textvariable=self.level_var, values=list(self.LEVELS), state="readonly", width=6)
+        level_combo.pack(side="left", padx=5)
+        level_combo.bind("<<ComboboxSelected>>", lambda e: self._set_level(self.LEVELS[self.level_var.get()]))
+
+        scrollbar = ttk.Scrollbar(frame)
+        scrollbar.pack(side="right", fill="y")
+        self.text = tk.Text(frame, height=10, state="disabled", wrap="word", yscrollcommand=scrollbar.set, font=("Courier New", 9))
+        self.text.pack(fill="both", expand=True)
+        scrollbar.config(command=self.text.yview)
+        self.text.tag_config("WARNING", foreground="#b36b00")
+        self.text.tag_config("ERROR", foreground="#c00000")
+
+    def winfo_exists(self):
+        return self.text.winfo_exists()
+
+    @staticmethod
+    def _tag(levelno):
+        if levelno >= logging.ERROR:
+            return "ERROR"
+        if levelno >= logging.WARNING:
+            return "WARNING"
+        return ""
+
+    @tracing.traced("log_render", cat="gui")
+    def add_records(self, records):
+        """
+        Formats a batch of records into lines, coalescing repeats and floods.
+        Every line goes into the ring buffer; those at or above the selected
+        level are rendered.
+        """
+        new_lines = []
+        budget = config.GUI_LOG_MAX_LINES_PER_POLL
+        suppressed = 0
+        for record in records:
+            message = record.getMessage()
+            if message == self._last_message and record.levelno < logging.WARNING:
+                self._repeats += 1
+                continue
+            self._append_repeats(new_lines)
+            self._last_message = message
+            if record.levelno < logging.WARNING and budget <= 0:
+                suppressed += 1
+                continue
+            if record.levelno < logging.WARNING:
+                budget -= 1
+            new_lines.append((record.levelno, self.formatter.format(record)))
+        if suppressed:
+            new_lines.append((logging.INFO, f"... 已省略 {suppressed} 則訊息 (完整內容見日誌檔) ..."))
+        self._show(new_lines)
+
+    def flush_repeats(self):
+        """Writes the pending repeat count, e.g. on a poll without new records."""
+        new_lines = []
+        self._append_repeats(new_lines)
+        self._show(new_lines)
+
+    def _append_repeats(self, new_lines):
+        if self._repeats:
+            new_lines.append((logging.INFO, f"... 上一則訊息重複了 {self._repeats} 次 ..."))
+            self._repeats = 0
+
+    def _show(self, new_lines):
+        self.lines.extend(new_lines)
+        visible = [line for line in new_lines if line[0] >= self.min_level]
+        if visible:
+            self._render(visible, replace=False)
+
+    def _set_level(self, level):
+        self.min_level = level
+        self._render([line for line in self.lines if line[0] >= level], replace=True)
+
+    def _render(self, lines, replace):
+        # Follow the end of the log only if the user has not scrolled up.
+        at_bottom = self.text.yview()[1] >= 0.999
+        chunks = []
+        for levelno, line in lines[-config.GUI_LOG_MAX_LINES:]:
+            chunks.extend((line + "\n", self._tag(levelno)))
+        self.text.config(state="normal")
+        if replace:
+            self.text.delete("1.0", tk.END)
+        self.text.insert(tk.END, *chunks)
+        # Every line ends with a newline, so the end index sits on an empty last line.
+        line_count = int(self.text.index("end-1c").split(".")[0]) - 1
+        if line_count > config.GUI_LOG_MAX_LINES:
+            self.text.delete("1.0", f"{line_count - config.GUI_LOG_MAX_LINES + 1}.0")
+        self.text.config(state="disabled")
+        if at_bottom or replace:
+            self.text.see(tk.END)
+
+
+def _format_duration(seconds):
+    if seconds is None:
+        return "--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class ProgressPanel:
+    """
+    The run dashboard: overall completion, throughput, moving-average ETA,
+    rolling p50/p95 chart-load latency and one row per port. Workers only
+    feed the `ProgressTracker`; the panel reads a snapshot every
+    `PROGRESS_REFRESH_MS`, so its cost does not depend on the event rate.
+    """
+
+    COLUMNS = (("port", "埠", 60), ("state", "狀態", 70), ("model", "模型", 70),
+               ("ticker", "Ticker", 80), ("done", "完成", 50), ("rate", "每分鐘", 60))
+
+    def __init__(self, root, parent, tracker):
+        self.root = root
+        self.tracker = tracker
+        self._rows = {}
+        self._last_values = {}
+        self._after_id = None
+
+        frame = ttk.LabelFrame(parent, text="執行進度", padding=(10, 5))
+        frame.pack(fill="x", padx=5, pady=5)
+        self.progress_bar = ttk.Progressbar(frame, mode="determinate")
+        self.progress_bar.pack(fill="x")
+        self.summary_label = ttk.Label(frame, text="尚未開始")
+        self.summary_label.pack(anchor="w", pady=(3, 3))
+        self.table = ttk.Treeview(frame, columns=[c[0] for c in self.COLUMNS], show="headings", height=4)
+        for column, heading, width in self.COLUMNS:
+            self.table.heading(column, text=heading)
+            self.table.column(column, width=width, anchor="center")
+        self.table.pack(fill="x")
+
+    def start(self):
+        """Clears the panel for a new run and starts refreshing it."""
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+        self.tracker.reset()
+        for row in self._rows.values():
+            self.table.delete(row)
+        self._rows.clear()
+        self._last_values.clear()
+        self._refresh()
+
+    @tracing.traced("progress_refresh", cat="gui")
+    def _refresh(self):
+        self._after_id = None
+        if not self.table.winfo_exists():
+            return
+        snapshot = self.tracker.snapshot()
+        total = snapshot["total"]
+        self.progress_bar.config(maximum=max(total, 1), value=snapshot["done"])
+        rate = snapshot["rate_per_minute"]
+        rate_text = f"{rate:.1f} 項/分" if rate else "--"
+        latency_text = f"p50 {snapshot['p50']:.1f} 秒 / p95 {snapshot['p95']:.1f} 秒" if snapshot["p50"] is not None else "--"
+        self.summary_label.config(
+            text=f"完成 {snapshot['done']}/{total} (失敗 {snapshot['failed']})   速度 {rate_text}   "
+                 f"預估剩餘 {_format_duration(snapshot['eta_seconds'])}   圖表載入 {latency_text}"
+        )
+
+        for port in snapshot["ports"]:
+            port_rate = port["rate_per_minute"]
+            values = (port["port"], port["state"], port["model"], port["ticker"], port["done"],
+                      f"{port_rate:.1f}" if port_rate else "--")
+            if self._last_values.get(port["port"]) == values:
+                continue # Untouched rows are not redrawn.
+            self._last_values[port["port"]] = values
+            if port["port"] in self._rows:
+                self.table.item(self._rows[port["port"]], values=values)
+            else:
+                self._rows[port["port"]] = self.table.insert("", "end", values=values)
+
+        if not snapshot["finished"]:
+            self._after_id = self.root.after(config.PROGRESS_REFRESH_MS, self._refresh)
 
 
 class TickerApp:
@@ -25,7 +221,7 @@ class TickerApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Lieta Research 自動化工具 v1.0.2")
-        self.root.geometry("600x650") # Increased height for settings and logs
+        self.root.geometry("640x820") # Increased height for settings, progress and logs
 
         self.user_settings = settings.load_settings()
         self.tickers = []
@@ -33,6 +229,7 @@ class TickerApp:
         self.destination_path = self.user_settings.get("last_destination_path", "")
         
         self.temp_download_path_base = config.TEMP_DOWNLOAD_DIR_NAME
+        self._temp_cleanup = None
         self._prepare_temp_dir()
 
         self.log_queue = queue.Queue()
@@ -49,24 +246,35 @@ class TickerApp:
     def _prepare_temp_dir(self):
         """
         Safely prepares the main temporary download directory.
-        It creates the base directory if it doesn't exist and clears any
-        subdirectories from previous runs.
+        It creates the base directory if it doesn't exist; subdirectories
+        from previous runs are cleared in a background thread so the window
+        can open right away (a run waits for the cleanup before starting).
         """
         try:
             os.makedirs(self.temp_download_path_base, exist_ok=True)
-            for item in os.listdir(self.temp_download_path_base):
-                item_path = os.path.join(self.temp_download_path_base, item)
-                try:
-                    if os.path.isdir(item_path):
-                        shutil.rmtree(item_path)
-                    elif os.path.isfile(item_path) or os.path.islink(item_path):
-                        os.unlink(item_path)
-                except Exception as e:
-                    logger.warning(f"無法刪除暫存項目 {item_path}: {e}")
         except Exception as e:
             logger.error(f"無法建立或存取暫存資料夾 {self.temp_download_path_base}: {e}", exc_info=True)
             messagebox.showerror("嚴重錯誤", f"無法準備暫存資料夾，請檢查權限.\n\n{e}")
             self.root.destroy()
+            return
+        self._temp_cleanup = threading.Thread(target=self._clear_temp_dir, daemon=True)
+        self._temp_cleanup.start()
+
+    def _clear_temp_dir(self):
+        try:
+            items = os.listdir(self.temp_download_path_base)
+        except OSError as e:
+            logger.warning(f"無法讀取暫存資料夾 {self.temp_download_path_base}: {e}")
+            return
+        for item in items:
+            item_path = os.path.join(self.temp_download_path_base, item)
+            try:
+                if os.path.isdir(item_path):
+                    shutil.rmtree(item_path)
+                elif os.path.isfile(item_path) or os.path.islink(item_path):
+                    os.unlink(item_path)
+            except Exception as e:
+                logger.warning(f"無法刪除暫存項目 {item_path}: {e}")
 
     def _setup_ui(self):
         style = ttk.Style()
@@ -81,6 +289,7 @@ class TickerApp:
         
         try:
             # Use BASE_DIR from config to create a reliable path
+            from PIL import Image, ImageTk # Only needed for the icon; loaded lazily to speed up start-up
             icon_path = os.path.join(config.BASE_DIR, "settings.png")
             self.settings_icon = ImageTk.PhotoImage(Image.open(icon_path).resize((24, 24), Image.Resampling.LANCZOS))
             settings_button = ttk.Button(top_frame, image=self.settings_icon, command=self._open_settings_window)
@@ -101,12 +310,14 @@ class TickerApp:
         self.start_button = ttk.Button(main_frame, text="開始自動化", command=self.start_automation_thread, state="disabled")
         self.start_button.pack(pady=15, ipadx=10, ipady=5)
 
+        self.progress_tracker = ProgressTracker()
+        self.progress_panel = ProgressPanel(self.root, main_frame, self.progress_tracker)
         self._create_log_display_frame(main_frame)
 
     def _open_settings_window(self):
         settings_win = Toplevel(self.root)
         settings_win.title("設定")
-        settings_win.geometry("400x320")
+        settings_win.geometry("420x640")
         settings_win.transient(self.root)
         settings_win.grab_set()
         settings_win.resizable(False, False)
@@ -122,6 +333,41 @@ class TickerApp:
         multi_window_cb = ttk.Checkbutton(general_frame, text="啟用多視窗下載 (實驗性功能)", variable=multi_window_var)
         multi_window_cb.pack(anchor="w")
 
+        adaptive_var = tk.BooleanVar(value=self.user_settings.get("adaptive_concurrency", True))
+        adaptive_cb = ttk.Checkbutton(general_frame, text="依後端延遲自動調整視窗數量 (多視窗模式)", variable=adaptive_var)
+        adaptive_cb.pack(anchor="w")
+
+        worker_frame = ttk.Frame(general_frame)
+        worker_frame.pack(fill="x", anchor="w", pady=(2, 0))
+        worker_count_var = tk.StringVar(value=str(self.user_settings.get("worker_count", 0)))
+        ttk.Label(worker_frame, text="工作視窗數上限 (0 = 依 CPU/記憶體自動決定):").pack(side="left")
+        worker_spinbox = ttk.Spinbox(worker_frame, from_=0, to=config.MAX_WORKERS, textvariable=worker_count_var, width=4, state="readonly")
+        worker_spinbox.pack(side="left", padx=5)
+
+        compress_var = tk.BooleanVar(value=self.user_settings.get("compress_outputs", False))
+        compress_cb = ttk.Checkbutton(general_frame, text="以 gzip 壓縮下載的 HTML 檔案", variable=compress_var)
+        compress_cb.pack(anchor="w")
+
+        detect_changes_var = tk.BooleanVar(value=self.user_settings.get("detect_changes", True))
+        detect_changes_cb = ttk.Checkbutton(general_frame, text="比對前次輸出，產生變更清單 (只列出資料有變更的 Tickers)", variable=detect_changes_var)
+        detect_changes_cb.pack(anchor="w")
+
+        direct_download_var = tk.BooleanVar(value=self.user_settings.get("direct_download", False))
+        direct_download_cb = ttk.Checkbutton(general_frame, text="直接下載至目的地磁碟 (避免跨磁碟複製)", variable=direct_download_var)
+        direct_download_cb.pack(anchor="w")
+
+        use_daemon_var = tk.BooleanVar(value=self.user_settings.get("use_daemon", False))
+        use_daemon_cb = ttk.Checkbutton(general_frame, text="交由背景服務執行 (需先以 --daemon 啟動)", variable=use_daemon_var)
+        use_daemon_cb.pack(anchor="w")
+
+        replica_frame = ttk.Frame(general_frame)
+        replica_frame.pack(fill="x", anchor="w", pady=(2, 0))
+        replica_var = tk.StringVar(value=self.user_settings.get("replica_destination", ""))
+        ttk.Label(replica_frame, text="複寫至 (留空 = 不複寫):").pack(side="left")
+        ttk.Entry(replica_frame, textvariable=replica_var, width=22).pack(side="left", padx=5, fill="x", expand=True)
+        ttk.Button(replica_frame, text="...", width=3,
+                   command=lambda: replica_var.set(filedialog.askdirectory(parent=settings_win) or replica_var.get())).pack(side="left")
+
         # --- Scheduler Settings ---
         scheduler_frame = ttk.LabelFrame(frame, text="自動排程設定", padding=10)
         scheduler_frame.pack(fill="x", pady=10)
@@ -154,6 +400,28 @@ class TickerApp:
         minute_combo.pack(side="left", padx=(10, 0))
         ttk.Label(time_frame, text=" 分").pack(side="left")
 
+        extra_times_frame = ttk.Frame(scheduler_frame)
+        extra_times_frame.pack(fill="x", pady=(5, 0), padx=5)
+        extra_times_var = tk.StringVar(value=self.user_settings.get("schedule_extra_times", ""))
+        ttk.Label(extra_times_frame, text="其他時段 (HH:MM，以逗號分隔):").pack(side="left")
+        ttk.Entry(extra_times_frame, textvariable=extra_times_var, width=16).pack(side="left", padx=5)
+
+        weekdays_only_var = tk.BooleanVar(value=self.user_settings.get("schedule_weekdays_only", False))
+        ttk.Checkbutton(scheduler_frame, text="僅在平日 (週一至週五) 執行", variable=weekdays_only_var).pack(anchor="w", padx=5, pady=(5, 0))
+
+        non_trading_frame = ttk.Frame(scheduler_frame)
+        non_trading_frame.pack(fill="x", pady=(5, 0), padx=5)
+        non_trading_labels = {"check": "只檢查資料是否更新", "skip": "略過", "run": "照常執行"}
+        non_trading_var = tk.StringVar(value=non_trading_labels.get(self.user_settings.get("non_trading_day_action", "check")))
+        ttk.Label(non_trading_frame, text="非交易日 (休市):").pack(side="left")
+        ttk.Combobox(non_trading_frame, textvariable=non_trading_var, values=list(non_trading_labels.values()), width=18, state="readonly").pack(side="left", padx=5)
+
+        deadline_frame = ttk.Frame(scheduler_frame)
+        deadline_frame.pack(fill="x", pady=(5, 0), padx=5)
+        run_deadline_var = tk.StringVar(value=self.user_settings.get("run_deadline", ""))
+        ttk.Label(deadline_frame, text="完成期限 (HH:MM，留空為不限):").pack(side="left")
+        ttk.Entry(deadline_frame, textvariable=run_deadline_var, width=8).pack(side="left", padx=5)
+
         # --- Save/Cancel Buttons ---
         button_frame = ttk.Frame(frame)
         button_frame.pack(side="bottom", fill="x", pady=(20, 0))
@@ -162,9 +430,21 @@ class TickerApp:
             # 1. Collect all settings from GUI
             current_settings = settings.load_settings()
             current_settings["enable_multi_window"] = multi_window_var.get()
+            current_settings["adaptive_concurrency"] = adaptive_var.get()
+            current_settings["worker_count"] = int(worker_count_var.get() or 0)
+            current_settings["compress_outputs"] = compress_var.get()
+            current_settings["direct_download"] = direct_download_var.get()
+            current_settings["detect_changes"] = detect_changes_var.get()
+            current_settings["replica_destination"] = replica_var.get().strip()
+            current_settings["use_daemon"] = use_daemon_var.get()
             current_settings["schedule_enabled"] = schedule_enabled_var.get()
             current_settings["schedule_time_hour"] = schedule_hour_var.get()
             current_settings["schedule_time_minute"] = schedule_minute_var.get()
+            current_settings["run_deadline"] = run_deadline_var.get().strip()
+            current_settings["schedule_extra_times"] = extra_times_var.get().strip()
+            current_settings["schedule_weekdays_only"] = weekdays_only_var.get()
+            current_settings["non_trading_day_action"] = next(
+                (key for key, label in non_trading_labels.items() if label == non_trading_var.get()), "check")
 
             # 2. Save to JSON file
             settings.save_settings(current_settings)
@@ -174,9 +454,11 @@ class TickerApp:
             # 3. Handle Windows Task Scheduler
             # Since the app now requires admin rights to run, we don't need to check for is_admin() here.
             try:
+                from . import scheduler
                 if schedule_enabled_var.get():
-                    schedule_time = f"{schedule_hour_var.get()}:{schedule_minute_var.get()}"
-                    success, message = scheduler.create_or_update_task(schedule_time)
+                    schedule_times = [f"{schedule_hour_var.get()}:{schedule_minute_var.get()}"]
+                    schedule_times += [t for t in extra_times_var.get().split(",") if t.strip()]
+                    success, message = scheduler.create_or_update_task(schedule_times, weekdays_only_var.get())
                 else:
                     success, message = scheduler.delete_task()
 
@@ -201,24 +483,26 @@ class TickerApp:
     def _setup_logging(self):
         tkinter_handler = TkinterLogHandler(self.log_queue)
         logger.addHandler(tkinter_handler)
-        self.root.after(100, self._process_log_queue)
+        self.root.after(config.GUI_LOG_POLL_MS, self._process_log_queue)
 
     def _process_log_queue(self):
+        records = []
         try:
-            while not self.log_queue.empty():
-                record = self.log_queue.get_nowait()
-                msg = self.log_formatter.format(record)
-                
-                if self.log_text.winfo_exists():
-                    self.log_text.config(state="normal")
-                    self.log_text.insert(tk.END, msg + "\n")
-                    self.log_text.see(tk.END)
-                    self.log_text.config(state="disabled")
+            # Drain only what is queued now, so a busy producer cannot keep this tick running.
+            for _ in range(self.log_queue.qsize()):
+                records.append(self.log_queue.get_nowait())
         except queue.Empty:
             pass
+        try:
+            if self.log_view.winfo_exists():
+                if records:
+                    self.log_view.add_records(records)
+                else:
+                    # A run that ends on repeated lines still shows their count.
+                    self.log_view.flush_repeats()
         finally:
             if self.root.winfo_exists():
-                self.root.after(100, self._process_log_queue)
+                self.root.after(config.GUI_LOG_POLL_MS, self._process_log_queue)
 
     def _create_file_selection_frame(self, parent):
         frame = ttk.LabelFrame(parent, text="1. 選擇 Ticker 檔案 (.txt)", padding=(10, 5))
@@ -232,7 +516,7 @@ class TickerApp:
         frame = ttk.LabelFrame(parent, text="2. 選擇模型", padding=(10, 5))
         frame.pack(fill="x", padx=5, pady=5)
         
-        self.models = ["Gamma", "Term", "Smile", "TV Code"]
+        self.models = list(config.MODELS)
         self.selected_models = {}
         
         last_selected = self.user_settings.get("last_selected_models", [])
@@ -257,13 +541,7 @@ class TickerApp:
         self.dest_button.pack(side="right")
 
     def _create_log_display_frame(self, parent):
-        frame = ttk.LabelFrame(parent, text="進度日誌", padding=(10, 5))
-        frame.pack(fill="both", expand=True, padx=5, pady=5)
-        scrollbar = ttk.Scrollbar(frame)
-        scrollbar.pack(side="right", fill="y")
-        self.log_text = tk.Text(frame, height=10, state="disabled", wrap="word", yscrollcommand=scrollbar.set, font=("Courier New", 9))
-        self.log_text.pack(fill="both", expand=True)
-        scrollbar.config(command=self.log_text.yview)
+        self.log_view = LogView(parent, self.log_formatter)
 
     def _load_initial_state(self):
         if self.tickers_path and os.path.exists(self.tickers_path):
@@ -277,21 +555,24 @@ class TickerApp:
 
     def _load_tickers_from_path(self, file_path):
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                self.tickers = [line.strip().upper() for line in f if line.strip()]
+            self.tickers = load_ticker_file(file_path)
             if not self.tickers:
                 logger.warning(f"Ticker 檔案 {file_path} 為空。")
                 return
             self.tickers_path = file_path
             self.file_label.config(text=file_path)
-            logger.info(f"已載入 Ticker 檔案: {len(self.tickers)} 個 Tickers。")
+            with_models = sum(1 for spec in self.tickers if spec.models)
+            logger.info(f"已載入 Ticker 檔案: {len(self.tickers)} 個 Tickers ({with_models} 個指定了模型)。")
         except Exception as e:
             logger.error(f"無法載入 Ticker 檔案 {file_path}: {e}", exc_info=True)
             self.tickers_path = ""
 
     def load_ticker_list(self):
         initial_dir = os.path.dirname(self.tickers_path) if self.tickers_path else "/"
-        file_path = filedialog.askopenfilename(filetypes=[("Text Files", "*.txt")], initialdir=initial_dir)
+        file_path = filedialog.askopenfilename(
+            filetypes=[("Ticker Files", "*.txt *.csv *.json"), ("Text Files", "*.txt"), ("CSV Files", "*.csv"), ("JSON Files", "*.json")],
+            initialdir=initial_dir
+        )
         if file_path:
             self._load_tickers_from_path(file_path)
             current_settings = settings.load_settings()
@@ -357,157 +638,41 @@ class TickerApp:
 
         self.automation_running = True
         self.toggle_ui_state(False)
+        self.progress_panel.start()
         
-        thread = threading.Thread(target=self.run_automation_task, daemon=True)
+        thread = threading.Thread(target=self.run_automation_task, name="automation", daemon=True)
         thread.start()
 
     def run_automation_task(self):
+        if self._temp_cleanup is not None:
+            self._temp_cleanup.join() # Leftovers of earlier runs must be gone before new downloads land
         try:
-            use_multi_window = self.user_settings.get("enable_multi_window", False)
-            if use_multi_window:
-                self._run_multi_window_task()
-            else:
-                self._run_single_window_task()
+            selected_models = [model for model, var in self.selected_models.items() if var.get()]
+            current_settings = settings.load_settings()
+            current_settings["last_selected_models"] = selected_models
+            settings.save_settings(current_settings)
+
+            from .main import execute_run
+            result = execute_run(
+                self.tickers.copy(), selected_models, self.destination_path, self.user_settings,
+                on_login_required=self._notify_login_required, on_progress=self.progress_tracker.handle,
+                on_run=lambda run: setattr(self, "scrapers", run.scrapers)
+            )
+
+            if self.root.winfo_exists():
+                self.show_summary(result.total_tasks, result.failed_tickers, result.deferred)
         except Exception as e:
             logger.critical(f"自動化過程中發生未預期的嚴重錯誤: {e}", exc_info=True)
             if self.root.winfo_exists():
                 self.root.after(0, lambda: messagebox.showerror("嚴重錯誤", f"自動化過程中發生嚴重錯誤，請查看 log.jsonl。\n\n{e}"))
         finally:
+            self.progress_tracker.handle({"event": "run_finished"}) # Also ends the panel after a failed run
             if self.root.winfo_exists():
                 self.automation_running = False
                 self.toggle_ui_state(True)
 
-    def _run_multi_window_task(self):
-        selected_models = [model for model, var in self.selected_models.items() if var.get()]
-        current_settings = settings.load_settings()
-        current_settings["last_selected_models"] = selected_models
-        settings.save_settings(current_settings)
-
-        if len(selected_models) > len(config.REMOTE_DEBUGGING_PORTS):
-            msg = f"選擇的模型數量 ({len(selected_models)}) 超過可用埠號數量 ({len(config.REMOTE_DEBUGGING_PORTS)})。"
-            logger.error(msg)
-            self.root.after(0, lambda: messagebox.showerror("錯誤", msg))
-            return
-
-        logger.info("--- 自動化開始 (多視窗模式) ---")
-        
-        # --- Phase 1: Prepare all profiles BEFORE launching any Chrome instances ---
-        logger.info("階段 1: 準備並同步所有 Chrome 設定檔...")
-        profiles_to_launch = []
-        for i, model in enumerate(selected_models):
-            port = config.REMOTE_DEBUGGING_PORTS[i]
-            user_data_dir = config.get_chrome_user_data_dir(port)
-            profiles_to_launch.append({'port': port, 'user_data_dir': user_data_dir, 'model': model})
-            
-            # This will create the directory and copy files from the main profile if it's the first time.
-            # We do this for all profiles before any Chrome process is started to avoid file locks.
-            chrome_launcher._sync_profile_if_new(port, user_data_dir)
-        logger.info("所有設定檔準備完成。")
-
-
-        # --- Phase 2: Launch Chrome instances and run automation tasks ---
-        logger.info("階段 2: 啟動 Chrome 實例並執行自動化任務...")
-        self.scrapers = []
-        threads = []
-        
-        for profile in profiles_to_launch:
-            temp_path_for_port = config.get_temp_download_path_for_port(profile['port'])
-            scraper = LietaScraper(download_path=temp_path_for_port, port=profile['port'])
-            self.scrapers.append(scraper)
-            
-            thread = threading.Thread(
-                target=self._run_single_model_task,
-                args=(scraper, self.tickers.copy(), profile['model'], self.destination_path, profile['port'], profile['user_data_dir']),
-                daemon=True
-            )
-            threads.append(thread)
-            thread.start()
-            time.sleep(1) # Stagger the launch slightly
-
-        for thread in threads:
-            thread.join()
-
-        logger.info("--- 所有線程執行完畢 ---")
-        
-        all_failed_tickers = []
-        for scraper in self.scrapers:
-            all_failed_tickers.extend(scraper.failed_tickers)
-        
-        total_tasks = len(selected_models) * len(self.tickers)
-        
-        if self.root.winfo_exists():
-            self.show_summary(total_tasks, all_failed_tickers)
-
-    def _run_single_window_task(self):
-        selected_models = [model for model, var in self.selected_models.items() if var.get()]
-        current_settings = settings.load_settings()
-        current_settings["last_selected_models"] = selected_models
-        settings.save_settings(current_settings)
-        
-        logger.info("--- 自動化開始 (單視窗模式) ---")
-        
-        port = config.REMOTE_DEBUGGING_PORTS[0]
-        user_data_dir = config.get_chrome_user_data_dir(port)
-        temp_path_for_port = config.get_temp_download_path_for_port(port)
-        
-        scraper = LietaScraper(download_path=temp_path_for_port, port=port)
-        self.scrapers = [scraper]
-
-        try:
-            if not chrome_launcher.launch_chrome_in_debug_mode(port, user_data_dir):
-                raise Exception("無法啟動 Chrome 偵錯實例。")
-            
-            time.sleep(5)
-
-            if not scraper.setup_driver():
-                raise Exception("無法連接到 WebDriver。")
-
-            if not scraper.check_login_status():
-                self.root.after(0, lambda: messagebox.showerror("需要登入", "請先登入 Lieta Research 網站後再開始自動化。"))
-                raise Exception("使用者未登入。")
-
-            all_failed_tickers = []
-            for model in selected_models:
-                failed = scraper.run_automation(self.tickers.copy(), model, self.destination_path)
-                all_failed_tickers.extend(failed)
-            
-            total_tasks = len(selected_models) * len(self.tickers)
-            if self.root.winfo_exists():
-                self.show_summary(total_tasks, all_failed_tickers)
-
-        except Exception as e:
-            logger.error(f"單視窗模式執行失敗: {e}", exc_info=True)
-            if self.root.winfo_exists():
-                self.root.after(0, lambda msg=str(e): messagebox.showerror("錯誤", f"自動化執行失敗: {msg}"))
-        finally:
-            if scraper.driver:
-                scraper.close_driver()
-
-    def _run_single_model_task(self, scraper, tickers, model, dest_path, port, user_data_dir):
-        try:
-            if not chrome_launcher.launch_chrome_in_debug_mode(port, user_data_dir):
-                raise Exception(f"[Port {port}] 無法啟動 Chrome 偵錯實例。")
-            
-            logger.info(f"[Port {port}] 等待 Chrome 啟動...")
-            time.sleep(5)
-
-            if not scraper.setup_driver():
-                raise Exception(f"[Port {port}] 無法連接到 WebDriver。")
-
-            if not scraper.check_login_status():
-                if port == config.REMOTE_DEBUGGING_PORTS[0]:
-                     self.root.after(0, lambda: messagebox.showerror("需要登入", "請先登入 Lieta Research 網站後再開始自動化。"))
-                raise Exception(f"[Port {port}] 使用者未登入。")
-
-            logger.info(f"[Port {port}] WebDriver 設定成功，開始執行任務。")
-            scraper.run_automation(tickers, model, dest_path)
-
-        except Exception as e:
-            logger.error(f"處理模型 {model} 時發生錯誤: {e}", exc_info=True)
-            scraper.failed_tickers.extend([f"{t} ({model})" for t in tickers])
-        finally:
-            if scraper.driver:
-                scraper.close_driver()
+    def _notify_login_required(self):
+        self.root.after(0, lambda: messagebox.showerror("需要登入", "請先登入 Lieta Research 網站後再開始自動化。"))
 
     def toggle_ui_state(self, is_enabled):
         state = "normal" if is_enabled else "disabled"
@@ -532,12 +697,14 @@ class TickerApp:
         
         self.open_dest_button.config(state="normal" if self.destination_path and os.path.isdir(self.destination_path) else "disabled")
 
-    def show_summary(self, total_tasks, failed_tickers):
+    def show_summary(self, total_tasks, failed_tickers, deferred=None):
         success_count = total_tasks - len(failed_tickers)
         summary_msg = f"任務完成！\n\n總計: {total_tasks}\n成功: {success_count}\n失敗: {len(failed_tickers)}"
         if failed_tickers:
             unique_failures = sorted(list(set(failed_tickers)))
             summary_msg += f"\n\n失敗的項目 ({len(unique_failures)} 個):\n" + "\n".join(unique_failures)
+        if deferred:
+            summary_msg += f"\n\n為趕上完成期限而延後的項目 ({len(deferred)} 個):\n" + "\n".join(deferred)
         logger.info(f"任務總結: {summary_msg.replace('任務完成！', '').strip()}")
 
     def cleanup(self):
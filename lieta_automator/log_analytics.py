@@ -0,0 +1,302 @@
+import glob
+import gzip
+import hashlib
+import json
+import math
+import os
+
+from . import config
+from . import logger as logger_module
+from .logger import logger
+
+# Latency histogram: log-spaced buckets growing by 10% from 0.1 s, so
+# percentiles come out within ~5% while the state stays a few dozen counters.
+_BUCKET_BASE = 0.1
+_BUCKET_GROWTH = 1.1
+# Summary format; cached summaries of another version are rebuilt.
+_CACHE_VERSION = 1
+
+
+def _bucket(seconds):
+    if seconds <= _BUCKET_BASE:
+        return 0
+    return int(math.log(seconds / _BUCKET_BASE, _BUCKET_GROWTH)) + 1
+
+
+def _bucket_value(index):
+    """Geometric middle of a bucket, the estimate reported for samples in it."""
+    if index == 0:
+        return _BUCKET_BASE
+    return _BUCKET_BASE * _BUCKET_GROWTH ** (index - 0.5)
+
+
+def percentile(histogram, fraction):
+    """Estimates a percentile from a {bucket: count} histogram."""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = fraction * total
+    seen = 0
+    for index in sorted(histogram, key=int):
+        seen += histogram[index]
+        if seen >= rank:
+            return _bucket_value(int(index))
+    return _bucket_value(int(max(histogram, key=int)))
+
+
+def _empty_summary():
+    return {
+        "tickers": {},     # "YYYY-MM|model|ticker" -> {"ok", "failed", "seconds", "max"}
+        "latency": {},     # "YYYY-MM-DD|model" -> {bucket: count}
+        "exceptions": {},  # fingerprint -> {"count", "message"}
+        "records": 0,
+        "errors": 0,
+    }
+
+
+def _add_record(summary, record):
+    summary["records"] += 1
+    if record.get("level") in ("ERROR", "CRITICAL"):
+        summary["errors"] += 1
+    fingerprint = record.get("exception_id") or record.get("exception_ref")
+    if fingerprint:
+        entry = summary["exceptions"].setdefault(fingerprint, {"count": 0, "message": ""})
+        entry["count"] += 1
+        if record.get("exception"):
+            entry["message"] = record["exception"].strip().splitlines()[-1][:200]
+
+    data = record.get("data")
+    if not isinstance(data, dict) or data.get("event") != "ticker_timing":
+        return
+    timestamp = record.get("timestamp", "")
+    model, ticker, seconds = data.get("model"), data.get("ticker"), data.get("seconds")
+    if not model or not ticker or seconds is None:
+        return
+    outcome = "ok" if data.get("ok") else "failed"
+    stats = summary["tickers"].setdefault(f"{timestamp[:7]}|{model}|{ticker}", {"ok": 0, "failed": 0, "seconds": 0.0, "max": 0.0})
+    stats[outcome] += 1
+    if data.get("ok"):
+        stats["seconds"] = round(stats["seconds"] + seconds, 3)
+        stats["max"] = max(stats["max"], seconds)
+        histogram = summary["latency"].setdefault(f"{timestamp[:10]}|{model}", {})
+        bucket = str(_bucket(seconds))
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+
+
+def _merge(target, source):
+    target["records"] += source["records"]
+    target["errors"] += source["errors"]
+    for key, stats in source["tickers"].items():
+        merged = target["tickers"].setdefault(key, {"ok": 0, "failed": 0, "seconds": 0.0, "max": 0.0})
+        merged["ok"] += stats["ok"]
+        merged["failed"] += stats["failed"]
+        merged["seconds"] = round(merged["seconds"] + stats["seconds"], 3)
+        merged["max"] = max(merged["max"], stats["max"])
+    for key, histogram in source["latency"].items():
+        merged = target["latency"].setdefault(key, {})
+        for bucket, count in histogram.items():
+            merged[bucket] = merged.get(bucket, 0) + count
+    for fingerprint, entry in source["exceptions"].items():
+        merged = target["exceptions"].setdefault(fingerprint, {"count": 0, "message": ""})
+        merged["count"] += entry["count"]
+        merged["message"] = merged["message"] or entry["message"]
+
+
+def _open_log(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _file_identity(path):
+    """
+    Fingerprint of a log file's first line. It survives rotation
+    (log_x.jsonl -> log_x.jsonl.1.gz), so a rotated file resumes from its
+    cached offset instead of being parsed again.
+    """
+    try:
+        with _open_log(path) as f:
+            first_line = f.readline()
+    except (OSError, EOFError):
+        return None
+    if not first_line.endswith(b"\n"):
+        return None # Empty, or the first record is still being written.
+    return hashlib.sha1(first_line).hexdigest()
+
+
+def _scan(path, offset, summary):
+    """Parses complete lines from byte `offset` on; returns the offset after the last complete line."""
+    with _open_log(path) as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break # A record still being written; picked up next time.
+            offset += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict):
+                _add_record(summary, record)
+    return offset
+
+
+class LogAnalytics:
+    """
+    Aggregates every `log_*.jsonl[.N.gz]` file in a directory, one line at a
+    time. The cache keeps the offset parsed so far and a summary for each
+    file that may still grow; compressed (finished) or deleted files are
+    folded into one base summary and only their fingerprint is kept, so
+    later runs read just new files and the new tail of growing ones.
+    """
+
+    def __init__(self, log_dir=None, cache_path=None):
+        self.log_dir = log_dir or config.BASE_DIR
+        self.cache_path = cache_path or config.LOG_ANALYTICS_CACHE_FILE
+        self.cache = self._load_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache.get("version") == _CACHE_VERSION:
+                return cache
+        except (OSError, ValueError):
+            pass
+        return {"version": _CACHE_VERSION, "base": _empty_summary(), "done": {}, "files": {}}
+
+    def _save_cache(self):
+        temp_path = self.cache_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.cache, f, ensure_ascii=False)
+        os.replace(temp_path, self.cache_path)
+
+    def collect(self):
+        """Updates the cache from the log files on disk and returns the combined summary."""
+        own_log = os.path.abspath(logger_module.log_file_path or "")
+        files, done = self.cache["files"], self.cache["done"]
+        seen = set()
+        parsed = reused = 0
+        for path in sorted(glob.glob(os.path.join(self.log_dir, "log_*.jsonl*"))):
+            if os.path.abspath(path) == own_log:
+                continue # This run's own log
+            identity = _file_identity(path)
+            if identity is None or identity in seen:
+                continue
+            seen.add(identity)
+            if identity in done:
+                reused += 1
+                continue
+            entry = files.get(identity)
+            if entry is None:
+                entry = files[identity] = {"offset": 0, "summary": _empty_summary()}
+            try:
+                new_offset = _scan(path, entry["offset"], entry["summary"])
+            except (OSError, EOFError) as e:
+                logger.warning(f"無法讀取日誌檔 {path}: {e}")
+                continue
+            if new_offset > entry["offset"]:
+                parsed += 1
+            else:
+                reused += 1
+            entry["offset"] = new_offset
+            entry["path"] = os.path.basename(path)
+            if path.endswith(".gz"):
+                seen.discard(identity) # Rotated files no longer change; fold them below.
+
+        # Fold finished files, and files deleted since (e.g. past the retention period), into the base.
+        for identity in list(files):
+            if identity not in seen:
+                _merge(self.cache["base"], files[identity]["summary"])
+                done[identity] = files.pop(identity).get("path", "")
+        self._save_cache()
+        logger.info(f"日誌分析: 讀取 {parsed} 個檔案，沿用 {reused} 個檔案的快取。")
+
+        combined = _empty_summary()
+        _merge(combined, self.cache["base"])
+        for entry in files.values():
+            _merge(combined, entry["summary"])
+        return combined
+
+
+def build_report(summary, since=None, top=10):
+    """
+    Turns a summary into report data. `since` ("YYYY-MM-DD") limits latency
+    to those days and ticker statistics to the months they fall in.
+    """
+    since_month = since[:7] if since else None
+    report = {"models": {}, "tickers": [], "slowest": [], "latency": [], "exceptions": []}
+
+    tickers = {}
+    for key, stats in summary["tickers"].items():
+        month, model, ticker = key.split("|", 2)
+        if since_month and month < since_month:
+            continue
+        merged = tickers.setdefault((model, ticker), {"ok": 0, "failed": 0, "seconds": 0.0, "max": 0.0})
+        merged["ok"] += stats["ok"]
+        merged["failed"] += stats["failed"]
+        merged["seconds"] += stats["seconds"]
+        merged["max"] = max(merged["max"], stats["max"])
+
+    for (model, ticker), stats in tickers.items():
+        models = report["models"].setdefault(model, {"ok": 0, "failed": 0})
+        models["ok"] += stats["ok"]
+        models["failed"] += stats["failed"]
+    for counts in report["models"].values():
+        total = counts["ok"] + counts["failed"]
+        counts["failure_rate"] = round(counts["failed"] / total, 4) if total else 0.0
+
+    failing = [
+        {"model": model, "ticker": ticker, "failed": stats["failed"], "attempts": stats["ok"] + stats["failed"],
+         "failure_rate": round(stats["failed"] / (stats["ok"] + stats["failed"]), 4)}
+        for (model, ticker), stats in tickers.items() if stats["failed"]
+    ]
+    report["tickers"] = sorted(failing, key=lambda t: (-t["failed"], -t["failure_rate"]))[:top]
+
+    slowest = [
+        {"model": model, "ticker": ticker, "mean_seconds": round(stats["seconds"] / stats["ok"], 1),
+         "max_seconds": round(stats["max"], 1), "samples": stats["ok"]}
+        for (model, ticker), stats in tickers.items() if stats["ok"] >= config.LOG_ANALYTICS_MIN_SAMPLES
+    ]
+    report["slowest"] = sorted(slowest, key=lambda t: -t["mean_seconds"])[:top]
+
+    for key in sorted(summary["latency"]):
+        day, model = key.split("|", 1)
+        if since and day < since:
+            continue
+        histogram = summary["latency"][key]
+        report["latency"].append({
+            "day": day, "model": model, "samples": sum(histogram.values()),
+            "p50": round(percentile(histogram, 0.50), 1),
+            "p95": round(percentile(histogram, 0.95), 1),
+            "p99": round(percentile(histogram, 0.99), 1),
+        })
+
+    report["exceptions"] = sorted(
+        ({"fingerprint": fp, **entry} for fp, entry in summary["exceptions"].items()),
+        key=lambda e: -e["count"])[:top]
+    return report
+
+
+def format_report(report):
+    lines = ["=== 各模型失敗率 ==="]
+    for model, counts in sorted(report["models"].items()):
+        lines.append(f"{model:<8} 成功 {counts['ok']:>6}  失敗 {counts['failed']:>5}  失敗率 {counts['failure_rate']:.1%}")
+    lines.append("")
+    lines.append("=== 失敗最多的 Tickers ===")
+    for t in report["tickers"]:
+        lines.append(f"{t['ticker']:<8} {t['model']:<8} 失敗 {t['failed']:>4} / {t['attempts']:<5} ({t['failure_rate']:.0%})")
+    lines.append("")
+    lines.append("=== 最慢的 Tickers (平均耗時) ===")
+    for t in report["slowest"]:
+        lines.append(f"{t['ticker']:<8} {t['model']:<8} 平均 {t['mean_seconds']:>6.1f} 秒  最長 {t['max_seconds']:>6.1f} 秒  ({t['samples']} 次)")
+    lines.append("")
+    lines.append("=== 每日延遲 (秒) ===")
+    for row in report["latency"]:
+        lines.append(f"{row['day']} {row['model']:<8} p50 {row['p50']:>6.1f}  p95 {row['p95']:>6.1f}  p99 {row['p99']:>6.1f}  ({row['samples']} 筆)")
+    if report["exceptions"]:
+        lines.append("")
+        lines.append("=== 最常見的例外 ===")
+        for e in report["exceptions"]:
+            lines.append(f"{e['fingerprint']} x{e['count']:<5} {e['message']}")
+    return "\n".join(lines)
@@ -1,8 +1,17 @@
+import atexit
+import copy
+import glob
+import gzip
+import hashlib
 import json
 import logging
 import os
-import tkinter as tk
-from logging import FileHandler, Handler, LogRecord
+import re
+import shutil
+import threading
+import time
+from logging import Handler, LogRecord
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from datetime import datetime
 
 from . import config # Import the config module
@@ -10,11 +19,32 @@ from . import config # Import the config module
 # --- Configuration ---
 LOG_LEVEL = logging.INFO
 
+# Parts of a traceback that differ between otherwise identical failures
+# (memory addresses in chromedriver stack traces, object ids).
+_VOLATILE_TRACEBACK_PARTS = re.compile(r"0x[0-9a-fA-F]+")
+
+
+def traceback_fingerprint(exc_text: str) -> str:
+    return hashlib.sha1(_VOLATILE_TRACEBACK_PARTS.sub("0x?", exc_text).encode("utf-8")).hexdigest()[:12]
+
+
 # --- Custom JSON Formatter ---
 class JsonFormatter(logging.Formatter):
     """
     Formats log records as a JSON string (JSONL format).
+
+    A traceback is written in full the first time it appears in a file,
+    tagged with its fingerprint ("exception_id"); later records with the
+    same traceback only carry "exception_ref". Call `reset_tracebacks()`
+    when starting a new file so each file stays self-contained.
     """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._seen_tracebacks = set()
+
+    def reset_tracebacks(self):
+        self._seen_tracebacks.clear()
+
     def format(self, record: LogRecord) -> str:
         # Create a clean copy of the record's dict to avoid modifying the original
         log_object = {
@@ -27,10 +57,21 @@ class JsonFormatter(logging.Formatter):
                 "line": record.lineno,
             },
         }
-        # Include exception info if it exists
-        if record.exc_info:
-            log_object["exception"] = self.formatException(record.exc_info)
-        
+        # Include structured payloads passed via `extra={"data": {...}}`
+        data = getattr(record, "data", None)
+        if data is not None:
+            log_object["data"] = data
+        # Include exception info if it exists (already rendered to text by the queue handler)
+        exc_text = record.exc_text or (self.formatException(record.exc_info) if record.exc_info else None)
+        if exc_text:
+            fingerprint = traceback_fingerprint(exc_text)
+            if fingerprint in self._seen_tracebacks:
+                log_object["exception_ref"] = fingerprint
+            else:
+                self._seen_tracebacks.add(fingerprint)
+                log_object["exception_id"] = fingerprint
+                log_object["exception"] = exc_text
+
         return json.dumps(log_object, ensure_ascii=False)
 
 import queue
@@ -53,29 +94,155 @@ class TkinterLogHandler(Handler):
         """
         self.log_queue.put(record)
 
+
+# --- Asynchronous File Logging ---
+class _RecordQueueHandler(QueueHandler):
+    """
+    Hands records to the file listener thread. Unlike the stock
+    QueueHandler it keeps the message and `data` separate, rendering only
+    the traceback to text so the record can be written later.
+    """
+    def prepare(self, record: LogRecord) -> LogRecord:
+        record = copy.copy(record) # Other handlers still receive the original
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RotatingJsonlHandler(RotatingFileHandler):
+    """
+    A size-rotating file handler that also rolls over after
+    `LOG_MAX_AGE_HOURS`, gzips the rotated files and starts a fresh
+    traceback table in each new file.
+    """
+    def __init__(self, filename):
+        # delay: the file is created by the first record, on the listener thread, not at import.
+        super().__init__(filename, maxBytes=config.LOG_MAX_BYTES, backupCount=config.LOG_BACKUP_COUNT, encoding="utf-8", delay=True)
+        self.namer = lambda name: name + ".gz"
+        self.rotator = _gzip_rotator
+        self._opened_at = time.time()
+
+    def shouldRollover(self, record):
+        # The base class formats the record to measure it, which would mark its
+        # traceback as written; the current file size is close enough.
+        if time.time() - self._opened_at >= config.LOG_MAX_AGE_HOURS * 3600:
+            return True
+        return self.stream is not None and self.stream.tell() >= self.maxBytes
+
+    def doRollover(self):
+        super().doRollover()
+        self._opened_at = time.time()
+        if isinstance(self.formatter, JsonFormatter):
+            self.formatter.reset_tracebacks()
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+# log_<timestamp>_<pid>.jsonl; files of older versions carry no pid.
+_LOG_FILE_PID = re.compile(r"^log_\d{14}_(\d+)\.jsonl$")
+
+
+def _process_running(pid):
+    """True if a process with this id exists (or cannot be checked)."""
+    if os.name == "nt":
+        import ctypes # Only needed here, on Windows
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid) # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5 # ERROR_ACCESS_DENIED: it exists
+        try:
+            exit_code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            return exit_code.value == 259 # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True # e.g. owned by another user
+    return True
+
+
+def _tidy_old_logs(current_path):
+    """
+    Compresses idle log files of earlier launches and deletes expired ones.
+    The live file of a process still running (e.g. a quiet `--daemon`) is
+    left alone, however long it has been idle.
+    """
+    now = time.time()
+    for path in glob.glob(os.path.join(config.BASE_DIR, "log_*.jsonl*")):
+        if os.path.abspath(path) == os.path.abspath(current_path):
+            continue
+        owner = _LOG_FILE_PID.match(os.path.basename(path))
+        if owner is not None and _process_running(int(owner.group(1))):
+            continue
+        try:
+            idle = now - os.path.getmtime(path)
+            if idle > config.LOG_RETENTION_DAYS * 86400:
+                os.remove(path)
+            elif path.endswith(".jsonl") and idle > config.LOG_MAX_AGE_HOURS * 3600:
+                # Files without a pid may belong to a running older version that wrote recently.
+                _gzip_rotator(path, path + ".gz")
+        except OSError:
+            continue
+
+
 # --- Setup Function ---
+_listener = None
+log_file_path = None
+
+
+def _stop_listener():
+    """Writes out the records still queued and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(_stop_listener)
+
+
 def setup_logging():
     """
     Configures the root logger for the application.
     - Clears existing handlers.
-    - Adds a JSON file handler with a timestamp in the filename.
+    - Routes records through a queue to a listener thread that writes the
+      rotating JSON log file, so logging never blocks on disk.
     """
+    global _listener, log_file_path
     logger = logging.getLogger()
     logger.setLevel(LOG_LEVEL)
 
     # Clear any existing handlers to prevent duplicate logs
     if logger.hasHandlers():
         logger.handlers.clear()
+    _stop_listener()
 
     # Generate a timestamped filename
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    log_filename = f"log_{timestamp}.jsonl"
+    # The pid tells other launches whether the file is still being written.
+    log_filename = f"log_{timestamp}_{os.getpid()}.jsonl"
     log_file_path = os.path.join(config.BASE_DIR, log_filename)
 
-    # Create and add the JSON file handler
-    file_handler = FileHandler(log_file_path, encoding="utf-8")
+    # The JSON file handler runs on the listener thread
+    file_handler = RotatingJsonlHandler(log_file_path)
     file_handler.setFormatter(JsonFormatter())
-    logger.addHandler(file_handler)
+    record_queue = queue.SimpleQueue()
+    _listener = QueueListener(record_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    logger.addHandler(_RecordQueueHandler(record_queue))
+
+    threading.Thread(target=_tidy_old_logs, args=(log_file_path,), daemon=True).start()
 
     # The Tkinter handler is added from the GUI module
     return logger
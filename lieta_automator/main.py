@@ -1,44 +1,118 @@
-import sys
+import argparse
+import json
 import os
-import time
-import tkinter as tk
-from tkinter import messagebox
+import sys
 import threading
 
 # Setup logging first, so it's available everywhere.
 from .logger import logger
-from .gui import TickerApp
-from . import settings, config, chrome_launcher
-from .scraper import LietaScraper
+from . import chrome_launcher, config, market_calendar, settings
+from .runner import AutomationRun, check_data_freshness
+from .tickers import count_items, load_ticker_file
+
+# The GUI (tkinter, PIL), the daemon client (http/urllib), the work queue
+# (sqlite3) and Selenium are imported where they are first used, so each
+# mode only loads what it needs and the window appears sooner.
+
 
-def _run_single_model_automated_task(scraper, tickers, model, dest_path, port, user_data_dir):
+def execute_run(tickers, models, destination_path, user_settings, on_login_required=None, on_progress=None,
+                on_run=None):
     """
-    A thread worker for running a single model's automation in headless mode.
-    Adapted from the GUI version.
+    Runs a job through the background daemon when it is enabled and
+    reachable, otherwise in this process. Shared by the GUI and the
+    scheduled task. `on_run` is called with the in-process `AutomationRun`
+    before it starts (the GUI closes its drivers when the window closes).
+    Returns the `RunResult`.
     """
-    try:
-        if not chrome_launcher.launch_chrome_in_debug_mode(port, user_data_dir):
-            raise Exception(f"[Port {port}] 無法啟動 Chrome 偵錯實例。")
-        
-        logger.info(f"[Port {port}] 等待 Chrome 啟動...")
-        time.sleep(5)
+    if user_settings.get("use_daemon", False):
+        from . import daemon
+        if daemon.is_daemon_running():
+            if user_settings.get("scraper_engine") == "cdp":
+                logger.warning("背景服務只使用 Selenium 引擎，本次工作不會使用 CDP 引擎。")
+            return daemon.run_job(tickers, models, destination_path, on_progress=on_progress)
+        logger.warning("背景服務未執行，改為直接在本程式中執行。")
+    if user_settings.get("scraper_engine") == "cdp":
+        from .cdp_scraper import run_cdp_engine
+        return run_cdp_engine(tickers, models, destination_path, user_settings, on_progress=on_progress,
+                              on_login_required=on_login_required)
+    run = AutomationRun(tickers, models, destination_path, user_settings, on_login_required=on_login_required,
+                        on_progress=on_progress)
+    if on_run is not None:
+        on_run(run)
+    return run.execute()
 
-        if not scraper.setup_driver():
-            raise Exception(f"[Port {port}] 無法連接到 WebDriver。")
 
-        if not scraper.check_login_status():
-            raise Exception(f"[Port {port}] 使用者未登入。請先手動執行一次程式並登入。")
+def _log_summary(result):
+    all_failed_tickers = result.failed_tickers
+    total_tasks = result.total_tasks
+    success_count = total_tasks - len(all_failed_tickers)
+    summary_msg = f"任務完成! 總計: {total_tasks}, 成功: {success_count}, 失敗: {len(all_failed_tickers)}"
+    if all_failed_tickers:
+        unique_failures = sorted(list(set(all_failed_tickers)))
+        summary_msg += f"\n失敗的項目 ({len(unique_failures)} 個): " + ", ".join(unique_failures)
+    if result.deferred:
+        summary_msg += f"\n為趕上完成期限而延後的項目 ({len(result.deferred)} 個): " + ", ".join(result.deferred)
+    logger.info(summary_msg)
 
-        logger.info(f"[Port {port}] WebDriver 設定成功，開始執行任務。")
-        scraper.run_automation(tickers, model, dest_path)
 
+def _load_saved_job(user_settings):
+    """
+    Reads the ticker file, models and destination saved by the GUI.
+    Returns (tickers, models, destination_path), or None after logging why
+    the job cannot run.
+    """
+    tickers_path = user_settings.get("last_ticker_path")
+    if not tickers_path or not os.path.exists(tickers_path):
+        logger.error(f"找不到 Ticker 檔案或路徑無效: {tickers_path}。任務中止。")
+        return None
+    
+    try:
+        tickers = load_ticker_file(tickers_path)
+        if not tickers:
+            logger.warning(f"Ticker 檔案 {tickers_path} 為空。任務結束。")
+            return None
+        logger.info(f"成功從 {tickers_path} 載入 {len(tickers)} 個 Tickers。")
     except Exception as e:
-        logger.error(f"處理模型 {model} 時發生錯誤: {e}", exc_info=True)
-        # Mark all tickers for this model as failed
-        scraper.failed_tickers.extend([f"{t} ({model})" for t in tickers])
-    finally:
-        if scraper.driver:
-            scraper.close_driver()
+        logger.error(f"讀取 Ticker 檔案 {tickers_path} 失敗: {e}", exc_info=True)
+        return None
+
+    selected_models = user_settings.get("last_selected_models", [])
+    destination_path = user_settings.get("last_destination_path", "")
+
+    if not all([selected_models, destination_path]):
+        logger.error("模型或儲存路徑未設定。請執行一次 GUI 模式來完成設定。任務中止。")
+        return None
+    logger.info(f"依 Ticker 檔案與選擇的模型，共需執行 {count_items(tickers, selected_models)} 項。")
+    return tickers, selected_models, destination_path
+
+
+def _should_run_today(user_settings, tickers, destination_path):
+    """
+    Checks today against the configured exchanges' trading calendar. On a
+    non-trading day the run is skipped, run anyway, or downgraded to a
+    freshness check of one ticker, depending on `non_trading_day_action`.
+    """
+    is_trading, description = market_calendar.trading_status(user_settings.get("market_exchanges", ["NYSE"]))
+    logger.info(description)
+    if is_trading:
+        return True
+
+    action = user_settings.get("non_trading_day_action", "check")
+    if action == "run":
+        logger.info("設定為非交易日仍執行完整任務。")
+        return True
+    if action == "skip":
+        logger.info("今天不是交易日，略過本次排程任務。")
+        return False
+
+    sentinel = user_settings.get("freshness_ticker") or tickers[0].ticker
+    logger.info(f"今天不是交易日，改為以 {sentinel} 檢查資料是否更新。")
+    if check_data_freshness(sentinel.upper(), destination_path):
+        logger.info("資料已更新，執行完整任務。")
+        return True
+    logger.info("資料未更新，略過本次排程任務。")
+    return False
+
 
 def run_automated_task():
     """
@@ -55,123 +129,287 @@ def run_automated_task():
         logger.info("排程未啟用，任務自動結束。")
         return
 
-    # 3. Load tickers
-    tickers_path = user_settings.get("last_ticker_path")
-    if not tickers_path or not os.path.exists(tickers_path):
-        logger.error(f"找不到 Ticker 檔案或路徑無效: {tickers_path}。任務中止。")
+    # 3. Load tickers, models and destination
+    job = _load_saved_job(user_settings)
+    if job is None:
         return
-    
+    tickers, selected_models, destination_path = job
+
+    # 4. Skip (or only spot-check) non-trading days
+    if not _should_run_today(user_settings, tickers, destination_path):
+        logger.info("--- 自動化排程任務結束 ---")
+        return
+
+    # 5. Run automation logic (shared with the GUI)
+    from .metrics import RunMetrics
+    run_metrics = RunMetrics()
+    result = None
     try:
-        with open(tickers_path, "r", encoding="utf-8") as f:
-            tickers = [line.strip().upper() for line in f if line.strip()]
-        if not tickers:
-            logger.warning(f"Ticker 檔案 {tickers_path} 為空。任務結束。")
-            return
-        logger.info(f"成功從 {tickers_path} 載入 {len(tickers)} 個 Tickers。")
+        result = execute_run(tickers, selected_models, destination_path, user_settings, on_progress=run_metrics.handle)
+
+        # 6. Log summary
+        _log_summary(result)
+
     except Exception as e:
-        logger.error(f"讀取 Ticker 檔案 {tickers_path} 失敗: {e}", exc_info=True)
+        logger.critical(f"自動化排程過程中發生未預期的嚴重錯誤: {e}", exc_info=True)
+    finally:
+        # 7. Leave the run's metrics for the monitoring's textfile collector
+        run_metrics.record_result(result)
+        run_metrics.write_textfile()
+        logger.info("--- 自動化排程任務結束 ---")
+
+
+def run_coordinated_task(worker_count=None):
+    """
+    Runs the saved job with one worker process per Chrome instance
+    (`--coordinator`), so a hung or crashed worker cannot stop the batch.
+    """
+    logger.info("--- 多程序自動化任務啟動 ---")
+    user_settings = settings.load_settings()
+    job = _load_saved_job(user_settings)
+    if job is None:
         return
+    tickers, selected_models, destination_path = job
+    from .distributed import Coordinator
+    from .metrics import RunMetrics
+    run_metrics = RunMetrics()
+    result = None
+    try:
+        coordinator = Coordinator(tickers, selected_models, destination_path, user_settings, worker_count=worker_count,
+                                  on_samples=run_metrics.record_samples)
+        result = coordinator.execute()
+        _log_summary(result)
+    except Exception as e:
+        logger.critical(f"多程序自動化過程中發生未預期的嚴重錯誤: {e}", exc_info=True)
+    finally:
+        run_metrics.record_result(result, duration=result.actual_makespan if result else None)
+        run_metrics.write_textfile()
+        logger.info("--- 多程序自動化任務結束 ---")
 
-    # 4. Get other settings
-    selected_models = user_settings.get("last_selected_models", [])
-    destination_path = user_settings.get("last_destination_path", "")
-    use_multi_window = user_settings.get("enable_multi_window", False)
 
-    if not all([selected_models, destination_path]):
-        logger.error("模型或儲存路徑未設定。請執行一次 GUI 模式來完成設定。任務中止。")
+def submit_tickers(tickers, models, destination_path):
+    """Sends an ad-hoc job to the running daemon (`--submit`)."""
+    from . import daemon
+    user_settings = settings.load_settings()
+    models = models or user_settings.get("last_selected_models", [])
+    destination_path = destination_path or user_settings.get("last_destination_path", "")
+    if not daemon.is_daemon_running():
+        logger.error("背景服務未執行。請先以 --daemon 啟動。")
         return
+    try:
+        _log_summary(daemon.run_job(tickers, models, destination_path))
+    except RuntimeError as e:
+        logger.error(f"背景服務工作失敗: {e}")
+
 
-    all_failed_tickers = []
-    scrapers = []
+def run_worker(args):
+    """Starts a worker process (`--worker`); also usable by hand on another machine sharing the queue file."""
+    from .distributed import run_worker_process
+    from .workqueue import SQLiteWorkQueue
+    queue_path = args.queue or config.WORK_QUEUE_FILE
+    run_id = args.run_id or SQLiteWorkQueue(queue_path).latest_open_run()
+    if run_id is None:
+        logger.info("佇列中沒有未完成的工作。")
+        return 0
+    port = args.port or chrome_launcher.allocate_worker_slots(args.worker_index + 1)[-1]['port']
+    return run_worker_process(queue_path, run_id, args.worker_index, port)
 
-    # 5. Run automation logic (adapted from gui.py)
+
+def record_task(har_path):
+    """Runs the saved job with one browser and records its network traffic (`--record`)."""
+    from .replay import record_session
+    user_settings = settings.load_settings()
+    job = _load_saved_job(user_settings)
+    if job is None:
+        return
+    tickers, selected_models, destination_path = job
+    logger.info(f"--- 錄製開始: {har_path} ---")
     try:
-        if use_multi_window:
-            logger.info("--- 自動化開始 (多視窗模式) ---")
-            if len(selected_models) > len(config.REMOTE_DEBUGGING_PORTS):
-                logger.error(f"選擇的模型數量 ({len(selected_models)}) 超過可用埠號數量 ({len(config.REMOTE_DEBUGGING_PORTS)})。")
-                return
-
-            profiles_to_launch = []
-            for i, model in enumerate(selected_models):
-                port = config.REMOTE_DEBUGGING_PORTS[i]
-                user_data_dir = config.get_chrome_user_data_dir(port)
-                profiles_to_launch.append({'port': port, 'user_data_dir': user_data_dir, 'model': model})
-                chrome_launcher._sync_profile_if_new(port, user_data_dir)
-            
-            threads = []
-            for profile in profiles_to_launch:
-                temp_path_for_port = config.get_temp_download_path_for_port(profile['port'])
-                scraper = LietaScraper(download_path=temp_path_for_port, port=profile['port'])
-                scrapers.append(scraper)
-                
-                thread = threading.Thread(
-                    target=_run_single_model_automated_task,
-                    args=(scraper, tickers.copy(), profile['model'], destination_path, profile['port'], profile['user_data_dir']),
-                    daemon=True
-                )
-                threads.append(thread)
-                thread.start()
-                time.sleep(1)
-
-            for thread in threads:
-                thread.join()
-
-        else: # Single window mode
-            logger.info("--- 自動化開始 (單視窗模式) ---")
-            port = config.REMOTE_DEBUGGING_PORTS[0]
-            user_data_dir = config.get_chrome_user_data_dir(port)
-            temp_path_for_port = config.get_temp_download_path_for_port(port)
-            
-            scraper = LietaScraper(download_path=temp_path_for_port, port=port)
-            scrapers.append(scraper)
-
-            if not chrome_launcher.launch_chrome_in_debug_mode(port, user_data_dir):
-                raise Exception("無法啟動 Chrome 偵錯實例。" )
-            
-            time.sleep(5)
-
-            if not scraper.setup_driver():
-                raise Exception("無法連接到 WebDriver。")
-
-            if not scraper.check_login_status():
-                raise Exception("使用者未登入。請先手動執行一次程式並登入。")
-
-            for model in selected_models:
-                failed_for_model = scraper.run_automation(tickers.copy(), model, destination_path)
-                all_failed_tickers.extend(failed_for_model)
-            
-            if scraper.driver:
-                scraper.close_driver()
+        record_session(tickers, selected_models, destination_path, har_path)
+    except Exception as e:
+        logger.critical(f"錄製過程中發生未預期的嚴重錯誤: {e}", exc_info=True)
 
-        # 6. Log summary
-        for scraper in scrapers:
-            all_failed_tickers.extend(scraper.failed_tickers)
-        
-        total_tasks = len(selected_models) * len(tickers)
-        success_count = total_tasks - len(all_failed_tickers)
-        summary_msg = f"任務完成! 總計: {total_tasks}, 成功: {success_count}, 失敗: {len(all_failed_tickers)}"
-        if all_failed_tickers:
-            unique_failures = sorted(list(set(all_failed_tickers)))
-            summary_msg += f"\n失敗的項目 ({len(unique_failures)} 個): " + ", ".join(unique_failures)
-        logger.info(summary_msg)
 
+def replay_task(har_path, port=None, latency_scale=1.0):
+    """Serves a recording as a local stand-in for the Lieta site (`--replay`)."""
+    from .replay import ReplayServer
+    server = ReplayServer(har_path, port=port, latency_scale=latency_scale)
+    logger.info(f"以 --base-url {server.base_url} 讓自動化改連至重播伺服器。")
+    server.serve_forever()
+
+
+def soak_task(ticker_count, models, har_path=None, latency_scale=0.0, replay_port=None):
+    """
+    Runs a soak test (`--soak N`) against a local stand-in site: the replay
+    server for `har_path` started in this process, or `--base-url`.
+    Returns the process exit code (1 when a memory budget is exceeded).
+    """
+    from .soak import run_soak_test
+    if har_path:
+        from .replay import ReplayServer
+        server = ReplayServer(har_path, port=replay_port, latency_scale=latency_scale)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        config.set_base_url(server.base_url)
+    elif config.LIETA_BASE_URL == config.DEFAULT_LIETA_BASE_URL:
+        logger.error("壓力測試不可對正式網站執行。請以 --soak-har 或 --base-url 指定本機重播伺服器。")
+        return 2
+    user_settings = settings.load_settings()
+    models = models or user_settings.get("last_selected_models", [])
+    if not models:
+        logger.error("未指定模型。請以 --models 指定或先執行一次 GUI 模式。")
+        return 2
+    try:
+        return 0 if run_soak_test(ticker_count, models, user_settings) else 1
     except Exception as e:
-        logger.critical(f"自動化排程過程中發生未預期的嚴重錯誤: {e}", exc_info=True)
-    finally:
-        logger.info("--- 自動化排程任務結束 ---")
+        logger.critical(f"壓力測試過程中發生未預期的嚴重錯誤: {e}", exc_info=True)
+        return 1
+
+
+def engine_benchmark_task(ticker_count, models=None, tabs=None):
+    """
+    Compares the Selenium and CDP engines on the first `ticker_count`
+    tickers of the saved job (`--engine-benchmark N`). Use `--base-url` to
+    benchmark against a replay server instead of the live site.
+    """
+    from .engine_benchmark import run_engine_benchmark
+    user_settings = settings.load_settings()
+    job = _load_saved_job(user_settings)
+    if job is None:
+        return
+    tickers, selected_models, _ = job
+    try:
+        run_engine_benchmark(tickers[:ticker_count], models or selected_models[:1], user_settings, tabs)
+    except Exception as e:
+        logger.critical(f"引擎效能比較過程中發生未預期的嚴重錯誤: {e}", exc_info=True)
+
+
+def replicate_task(retry_failed=False):
+    """
+    Copies what is left in the replication outbox to the configured
+    `replica_destination` (`--replicate`), e.g. after an interrupted run.
+    Returns the process exit code (1 if files are left or failed).
+    """
+    from .replication import FAILED, PENDING, replicator_for
+    user_settings = settings.load_settings()
+    replicator = replicator_for(user_settings.get("last_destination_path", ""), user_settings)
+    if replicator is None:
+        logger.error("未設定複寫目的地或儲存路徑。請在 GUI 的設定中指定。")
+        return 2
+    if retry_failed:
+        logger.info(f"已將 {replicator.outbox.retry_failed(replicator.target_root)} 個先前失敗的檔案重新排入複寫佇列。")
+    replicator.start()
+    done = replicator.drain()
+    counts = replicator.outbox.counts(replicator.target_root)
+    replicator.close(timeout=0)
+    return 0 if done and not counts[FAILED] and not counts[PENDING] else 1
+
+
+def analyze_logs_task(log_dir=None, since=None, top=10, output_path=None):
+    """Prints failure rates, latency percentiles and slowest tickers from the log files (`--analyze-logs`)."""
+    from .log_analytics import LogAnalytics, build_report, format_report
+    report = build_report(LogAnalytics(log_dir or None).collect(), since=since, top=top)
+    print(format_report(report))
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n已將報告寫入 {output_path}")
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Lieta Research 自動化工具")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--run-automated", action="store_true", help="以儲存的設定執行無介面排程任務")
+    mode.add_argument("--daemon", action="store_true", help="啟動背景服務，保持已登入的瀏覽器並接收工作")
+    mode.add_argument("--submit", nargs="+", metavar="TICKER", help="將指定的 Tickers 送交背景服務")
+    mode.add_argument("--coordinator", action="store_true", help="以儲存的設定執行，每個 Chrome 由獨立的工作程序驅動")
+    mode.add_argument("--worker", action="store_true", help="(由 --coordinator 啟動) 從共用佇列領取項目的工作程序")
+    mode.add_argument("--record", metavar="HAR", help="以單一瀏覽器執行儲存的任務，並將網路流量錄製為 HAR 檔")
+    mode.add_argument("--replay", metavar="HAR", help="啟動本機重播伺服器，以錄製的內容與延遲模擬 Lieta 網站")
+    mode.add_argument("--analyze-logs", nargs="?", const="", metavar="DIR", help="分析日誌檔 (預設為程式資料夾)：失敗率、延遲百分位數、最慢的 Tickers")
+    mode.add_argument("--startup-benchmark", action="store_true", help="測量啟動時的匯入耗時，超過預算或載入不應載入的模組時以代碼 1 結束")
+    mode.add_argument("--soak", type=int, metavar="N", help="以 N 個合成 Tickers 對本機重播網站執行記憶體壓力測試")
+    mode.add_argument("--replicate", action="store_true", help="將複寫佇列中尚未完成的檔案複製到複寫目的地後結束")
+    mode.add_argument("--engine-benchmark", type=int, nargs="?", const=10, metavar="N", help="以儲存任務的前 N 個 Tickers (預設 10) 比較 Selenium 與 CDP 引擎的速度與資源用量")
+    parser.add_argument("--models", nargs="+", help="--submit 使用的模型 (預設為上次選擇的模型；--engine-benchmark 預設為第一個)")
+    parser.add_argument("--destination", help="--submit 使用的儲存路徑 (預設為上次的儲存路徑)")
+    parser.add_argument("--workers", type=int, help="--coordinator 的工作程序數 (預設依設定或系統資源決定)")
+    parser.add_argument("--queue", help="--worker 使用的佇列檔案")
+    parser.add_argument("--run-id", type=int, help="--worker 要處理的工作編號 (預設為最早未完成的工作)")
+    parser.add_argument("--worker-index", type=int, default=0, help="--worker 使用的 Chrome 設定檔編號")
+    parser.add_argument("--port", type=int, help="--worker 使用的偵錯埠")
+    parser.add_argument("--replay-port", type=int, help="--replay 伺服器的連接埠 (預設 %d)" % config.REPLAY_PORT)
+    parser.add_argument("--latency-scale", type=float, help="--replay/--soak-har 的延遲倍率 (0 = 不延遲；預設 --replay 為 1，--soak 為 0)")
+    parser.add_argument("--soak-har", metavar="HAR", help="--soak 使用的錄製檔，在本程序內啟動重播伺服器")
+    parser.add_argument("--since", metavar="YYYY-MM-DD", help="--analyze-logs 只統計此日期之後 (Ticker 統計以月份為單位)")
+    parser.add_argument("--top", type=int, default=10, help="--analyze-logs 每個排行列出的筆數")
+    parser.add_argument("--analysis-output", metavar="JSON", help="--analyze-logs 另將報告寫入 JSON 檔")
+    parser.add_argument("--profile", action="store_true", help="記錄各線程的執行區段，結束時輸出可在 Perfetto 開啟的追蹤檔 (GUI 與各種執行模式皆可)")
+    parser.add_argument("--profile-sample", action="store_true", help="搭配 --profile，另取樣所有線程的呼叫堆疊並輸出熱點函式報告")
+    parser.add_argument("--retry-failed", action="store_true", help="--replicate 時一併重試多次失敗的檔案")
+    parser.add_argument("--tabs", type=int, help="--engine-benchmark 中 CDP 引擎使用的分頁數 (預設 %d)" % config.CDP_TABS_PER_BROWSER)
+    parser.add_argument("--base-url", help="改連至其他 Lieta 網址，例如重播伺服器 http://127.0.0.1:%d" % config.REPLAY_PORT)
+    args = parser.parse_args()
+    if args.soak is not None and args.soak < 1:
+        parser.error("--soak 的 Ticker 數必須至少為 1")
+    if args.engine_benchmark is not None and args.engine_benchmark < 1:
+        parser.error("--engine-benchmark 的 Ticker 數必須至少為 1")
+    if args.tabs is not None and args.tabs < 1:
+        parser.error("--tabs 必須至少為 1")
+    return args
 
 
 def main():
     """
     Main entry point for the application.
-    Checks for an automation flag and runs either the GUI or the headless task.
+    Checks the command-line flags and runs the GUI, the headless task,
+    the daemon or a daemon client.
     """
-    # Check for the headless/automated run flag
-    if "--run-automated" in sys.argv:
+    args = _parse_args()
+    if args.base_url:
+        config.set_base_url(args.base_url)
+    if not (args.profile or args.profile_sample):
+        _run_mode(args)
+        return
+    from . import tracing
+    tracing.start(sample=args.profile_sample)
+    try:
+        _run_mode(args)
+    finally:
+        tracing.stop()
+
+
+def _run_mode(args):
+    if args.run_automated:
         run_automated_task()
+    elif args.daemon:
+        from . import daemon
+        daemon.AutomationDaemon().serve_forever()
+    elif args.submit:
+        submit_tickers(args.submit, args.models, args.destination)
+    elif args.coordinator:
+        run_coordinated_task(args.workers)
+    elif args.worker:
+        sys.exit(run_worker(args))
+    elif args.record:
+        record_task(args.record)
+    elif args.replay:
+        replay_task(args.replay, args.replay_port, 1.0 if args.latency_scale is None else args.latency_scale)
+    elif args.analyze_logs is not None:
+        analyze_logs_task(args.analyze_logs, args.since, args.top, args.analysis_output)
+    elif args.startup_benchmark:
+        from .startup_benchmark import run_startup_benchmark
+        sys.exit(0 if run_startup_benchmark() else 1)
+    elif args.soak is not None:
+        sys.exit(soak_task(args.soak, args.models, args.soak_har, args.latency_scale or 0.0, args.replay_port))
+    elif args.replicate:
+        sys.exit(replicate_task(args.retry_failed))
+    elif args.engine_benchmark is not None:
+        engine_benchmark_task(args.engine_benchmark, args.models, args.tabs)
     else:
         # Original GUI startup
+        import tkinter as tk
+        from tkinter import messagebox
+        from .gui import TickerApp
         try:
             logger.info("正在啟動 GUI...")
             root = tk.Tk()
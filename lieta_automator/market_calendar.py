@@ -0,0 +1,151 @@
+import json
+import os
+from datetime import date, datetime, timedelta
+
+from . import config
+from .logger import logger
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError: # Python < 3.9: fall back to the local date.
+    ZoneInfo = None
+
+# Closures outside the regular rules (national days of mourning, weather).
+_NYSE_SPECIAL_CLOSURES = {
+    date(2004, 6, 11), # President Reagan
+    date(2007, 1, 2), # President Ford
+    date(2012, 10, 29), # Hurricane Sandy
+    date(2012, 10, 30),
+    date(2018, 12, 5), # President G. H. W. Bush
+    date(2025, 1, 9), # President Carter
+}
+
+# Exchanges with a bundled calendar, and the time zone their trading day is counted in.
+# US equity and option venues share the NYSE holiday schedule.
+EXCHANGES = {
+    "NYSE": "America/New_York",
+    "NASDAQ": "America/New_York",
+    "CBOE": "America/New_York",
+}
+
+
+def _nth_weekday(year, month, weekday, n):
+    """The n-th `weekday` (0 = Monday) of a month; n = -1 gives the last one."""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    next_month = date(year + month // 12, month % 12 + 1, 1)
+    last = next_month - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _easter(year):
+    """Gregorian Easter Sunday (anonymous Gregorian algorithm)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _observed(day):
+    """Saturday holidays move to Friday, Sunday holidays to Monday."""
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+def nyse_holidays(year):
+    """Full-day NYSE closures of a year, from the exchange's holiday rules."""
+    holidays = set()
+    new_year = date(year, 1, 1)
+    # A New Year's Day on Saturday is not made up on the Friday before.
+    if new_year.weekday() != 5:
+        holidays.add(_observed(new_year))
+    holidays.add(_nth_weekday(year, 1, 0, 3)) # Martin Luther King Jr. Day
+    holidays.add(_nth_weekday(year, 2, 0, 3)) # Washington's Birthday
+    holidays.add(_easter(year) - timedelta(days=2)) # Good Friday
+    holidays.add(_nth_weekday(year, 5, 0, -1)) # Memorial Day
+    if year >= 2022:
+        holidays.add(_observed(date(year, 6, 19))) # Juneteenth
+    holidays.add(_observed(date(year, 7, 4))) # Independence Day
+    holidays.add(_nth_weekday(year, 9, 0, 1)) # Labor Day
+    holidays.add(_nth_weekday(year, 11, 3, 4)) # Thanksgiving
+    holidays.add(_observed(date(year, 12, 25))) # Christmas
+    holidays.update(d for d in _NYSE_SPECIAL_CLOSURES if d.year == year)
+    return holidays
+
+
+def _load_user_holidays():
+    """
+    Extra closures from `market_holidays.json`, e.g.
+    {"NYSE": ["2026-12-24"], "TWSE": ["2026-02-16", ...]}.
+    """
+    path = config.MARKET_HOLIDAYS_FILE
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return {
+            exchange.upper(): {date.fromisoformat(d) for d in dates}
+            for exchange, dates in data.items()
+        }
+    except (json.JSONDecodeError, OSError, ValueError, AttributeError, TypeError) as e:
+        logger.warning(f"無法讀取休市日檔案 {path}: {e}")
+        return {}
+
+
+def _exchange_today(exchange, now=None):
+    """Today's date in the exchange's time zone (the local date if it is unknown)."""
+    tz_name = EXCHANGES.get(exchange)
+    if now is not None:
+        return now.date()
+    if tz_name and ZoneInfo is not None:
+        try:
+            return datetime.now(ZoneInfo(tz_name)).date()
+        except ZoneInfoNotFoundError:
+            # Windows has no time zone database unless the `tzdata` package is installed.
+            pass
+    return date.today()
+
+
+def is_trading_day(exchange, day, user_holidays=None):
+    exchange = exchange.upper()
+    if day.weekday() >= 5:
+        return False
+    if user_holidays and day in user_holidays.get(exchange, set()):
+        return False
+    if exchange in EXCHANGES and day in nyse_holidays(day.year):
+        return False
+    return True
+
+
+def trading_status(exchanges, now=None):
+    """
+    Checks today against each configured exchange. Returns
+    (is_trading, description); the day counts as a trading day when any of
+    the exchanges is open.
+    """
+    user_holidays = _load_user_holidays()
+    open_exchanges, closed = [], []
+    for exchange in exchanges:
+        exchange = exchange.upper()
+        if exchange not in EXCHANGES and exchange not in user_holidays:
+            logger.warning(f"沒有 {exchange} 的內建休市日資料，只會排除週末 (可在 market_holidays.json 補充)。")
+        day = _exchange_today(exchange, now)
+        if is_trading_day(exchange, day, user_holidays):
+            open_exchanges.append(f"{exchange} {day}")
+        else:
+            closed.append(f"{exchange} {day}")
+    if open_exchanges:
+        return True, "交易日: " + ", ".join(open_exchanges)
+    return False, "非交易日: " + ", ".join(closed)
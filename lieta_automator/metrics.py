@@ -0,0 +1,269 @@
+import math
+import os
+import threading
+import time
+
+from . import config, progress
+from .logger import logger
+from .supervisor import chrome_process_rss
+
+# Content types of the two exposition formats `render()` produces.
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self, openmetrics):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def header(self, openmetrics):
+        # OpenMetrics names the counter family without the "_total" suffix its samples carry.
+        name = self.name[:-len("_total")] if openmetrics else self.name
+        return [f"# HELP {name} {self.help}", f"# TYPE {name} counter"]
+
+    def samples(self):
+        with self._lock:
+            return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=None):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets or config.METRICS_SECONDS_BUCKETS)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    le = (("le", _number(float(bound))),)
+                    lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {count}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, key)} {counts[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(round(total, 3))}")
+        return lines
+
+
+class RunMetrics:
+    """
+    Turns the progress events of runs (`AutomationRun(on_progress=...)`)
+    into counters, histograms and gauges in the Prometheus text format:
+
+    - items attempted / succeeded / failed (by model and failure reason),
+      and items re-queued after a browser crash
+    - seconds per scrape phase (submit, chart_load, download, extract) and per item
+    - active workers, Chrome RSS per port, run duration and outcome
+
+    One instance lives as long as the process, so counters accumulate over
+    the daemon's jobs. `handle()` is thread safe.
+    """
+
+    def __init__(self):
+        self.attempted = Counter("lieta_items_attempted_total", "Item attempts; a re-queued item counts again.", ["model"])
+        self.succeeded = Counter("lieta_items_succeeded_total", "Items saved successfully.", ["model"])
+        self.failed = Counter("lieta_items_failed_total", "Items that failed, by the step they failed in.", ["model", "reason"])
+        self.requeued = Counter("lieta_items_requeued_total", "Items re-queued after their browser crashed.", ["model"])
+        self.runs = Counter("lieta_runs_total", "Finished runs.")
+        self.phase_seconds = Histogram("lieta_scrape_phase_seconds", "Seconds spent in each step of an item.", ["model", "phase"])
+        self.item_seconds = Histogram("lieta_item_seconds", "Seconds from submitting a ticker to its saved output.", ["model"])
+        self.active_workers = Gauge("lieta_active_workers", "Workers currently running items.")
+        self.chrome_rss = Gauge("lieta_chrome_rss_bytes", "Resident memory of a worker's Chrome processes.", ["port"])
+        self.run_in_progress = Gauge("lieta_run_in_progress", "1 while a run is executing.")
+        self.run_duration = Gauge("lieta_run_duration_seconds", "Duration of the current or last run.")
+        self.run_items = Gauge("lieta_last_run_items", "Items planned for the last finished run.")
+        self.run_failed_items = Gauge("lieta_last_run_failed_items", "Items the last finished run could not save.")
+        self.run_completed = Gauge("lieta_last_run_completed", "1 if the last run ran to the end, 0 if it was aborted.")
+        self.run_timestamp = Gauge("lieta_last_run_finished_timestamp_seconds", "Unix time the last run finished.")
+        self._metrics = [
+            self.attempted, self.succeeded, self.failed, self.requeued, self.runs,
+            self.phase_seconds, self.item_seconds,
+            self.active_workers, self.chrome_rss,
+            self.run_in_progress, self.run_duration, self.run_items, self.run_failed_items,
+            self.run_completed, self.run_timestamp,
+        ]
+        self._lock = threading.Lock()
+        self._run_started = None
+        self._active_ports = set()
+        self._rss_sampled = {}
+        self.active_workers.set(0)
+        self.run_in_progress.set(0)
+
+    def handle(self, event):
+        kind = event.get("event")
+        if kind == "run_started":
+            with self._lock:
+                self._run_started = time.monotonic()
+                self._active_ports.clear()
+            self.run_in_progress.set(1)
+            self.active_workers.set(0)
+        elif kind == "worker_state":
+            self._worker_state(event["port"], event["state"])
+        elif kind == "item_finished":
+            self._item_finished(event)
+        elif kind == "run_finished":
+            with self._lock:
+                duration = time.monotonic() - self._run_started if self._run_started else None
+                self._run_started = None
+                self._active_ports.clear()
+            if duration is not None:
+                self.run_duration.set(round(duration, 1))
+            self.run_in_progress.set(0)
+            self.active_workers.set(0)
+
+    def _worker_state(self, port, state):
+        with self._lock:
+            if state == progress.FINISHED:
+                self._active_ports.discard(port)
+            else:
+                self._active_ports.add(port)
+            active = len(self._active_ports)
+        self.active_workers.set(active)
+        if state == progress.FINISHED:
+            self._sample_chrome_rss(port, force=True)
+
+    def _item_finished(self, event):
+        model = event["model"]
+        self.attempted.inc(model=model)
+        if event.get("ok"):
+            self.succeeded.inc(model=model)
+            if event.get("seconds") is not None:
+                self.item_seconds.observe(event["seconds"], model=model)
+        elif event.get("requeued"):
+            self.requeued.inc(model=model)
+        else:
+            self.failed.inc(model=model, reason=event.get("reason") or "unknown")
+        for phase, seconds in (event.get("phases") or {}).items():
+            self.phase_seconds.observe(seconds, model=model, phase=phase)
+        if "port" in event:
+            self._sample_chrome_rss(event["port"])
+
+    def _sample_chrome_rss(self, port, force=False):
+        # Finding the Chrome process scans the TCP table, so it is done at most every few seconds per port.
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._rss_sampled.get(port, -math.inf) < config.METRICS_RSS_SAMPLE_SECONDS:
+                return
+            self._rss_sampled[port] = now
+        rss = chrome_process_rss(port)
+        if rss is not None:
+            self.chrome_rss.set(rss, port=port)
+
+    def record_samples(self, samples):
+        """Counts timing samples of items processed elsewhere (worker processes of `--coordinator`)."""
+        for sample in samples:
+            self._item_finished({"ok": True, **sample})
+
+    def record_result(self, result, duration=None):
+        """
+        Records the outcome of a finished run (`RunResult`, or None if the
+        run was aborted by an error). `duration` is only needed for runs
+        that did not report progress events.
+        """
+        self.runs.inc()
+        self.run_completed.set(0 if result is None else 1)
+        if result is not None:
+            self.run_items.set(result.total_tasks)
+            self.run_failed_items.set(len(result.failed_tickers))
+        self.run_timestamp.set(round(time.time()))
+        if duration is not None:
+            self.run_duration.set(round(duration, 1))
+
+    def render(self, openmetrics=False):
+        """Returns every metric in the Prometheus text format, or in OpenMetrics when asked to."""
+        if self._run_started is not None:
+            self.run_duration.set(round(time.monotonic() - self._run_started, 1))
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.header(openmetrics))
+            lines.extend(metric.samples())
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path=None):
+        """
+        Writes the metrics for node_exporter's textfile collector. The file
+        is written next to its final name and renamed into place, so the
+        collector never reads a partial file.
+        """
+        path = path or config.METRICS_TEXTFILE_PATH
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8", newline="\n") as f:
+                f.write(self.render())
+            os.replace(temp_path, path)
+            logger.info(f"已寫入執行指標: {path}")
+        except OSError as e:
+            logger.warning(f"無法寫入執行指標檔案 {path}: {e}")
+
+
+def wants_openmetrics(accept_header):
+    return "application/openmetrics-text" in (accept_header or "")
@@ -0,0 +1,217 @@
+import errno
+import gzip
+import hashlib
+import json
+import os
+import queue
+import shutil
+import threading
+from datetime import datetime
+
+from . import config, tracing
+from .changes import describe_chart_change, latest_output
+from .logger import logger
+
+
+class DownloadJob:
+    """
+    A finished browser download that still has to be moved into
+    `<destination>/<model>/<TICKER>/`, hashed, optionally compressed and indexed.
+    """
+
+    def __init__(self, source_path, destination_path, model, ticker, port=None):
+        self.source_path = source_path
+        self.destination_path = destination_path
+        self.model = model
+        self.ticker = ticker.upper()
+        self.port = port
+        # Take the timestamp when the download finished, not when a pipeline
+        # worker eventually gets around to it.
+        self.timestamp = datetime.now().strftime("%Y-%m-%d_%H;%M")
+
+    @property
+    def label(self):
+        return f"{self.ticker} ({self.model})"
+
+    @tracing.traced("post_process", cat="pipeline")
+    def process(self, pipeline):
+        target_dir = os.path.join(self.destination_path, self.model, self.ticker)
+        os.makedirs(target_dir, exist_ok=True)
+        new_filename = f"{self.timestamp}_{self.ticker}_{self.model}.html"
+
+        # Hash and compress while the file is still in the download directory,
+        # so the destination only ever receives the finished file.
+        source_path = self.source_path
+        sha256 = _sha256_of(source_path) if pipeline.hash_files else None
+        change = None
+        if pipeline.changes is not None:
+            with tracing.span("detect_change", cat="pipeline"):
+                change = describe_chart_change(source_path, latest_output(target_dir))
+        if pipeline.compress:
+            source_path = _gzip_in_place(source_path)
+            new_filename += ".gz"
+
+        new_filepath = os.path.join(target_dir, new_filename)
+        _atomic_move(source_path, new_filepath)
+
+        relative_path = os.path.relpath(new_filepath, self.destination_path)
+        entry = {
+            "model": self.model,
+            "ticker": self.ticker,
+            "path": relative_path,
+            "size": os.path.getsize(new_filepath),
+            "sha256": sha256,
+            "saved_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        if change is not None:
+            entry["change"] = change
+            pipeline.changes.record(self.model, self.ticker, change, path=relative_path)
+        pipeline.add_to_index(self.destination_path, entry)
+        if pipeline.replicator is not None:
+            # The index hash is of the uncompressed file; a compressed copy is checked against its source.
+            pipeline.replicator.submit(new_filepath, None if pipeline.compress else sha256)
+        logger.info(f"成功: [Port:{self.port}|{self.model}] {new_filename} 已儲存。")
+
+
+@tracing.traced("move", cat="pipeline")
+def _atomic_move(source_path, target_path):
+    """
+    Moves a file so that readers of `target_path` never see a partial file.
+    Within one filesystem (direct-download staging) this is a single rename;
+    across volumes the copy goes to a hidden temp name that is renamed last.
+    """
+    try:
+        os.replace(source_path, target_path)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    target_dir, target_name = os.path.split(target_path)
+    part_path = os.path.join(target_dir, f".{target_name}.part")
+    try:
+        shutil.copyfile(source_path, part_path)
+        os.replace(part_path, target_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    os.remove(source_path)
+
+
+def reset_download_dir(path):
+    """
+    Creates a download directory, discarding leftovers (e.g. `.crdownload`
+    files) from a previous run that was interrupted.
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+@tracing.traced("sha256", cat="pipeline")
+def _sha256_of(filepath, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@tracing.traced("gzip", cat="pipeline")
+def _gzip_in_place(filepath):
+    """Compresses `filepath` to `filepath.gz` and removes the original."""
+    gz_path = filepath + ".gz"
+    with open(filepath, "rb") as src, gzip.open(gz_path, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(filepath)
+    return gz_path
+
+
+class PostProcessingPipeline:
+    """
+    A bounded, in-process worker pool that finalises scraper output off the
+    browser threads.
+
+    `submit()` blocks once `max_pending` jobs are waiting, so a slow disk or
+    network share throttles the scrapers instead of growing memory without
+    bound. `close()` waits for every queued job before returning.
+    """
+
+    _STOP = object()
+
+    def __init__(self, workers=None, max_pending=None, compress=False, hash_files=True, changes=None, replicator=None):
+        self.workers = workers or config.PIPELINE_WORKERS
+        self.compress = compress
+        self.hash_files = hash_files
+        # A `changes.ChangeDetector`: each chart is compared with the previous output of its (model, ticker).
+        self.changes = changes
+        # A `replication.Replicator`: every saved file is queued for copying to the secondary destination.
+        self.replicator = replicator
+        self.failed_items = []
+        self._queue = queue.Queue(maxsize=max_pending or config.PIPELINE_MAX_PENDING)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._file_locks = {}
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"pipeline-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"後處理管線已啟動 ({self.workers} 個工作執行緒)。")
+        return self
+
+    def submit(self, job):
+        """Queues a job, blocking while the pipeline is at capacity (backpressure)."""
+        if self._queue.full():
+            logger.info(f"[Port {job.port}] 後處理管線已滿，等待磁碟寫入完成...")
+        self._queue.put(job)
+
+    def drain(self):
+        """Blocks until every submitted job has been processed."""
+        self._queue.join()
+
+    def close(self):
+        """Drains the queue and stops the worker threads. Safe to call twice."""
+        if not self._threads:
+            return
+        self.drain()
+        for _ in self._threads:
+            self._queue.put(self._STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self.failed_items:
+            logger.warning(f"後處理管線中有 {len(self.failed_items)} 個項目失敗。")
+        logger.info("後處理管線已清空並關閉。")
+
+    def file_lock(self, path):
+        with self._lock:
+            return self._file_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+    @tracing.traced("index", cat="pipeline")
+    def add_to_index(self, destination_path, entry):
+        """Appends an entry to the destination's JSONL output index."""
+        index_path = os.path.join(destination_path, config.OUTPUT_INDEX_FILENAME)
+        with self.file_lock(index_path):
+            with open(index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is self._STOP:
+                    return
+                self.run_job(job)
+            finally:
+                self._queue.task_done()
+
+    def run_job(self, job):
+        """Processes a single job, recording it as failed instead of raising."""
+        try:
+            job.process(self)
+        except Exception as e:
+            logger.error(f"失敗: [Port:{job.port}|{job.model}] - {job.ticker} 後處理失敗。原因: {e}", exc_info=True)
+            with self._lock:
+                self.failed_items.append(job.label)
@@ -0,0 +1,239 @@
+import json
+import os
+import threading
+from collections import deque
+
+from . import config
+from .logger import logger
+from .tickers import DEFAULT_PRIORITY, normalize
+
+
+class TimingHistory:
+    """
+    Per-model and per-(model, ticker) cost estimates, kept as exponentially
+    weighted moving averages in `run_timings.json` next to the settings file.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.TIMING_HISTORY_FILE
+        self.models = {}
+        self.items = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=None):
+        history = cls(path)
+        if os.path.exists(history.path):
+            try:
+                with open(history.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                history.models = data.get("models", {})
+                history.items = data.get("items", {})
+            except (json.JSONDecodeError, IOError) as e:
+                logger.warning(f"無法讀取歷史耗時紀錄 {history.path}，將使用預設估計值: {e}")
+        return history
+
+    def save(self):
+        with self._lock:
+            data = {"models": self.models, "items": self.items}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def estimate(self, model, ticker):
+        """Expected seconds for one (model, ticker) item."""
+        item = self.items.get(_item_key(model, ticker))
+        if item is not None:
+            return item
+        model_stats = self.models.get(model)
+        if model_stats is not None:
+            return model_stats["seconds"]
+        return config.DEFAULT_MODEL_COSTS.get(model, config.DEFAULT_ITEM_COST)
+
+    def record(self, model, ticker, seconds):
+        alpha = config.TIMING_HISTORY_ALPHA
+        key = _item_key(model, ticker)
+        with self._lock:
+            previous = self.items.get(key)
+            self.items[key] = round(seconds if previous is None else (1 - alpha) * previous + alpha * seconds, 3)
+            stats = self.models.setdefault(model, {"seconds": seconds, "samples": 0})
+            stats["seconds"] = round((1 - alpha) * stats["seconds"] + alpha * seconds, 3)
+            stats["samples"] += 1
+
+    def record_samples(self, samples):
+        """Folds in the `timings` samples collected by the scrapers."""
+        for sample in samples:
+            self.record(sample["model"], sample["ticker"], sample["seconds"])
+
+
+def _item_key(model, ticker):
+    return f"{model}|{ticker.upper()}"
+
+
+class WorkItem:
+    """A single (model, ticker) unit of work with its estimated cost."""
+
+    def __init__(self, model, ticker, cost, priority=DEFAULT_PRIORITY):
+        self.model = model
+        self.ticker = ticker
+        self.cost = cost
+        self.priority = priority
+        # Times the item was interrupted by a browser crash and re-queued.
+        self.attempts = 0
+
+    @property
+    def label(self):
+        return f"{self.ticker} ({self.model})"
+
+
+class RunPlan:
+    """The outcome of `plan_run`: an ordered list of work items per port."""
+
+    def __init__(self, ports):
+        self.assignments = {port: [] for port in ports}
+        self.predicted_load = {port: 0.0 for port in ports}
+
+    @property
+    def total_items(self):
+        return sum(len(items) for items in self.assignments.values())
+
+    @property
+    def predicted_makespan(self):
+        return max(self.predicted_load.values(), default=0.0)
+
+    def describe(self):
+        lines = []
+        for port, items in self.assignments.items():
+            models = sorted({item.model for item in items})
+            lines.append(f"Port {port}: {len(items)} 項 ({', '.join(models) or '無'})，預估 {self.predicted_load[port] / 60:.1f} 分鐘")
+        return "\n".join(lines)
+
+
+def plan_run(tickers, models, ports, history=None):
+    """
+    Assigns every (model, ticker) pair to a port so the expected finish times
+    are as even as possible. `tickers` may be plain strings or `TickerSpec`s;
+    a spec that lists its own models only gets items for those.
+
+    Uses longest-processing-time-first within each priority level: items are
+    sorted by priority, then estimated cost, and each goes to the port with
+    the least expected load, where starting a model a port has not used yet
+    also pays `MODEL_SWITCH_COST`. Each port then processes its items by
+    priority, grouped by model, in ticker-file order.
+    """
+    history = history or TimingHistory.load()
+    plan = RunPlan(ports)
+    specs = normalize(tickers)
+    items = [
+        WorkItem(model, spec.ticker, history.estimate(model, spec.ticker), spec.priority)
+        for model in models for spec in specs if spec.wants(model)
+    ]
+    port_models = {port: set() for port in ports}
+
+    for item in sorted(items, key=lambda it: (-it.priority, -it.cost)):
+        def expected_load(port):
+            switch = 0 if item.model in port_models[port] else config.MODEL_SWITCH_COST
+            return plan.predicted_load[port] + switch + item.cost
+
+        port = min(ports, key=expected_load)
+        plan.predicted_load[port] = expected_load(port)
+        port_models[port].add(item.model)
+        plan.assignments[port].append(item)
+
+    model_order = {model: i for i, model in enumerate(models)}
+    ticker_order = {}
+    for i, spec in enumerate(specs):
+        ticker_order.setdefault(spec.ticker, i)
+    for port in ports:
+        plan.assignments[port].sort(key=lambda it: (-it.priority, model_order[it.model], ticker_order[it.ticker]))
+    return plan
+
+
+class PlanQueue:
+    """
+    Thread-safe dispenser over a `RunPlan`.
+
+    Each port first works through its own planned items. A port that runs
+    dry steals from the tail of the port with the most remaining expected
+    work, preferring items of the model it already has selected, so the
+    plan stays balanced when ports start late, get throttled or fail.
+    """
+
+    def __init__(self, plan):
+        self._queues = {port: deque(items) for port, items in plan.assignments.items()}
+        self._remaining = {port: sum(item.cost for item in items) for port, items in plan.assignments.items()}
+        self._lock = threading.Lock()
+
+    def has_work(self):
+        with self._lock:
+            return any(self._queues.values())
+
+    def take(self, port, current_model=None):
+        """Returns the next item for `port`, or None when all work is handed out."""
+        with self._lock:
+            own = self._queues.setdefault(port, deque())
+            if own:
+                item = own.popleft()
+                self._remaining[port] -= item.cost
+                return item
+
+            candidates = [p for p, q in self._queues.items() if q]
+            if not candidates:
+                return None
+            victim = max(candidates, key=lambda p: self._remaining[p])
+            queue = self._queues[victim]
+            item = None
+            for i in range(len(queue) - 1, -1, -1):
+                if queue[i].model == current_model:
+                    item = queue[i]
+                    del queue[i]
+                    break
+            if item is None:
+                item = queue.pop()
+            self._remaining[victim] -= item.cost
+            logger.info(f"[Port {port}] 從 Port {victim} 接手 {item.label}。")
+            return item
+
+    def put_back(self, port, item):
+        """Returns an unfinished item to the front of a port's queue."""
+        with self._lock:
+            self._queues.setdefault(port, deque()).appendleft(item)
+            self._remaining[port] = self._remaining.get(port, 0) + item.cost
+
+    def remaining_cost(self):
+        """Estimated seconds of work not handed out yet."""
+        with self._lock:
+            return sum(self._remaining.values())
+
+    def defer_until_fits(self, capacity):
+        """
+        Removes items, lowest priority and latest in line first, until the
+        estimated cost of what is left is at most `capacity`. Items of the
+        highest priority in the queue are never removed. Returns the removed items.
+        """
+        with self._lock:
+            pending = [(port, item) for port, queue in self._queues.items() for item in queue]
+            if not pending:
+                return []
+            top_priority = max(item.priority for _, item in pending)
+            total = sum(item.cost for _, item in pending)
+            candidates = [(port, item) for port, item in reversed(pending) if item.priority < top_priority]
+            candidates.sort(key=lambda pair: pair[1].priority) # stable: keeps the latest-first order per priority
+            removed = []
+            for port, item in candidates:
+                if total <= capacity:
+                    break
+                self._queues[port].remove(item)
+                self._remaining[port] -= item.cost
+                total -= item.cost
+                removed.append(item)
+            return removed
+
+    def drain(self):
+        """Removes and returns every item that was never handed out."""
+        with self._lock:
+            items = [item for queue in self._queues.values() for item in queue]
+            for queue in self._queues.values():
+                queue.clear()
+            return items
@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import deque
+
+from . import config
+
+# Worker states shown in the progress panel.
+STARTING = "啟動中"
+RUNNING = "執行中"
+RESTARTING = "重新啟動"
+FINISHED = "已結束"
+
+
+def _rate_per_minute(times):
+    """Items per minute over a window of completion times (monotonic seconds)."""
+    if len(times) < 2 or times[-1] <= times[0]:
+        return None
+    return (len(times) - 1) / (times[-1] - times[0]) * 60
+
+
+def _quantile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class ProgressTracker:
+    """
+    Aggregates the progress events of a run (`AutomationRun(on_progress=...)`)
+    into a snapshot for a dashboard. Events are dicts with an "event" key:
+
+        run_started     total, ports
+        worker_state    port, state
+        item_started    port, model, ticker
+        item_finished   port, model, ticker, ok, seconds, chart_load_seconds, requeued,
+                        phases ({step: seconds}), reason (step a failure happened in)
+        items_deferred  count
+        run_finished
+
+    `handle()` is cheap and thread safe, so workers can call it directly;
+    readers poll `snapshot()` at their own pace.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.total = 0
+            self.done = 0
+            self.failed = 0
+            self.finished = False
+            self.ports = {}
+            self._finish_times = deque(maxlen=config.PROGRESS_RATE_WINDOW)
+            self._latencies = deque(maxlen=config.PROGRESS_LATENCY_WINDOW)
+
+    def _port(self, port):
+        return self.ports.setdefault(port, {
+            "state": STARTING, "model": "", "ticker": "", "done": 0,
+            "_times": deque(maxlen=config.PROGRESS_RATE_WINDOW),
+        })
+
+    def handle(self, event):
+        kind = event.get("event")
+        now = time.monotonic()
+        with self._lock:
+            if kind == "run_started":
+                self.total = event["total"]
+                for port in event.get("ports", []):
+                    self._port(port)
+            elif kind == "worker_state":
+                self._port(event["port"])["state"] = event["state"]
+            elif kind == "item_started":
+                port = self._port(event["port"])
+                port.update(state=RUNNING, model=event["model"], ticker=event["ticker"])
+            elif kind == "item_finished" and not event.get("requeued"):
+                port = self._port(event["port"])
+                port["done"] += 1
+                port["_times"].append(now)
+                port["ticker"] = ""
+                self.done += 1
+                self._finish_times.append(now)
+                if not event.get("ok"):
+                    self.failed += 1
+                elif event.get("chart_load_seconds") is not None:
+                    self._latencies.append(event["chart_load_seconds"])
+            elif kind == "items_deferred":
+                self.total -= event["count"]
+            elif kind == "run_finished":
+                self.finished = True
+                for port in self.ports.values():
+                    port["state"] = FINISHED
+                    port["ticker"] = ""
+
+    def snapshot(self):
+        """Returns the current totals, throughput, ETA, latency percentiles and per-port rows."""
+        with self._lock:
+            rate = _rate_per_minute(self._finish_times)
+            remaining = max(0, self.total - self.done)
+            latencies = sorted(self._latencies)
+            return {
+                "total": self.total,
+                "done": self.done,
+                "failed": self.failed,
+                "finished": self.finished,
+                "rate_per_minute": rate,
+                "eta_seconds": remaining / rate * 60 if rate and remaining else (0 if self.finished else None),
+                "p50": _quantile(latencies, 0.50) if latencies else None,
+                "p95": _quantile(latencies, 0.95) if latencies else None,
+                "ports": [
+                    {"port": port, "state": row["state"], "model": row["model"], "ticker": row["ticker"],
+                     "done": row["done"], "rate_per_minute": _rate_per_minute(row["_times"])}
+                    for port, row in sorted(self.ports.items())
+                ],
+            }
@@ -0,0 +1,396 @@
+import base64
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from . import config
+from .logger import logger
+from .runner import WorkerPool
+from .tickers import normalize
+
+_SCRUBBED = "[scrubbed]"
+# Recorded content types that may contain absolute URLs to rewrite during replay.
+_TEXT_TYPES = ("text/", "javascript", "json", "xml", "svg")
+
+
+def _is_scrubbed_field(name):
+    name = name.lower()
+    return any(field in name for field in config.RECORDING_SCRUBBED_FIELDS)
+
+
+def _is_scrubbed_param(name):
+    return name.lower() in config.RECORDING_SCRUBBED_PARAMS or _is_scrubbed_field(name)
+
+
+def scrub_headers(headers):
+    """Returns HAR header entries with credential values removed."""
+    return [
+        {"name": name, "value": _SCRUBBED if name.lower() in config.RECORDING_SCRUBBED_HEADERS else str(value)}
+        for name, value in (headers or {}).items()
+    ]
+
+
+def scrub_url(url):
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = [(k, _SCRUBBED if _is_scrubbed_param(k) else v) for k, v in parse_qsl(parts.query, keep_blank_values=True)]
+    return parts._replace(query=urlencode(query)).geturl()
+
+
+def scrub_json_text(text):
+    """Removes the values of credential-like keys from a JSON document; other text is returned as is."""
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return text
+
+    def scrub(value):
+        if isinstance(value, dict):
+            return {k: (_SCRUBBED if _is_scrubbed_field(k) else scrub(v)) for k, v in value.items()}
+        if isinstance(value, list):
+            return [scrub(v) for v in value]
+        return value
+
+    return json.dumps(scrub(data), ensure_ascii=False)
+
+
+def scrub_form_text(text):
+    """Removes the values of credential-like fields from an application/x-www-form-urlencoded body."""
+    fields = parse_qsl(text, keep_blank_values=True)
+    return urlencode([(k, _SCRUBBED if _is_scrubbed_param(k) else v) for k, v in fields])
+
+
+# A quoted string assigned to a key, in embedded JSON or script: "csrfToken": "..." / authToken = '...'
+_QUOTED_VALUE = re.compile(r"""(["']?)([\w$.-]+)\1(\s*[:=]\s*)(["'])((?:\\.|(?!\4).)*)\4""")
+# <meta name="csrf-token" content="..."> and hidden <input name="session" value="...">
+_TAG = re.compile(r"<(?:meta|input)\b[^>]*>", re.IGNORECASE)
+_TAG_NAME = re.compile(r"""\b(?:name|id|property)\s*=\s*["']([^"']*)["']""", re.IGNORECASE)
+_TAG_VALUE = re.compile(r"""(\b(?:content|value)\s*=\s*)(["'])[^"']*\2""", re.IGNORECASE)
+
+
+def scrub_text(text):
+    """
+    Removes credential-like values embedded in an HTML or script body: string
+    values of credential-like keys and the content of credential-like meta
+    tags and inputs. The document structure is kept, so it still replays.
+    """
+    def scrub_value(match):
+        if not _is_scrubbed_field(match.group(2)):
+            return match.group(0)
+        return f"{match.group(1)}{match.group(2)}{match.group(1)}{match.group(3)}{match.group(4)}{_SCRUBBED}{match.group(4)}"
+
+    def scrub_tag(match):
+        name = _TAG_NAME.search(match.group(0))
+        if name is None or not _is_scrubbed_field(name.group(1)):
+            return match.group(0)
+        return _TAG_VALUE.sub(lambda value: f"{value.group(1)}{value.group(2)}{_SCRUBBED}{value.group(2)}", match.group(0))
+
+    return _TAG.sub(scrub_tag, _QUOTED_VALUE.sub(scrub_value, text))
+
+
+def scrub_body(text, mime_type):
+    """Scrubs a recorded request or response body according to its content type."""
+    mime_type = (mime_type or "").lower()
+    if "x-www-form-urlencoded" in mime_type:
+        return scrub_form_text(text)
+    if "json" in mime_type:
+        scrubbed = scrub_json_text(text)
+        return scrubbed if scrubbed is not text else scrub_text(text)
+    if not mime_type:
+        # Request bodies often come without a recorded type.
+        scrubbed = scrub_json_text(text)
+        if scrubbed is not text:
+            return scrubbed
+        if "=" in text and not any(c.isspace() or c in "{}<>" for c in text):
+            return scrub_form_text(text)
+        return scrub_text(text)
+    if any(t in mime_type for t in _TEXT_TYPES):
+        return scrub_text(text)
+    return text
+
+
+def _header(headers, name):
+    return next((str(v) for k, v in (headers or {}).items() if k.lower() == name), "")
+
+
+class HarRecorder:
+    """
+    Turns the network events of a scraper (Network.* CDP events) into a
+    HAR 1.2 document with per-request timing, scrubbed of cookies,
+    authorization headers and credential-like fields.
+
+    Works with either engine: the scraper provides `start_network_capture()`,
+    `network_events()` and `response_body(request_id)`. With the Selenium
+    engine, call `collect()` regularly (e.g. after every ticker): response
+    bodies can only be fetched while Chrome still holds them.
+    """
+
+    def __init__(self, scraper):
+        self.scraper = scraper
+        self.entries = []
+        self._pending = {}
+
+    def start(self):
+        self.scraper.start_network_capture()
+
+    def collect(self):
+        for method, params in self.scraper.network_events():
+            if method == "Network.requestWillBeSent":
+                self._on_request(params)
+            elif method == "Network.responseReceived":
+                pending = self._pending.get(params["requestId"])
+                if pending is not None:
+                    pending["response"] = params["response"]
+            elif method == "Network.loadingFinished":
+                self._on_finished(params)
+            elif method == "Network.loadingFailed":
+                self._pending.pop(params.get("requestId"), None)
+
+    def _on_request(self, params):
+        request_id = params["requestId"]
+        previous = self._pending.pop(request_id, None)
+        if previous is not None and params.get("redirectResponse"):
+            # A redirect reuses the request id; the previous hop ends here.
+            previous["response"] = params["redirectResponse"]
+            self._add_entry(previous, params["timestamp"], body=None)
+        self._pending[request_id] = {
+            "request": params["request"],
+            "started": params["timestamp"],
+            "wall_time": params.get("wallTime", time.time()),
+            "response": None,
+        }
+
+    def _on_finished(self, params):
+        pending = self._pending.pop(params["requestId"], None)
+        if pending is None or pending["response"] is None:
+            return
+        body = None
+        try:
+            body = self.scraper.response_body(params["requestId"])
+        except Exception:
+            pass # Bodies of some requests (e.g. preflights, evicted resources) are unavailable.
+        self._add_entry(pending, params["timestamp"], body)
+
+    def _add_entry(self, pending, finished, body):
+        request, response = pending["request"], pending["response"]
+        total_ms = max(0.0, (finished - pending["started"]) * 1000)
+        timing = response.get("timing") or {}
+        wait_ms = None
+        if timing.get("receiveHeadersEnd") is not None and timing.get("sendEnd") is not None:
+            wait_ms = max(0.0, timing["receiveHeadersEnd"] - timing["sendEnd"])
+        if wait_ms is None or wait_ms > total_ms:
+            wait_ms = total_ms
+
+        content = {"size": 0, "mimeType": response.get("mimeType", "")}
+        if body is not None:
+            text = body.get("body", "")
+            if body.get("base64Encoded"):
+                content["encoding"] = "base64"
+            else:
+                text = scrub_body(text, content["mimeType"])
+            content["text"] = text
+            content["size"] = len(text)
+
+        post_data = request.get("postData")
+        post_type = _header(request.get("headers"), "content-type")
+        self.entries.append({
+            "startedDateTime": datetime.fromtimestamp(pending["wall_time"], timezone.utc).isoformat(),
+            "time": round(total_ms, 3),
+            "request": {
+                "method": request.get("method", "GET"),
+                "url": scrub_url(request["url"]),
+                "httpVersion": response.get("protocol", "HTTP/1.1"),
+                "headers": scrub_headers(request.get("headers")),
+                "queryString": [],
+                "cookies": [],
+                "headersSize": -1,
+                "bodySize": len(post_data) if post_data else 0,
+                **({"postData": {"mimeType": post_type, "text": scrub_body(post_data, post_type)}} if post_data else {}),
+            },
+            "response": {
+                "status": response.get("status", 200),
+                "statusText": response.get("statusText", ""),
+                "httpVersion": response.get("protocol", "HTTP/1.1"),
+                "headers": scrub_headers(response.get("headers")),
+                "cookies": [],
+                "content": content,
+                "redirectURL": scrub_url(_header(response.get("headers"), "location")),
+                "headersSize": -1,
+                "bodySize": content["size"],
+            },
+            "cache": {},
+            "timings": {"send": 0, "wait": round(wait_ms, 3), "receive": round(total_ms - wait_ms, 3)},
+        })
+
+    def save(self, path):
+        har = {"log": {
+            "version": "1.2",
+            "creator": {"name": "lieta_automator", "version": "1"},
+            "pages": [],
+            "entries": self.entries,
+        }}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(har, f, ensure_ascii=False)
+        logger.info(f"已錄製 {len(self.entries)} 個請求至 {path}。")
+
+
+def record_session(tickers, models, destination_path, har_path):
+    """
+    Runs `tickers` x `models` with a single browser while recording its
+    network traffic to `har_path` (`--record`).
+    """
+    specs = normalize(tickers)
+    pool = WorkerPool(1)
+    slot, scraper = pool.slots[0], pool.scrapers[0]
+    scraper.capture_network = True
+    scraper.begin_run(config.get_download_path(destination_path, slot['port'], False))
+    recorder = HarRecorder(scraper)
+    try:
+        pool.prepare_profiles()
+        pool.start_worker(slot, scraper)
+        recorder.start()
+        for model in models:
+            if not scraper.select_model(model):
+                continue
+            for spec in specs:
+                if spec.wants(model):
+                    scraper.process_ticker(model, spec.ticker, destination_path)
+                    recorder.collect()
+            scraper.flush_tv_code(destination_path)
+        recorder.collect()
+    finally:
+        recorder.save(har_path)
+        pool.shutdown()
+
+
+class ReplayServer:
+    """
+    Serves a HAR recording over plain HTTP on 127.0.0.1, with each response
+    delayed by its recorded wait and receive times multiplied by
+    `latency_scale` (0 = as fast as possible).
+
+    Requests are matched by method, path and query; repeated requests cycle
+    through the recorded responses. Absolute URLs of recorded origins in
+    text responses are rewritten to `/_origin/<host>/...` on this server,
+    so pages keep working offline. WebSocket traffic is not replayed.
+    """
+
+    def __init__(self, har_path, port=None, latency_scale=1.0):
+        self.port = port or config.REPLAY_PORT
+        self.latency_scale = latency_scale
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        with open(har_path, "r", encoding="utf-8") as f:
+            entries = json.load(f)["log"]["entries"]
+        self.primary_host = urlsplit(config.LIETA_BASE_URL).netloc
+        self._routes = {}
+        self._cursor = {}
+        self._lock = threading.Lock()
+        hosts = set()
+        for entry in entries:
+            url = urlsplit(entry["request"]["url"])
+            hosts.add(url.netloc)
+            self._routes.setdefault(self._route_key(entry["request"]["method"], url.netloc, url.path, url.query), []).append(entry)
+        self._origin_pattern = re.compile("|".join(
+            re.escape(f"{scheme}://{host}") for host in sorted(hosts, key=len, reverse=True) for scheme in ("https", "http")
+        ) or r"(?!)")
+        logger.info(f"已載入 {len(entries)} 個錄製的請求 ({len(hosts)} 個來源)。")
+
+    @staticmethod
+    def _route_key(method, host, path, query):
+        return method.upper(), host, path or "/", query
+
+    def _rewrite(self, text):
+        def replace(match):
+            host = match.group(0).split("://", 1)[1]
+            if host == self.primary_host:
+                return self.base_url
+            return f"{self.base_url}/_origin/{host}"
+        return self._origin_pattern.sub(replace, text)
+
+    def find(self, method, raw_path):
+        """Returns the recorded entry for a request to this server, or None."""
+        url = urlsplit(raw_path)
+        host, path = self.primary_host, url.path
+        if path.startswith("/_origin/"):
+            host, _, rest = path[len("/_origin/"):].partition("/")
+            path = "/" + rest
+        candidates = self._routes.get(self._route_key(method, host, path, url.query))
+        if candidates is None:
+            # Fall back to the same path with any query (cache-busting parameters, scrubbed tokens).
+            candidates = next((v for k, v in self._routes.items() if k[:3] == (method.upper(), host, path)), None)
+        if not candidates:
+            return None
+        with self._lock:
+            key = (method.upper(), host, path)
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+        return candidates[index % len(candidates)]
+
+    def body_of(self, entry):
+        content = entry["response"]["content"]
+        text = content.get("text")
+        if text is None:
+            return b""
+        if content.get("encoding") == "base64":
+            return base64.b64decode(text)
+        if any(kind in content.get("mimeType", "") for kind in _TEXT_TYPES):
+            text = self._rewrite(text)
+        return text.encode("utf-8")
+
+    def serve_forever(self):
+        server = ThreadingHTTPServer(("127.0.0.1", self.port), _make_replay_handler(self))
+        server.daemon_threads = True
+        logger.info(f"重播伺服器已啟動: {self.base_url} (延遲倍率 {self.latency_scale})")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+
+def _make_replay_handler(replay):
+    # Hop-by-hop and length headers are recomputed for the replayed body.
+    skipped_headers = {"content-length", "content-encoding", "transfer-encoding", "connection"}
+
+    class _ReplayHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _replay(self):
+            length = int(self.headers.get("Content-Length", 0) or 0)
+            if length:
+                self.rfile.read(length)
+            entry = replay.find(self.command, self.path)
+            if entry is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                logger.warning(f"重播: 沒有符合的錄製內容 {self.command} {self.path}")
+                return
+
+            timings = entry.get("timings", {})
+            time.sleep(max(0.0, timings.get("wait", 0)) / 1000 * replay.latency_scale)
+            body = replay.body_of(entry)
+            response = entry["response"]
+            self.send_response(response["status"], response.get("statusText") or None)
+            for header in response["headers"]:
+                name = header["name"]
+                if name.lower() in skipped_headers or header["value"] == _SCRUBBED:
+                    continue
+                value = replay._rewrite(header["value"]) if name.lower() == "location" else header["value"]
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            time.sleep(max(0.0, timings.get("receive", 0)) / 1000 * replay.latency_scale)
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = do_OPTIONS = do_PATCH = _replay
+
+    return _ReplayHandler
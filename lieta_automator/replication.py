@@ -0,0 +1,344 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import config
+from .logger import logger
+from .pipeline import _sha256_of
+
+# Outbox entry states. Copied entries are deleted.
+PENDING = "pending"
+LEASED = "leased"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source_path TEXT NOT NULL,
+    target_path TEXT NOT NULL,
+    sha256 TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    lease_expires REAL,
+    error TEXT,
+    enqueued_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_by_status ON outbox(status, not_before);
+"""
+
+
+class ReplicationError(Exception):
+    """A copy could not be verified against its source."""
+
+
+class SourceMissingError(ReplicationError):
+    """The file to copy was deleted before it was replicated; retrying cannot help."""
+
+
+class ReplicationOutbox:
+    """
+    The files still to be copied to a secondary destination, kept in a
+    SQLite file so replication interrupted by a crash or a closed program
+    resumes where it stopped, without rescanning the destination.
+
+    Like `workqueue.SQLiteWorkQueue`, entries are leased while they are
+    copied, every state change is a transaction and each thread has its
+    own connection, so worker processes can add entries to the same file.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.REPLICATION_OUTBOX_FILE
+        self._local = threading.local()
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def add(self, source_path, target_path, sha256=None):
+        """
+        Queues a copy. A file rewritten before its previous version was
+        copied (e.g. the day's TV Code files) is queued once.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            updated = conn.execute(
+                "UPDATE outbox SET sha256 = ?, enqueued_at = ? WHERE target_path = ? AND status = ?",
+                (sha256, time.time(), target_path, PENDING)
+            ).rowcount
+            if not updated:
+                conn.execute(
+                    "INSERT INTO outbox (source_path, target_path, sha256, status, enqueued_at) VALUES (?, ?, ?, ?, ?)",
+                    (source_path, target_path, sha256, PENDING, time.time())
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def claim(self, limit, target_root=None):
+        """Leases up to `limit` entries that are due (or whose lease ran out); returns them as rows."""
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            query = ("SELECT * FROM outbox WHERE ((status = ? AND not_before <= ?) OR (status = ? AND lease_expires < ?))")
+            params = [PENDING, now, LEASED, now]
+            if target_root is not None:
+                query += " AND substr(target_path, 1, ?) = ?"
+                params += _below(target_root)
+            rows = conn.execute(query + " ORDER BY id LIMIT ?", params + [limit]).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET status = ?, lease_expires = ? WHERE id = ?",
+                [(LEASED, now + config.REPLICATION_LEASE_SECONDS, row["id"]) for row in rows]
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def finish(self, results):
+        """
+        Records a copied batch in one transaction: `results` holds (row,
+        error, retry) triples, error None for a verified copy. Failed
+        entries are retried with a growing delay, up to
+        `REPLICATION_MAX_ATTEMPTS`, unless `retry` is False.
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for row, error, retry in results:
+                if error is None:
+                    conn.execute("DELETE FROM outbox WHERE id = ?", (row["id"],))
+                    continue
+                attempts = row["attempts"] + 1
+                status = FAILED if not retry or attempts >= config.REPLICATION_MAX_ATTEMPTS else PENDING
+                delay = config.REPLICATION_RETRY_SECONDS * 2 ** (attempts - 1)
+                conn.execute(
+                    "UPDATE outbox SET status = ?, attempts = ?, not_before = ?, lease_expires = NULL, error = ? WHERE id = ?",
+                    (status, attempts, now + delay, error, row["id"])
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def counts(self, target_root=None):
+        """Returns {status: entries} (pending, leased, failed)."""
+        query, params = "SELECT status, COUNT(*) AS n FROM outbox", []
+        if target_root is not None:
+            query += " WHERE substr(target_path, 1, ?) = ?"
+            params += _below(target_root)
+        rows = self._connection().execute(query + " GROUP BY status", params).fetchall()
+        counts = {PENDING: 0, LEASED: 0, FAILED: 0}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+    def due(self, target_root=None):
+        """Number of pending entries that may be copied now (not waiting to retry)."""
+        query, params = "SELECT COUNT(*) FROM outbox WHERE status = ? AND not_before <= ?", [PENDING, time.time()]
+        if target_root is not None:
+            query += " AND substr(target_path, 1, ?) = ?"
+            params += _below(target_root)
+        return self._connection().execute(query, params).fetchone()[0]
+
+    def retry_failed(self, target_root=None):
+        """Puts entries that ran out of attempts back in line; returns how many."""
+        query, params = "UPDATE outbox SET status = ?, attempts = 0, not_before = 0 WHERE status = ?", [PENDING, FAILED]
+        if target_root is not None:
+            query += " AND substr(target_path, 1, ?) = ?"
+            params += _below(target_root)
+        return self._connection().execute(query, params).rowcount
+
+
+def _below(target_root):
+    prefix = os.path.join(target_root, "")
+    return [len(prefix), prefix]
+
+
+def _copy_verified(source_path, target_path, expected_sha256=None):
+    """
+    Copies a file through a temp file next to the target, hashing the source
+    as it is read, then reads the copy back and compares the hashes before
+    renaming it into place.
+    """
+    if os.path.exists(target_path) and os.path.getsize(target_path) == os.path.getsize(source_path):
+        # Copied before an interruption, but not yet marked done.
+        if _sha256_of(target_path) == (expected_sha256 or _sha256_of(source_path)):
+            return
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    temp_path = f"{target_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    digest = hashlib.sha256()
+    try:
+        with open(source_path, "rb") as source, open(temp_path, "wb") as target:
+            for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                digest.update(chunk)
+                target.write(chunk)
+        source_sha256 = digest.hexdigest()
+        if expected_sha256 and source_sha256 != expected_sha256:
+            raise ReplicationError(f"來源檔案與索引中的雜湊不符: {source_path}")
+        if _sha256_of(temp_path) != source_sha256:
+            raise ReplicationError(f"複本的雜湊與來源不符: {target_path}")
+        os.replace(temp_path, target_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class Replicator:
+    """
+    Mirrors the outputs saved in `source_root` to `target_root` (e.g. a
+    network share) in the background.
+
+    `submit()` only records the file in the outbox, so it is cheap enough
+    for the post-processing pipeline and works from any process. Once
+    started, a background thread leases up to `REPLICATION_BATCH_SIZE`
+    files at a time, copies them with at most `REPLICATION_WORKERS`
+    parallel copies, verifies each copy's SHA-256 and records the batch.
+    """
+
+    def __init__(self, source_root, target_root, outbox=None, workers=None, batch_size=None):
+        self.source_root = os.path.abspath(source_root)
+        self.target_root = os.path.abspath(target_root)
+        self.outbox = outbox or ReplicationOutbox()
+        self.workers = workers or config.REPLICATION_WORKERS
+        self.batch_size = batch_size or config.REPLICATION_BATCH_SIZE
+        self.copied = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    def submit(self, path, sha256=None):
+        """Queues a file below `source_root` for replication. `sha256`, if known, is checked against the source."""
+        try:
+            relative_path = os.path.relpath(os.path.abspath(path), self.source_root)
+            self.outbox.add(os.path.abspath(path), os.path.join(self.target_root, relative_path), sha256)
+            self._wake.set()
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"無法將 {path} 加入複寫佇列: {e}")
+
+    def start(self):
+        counts = self.outbox.counts(self.target_root)
+        if counts[PENDING] or counts[LEASED]:
+            logger.info(f"複寫佇列中有 {counts[PENDING] + counts[LEASED]} 個先前未完成的檔案，將繼續複寫。")
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="replication")
+        self._thread = threading.Thread(target=self._loop, name="replication", daemon=True)
+        self._thread.start()
+        logger.info(f"複寫已啟動: {self.source_root} -> {self.target_root} (最多 {self.workers} 個平行複製)。")
+        return self
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                batch = self.outbox.claim(self.batch_size, self.target_root)
+            except sqlite3.Error as e:
+                logger.error(f"讀取複寫佇列失敗: {e}")
+                batch = []
+            if not batch:
+                self._wake.wait(config.REPLICATION_POLL_SECONDS)
+                self._wake.clear()
+                continue
+            results = list(self._executor.map(self._copy, batch))
+            try:
+                self.outbox.finish(results)
+            except sqlite3.Error as e:
+                logger.error(f"更新複寫佇列失敗，這批檔案將在租約到期後重新複製: {e}")
+                continue
+            failed = [row for row, error, _ in results if error is not None]
+            self.copied += len(results) - len(failed)
+            if failed:
+                logger.warning(f"複寫: {len(results) - len(failed)} 個檔案完成，{len(failed)} 個失敗，稍後重試。")
+            else:
+                logger.info(f"複寫: 已複製並驗證 {len(results)} 個檔案。")
+
+    def _copy(self, row):
+        try:
+            if not os.path.exists(row["source_path"]):
+                raise SourceMissingError(f"來源檔案已不存在: {row['source_path']}")
+            _copy_verified(row["source_path"], row["target_path"], row["sha256"])
+            return row, None, True
+        except Exception as e:
+            logger.warning(f"複寫 {row['source_path']} 失敗: {e}")
+            return row, str(e), not isinstance(e, SourceMissingError)
+
+    def drain(self, timeout=None):
+        """
+        Waits until no file of this destination is waiting to be copied, or
+        `timeout` seconds. Stops early when the only files left wait to be
+        retried (e.g. the share is offline). Returns True if everything was
+        copied.
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else config.REPLICATION_DRAIN_SECONDS)
+        while True:
+            counts = self.outbox.counts(self.target_root)
+            if not counts[PENDING] and not counts[LEASED]:
+                return True
+            if time.monotonic() >= deadline or (not counts[LEASED] and not self.outbox.due(self.target_root)):
+                return False
+            self._wake.set()
+            time.sleep(0.5)
+
+    def close(self, timeout=None):
+        """Drains the outbox for up to `timeout` seconds and stops; what is left resumes next time."""
+        if self._thread is None:
+            self.outbox.close()
+            return
+        done = self.drain(timeout)
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._executor.shutdown()
+        self._thread = None
+        counts = self.outbox.counts(self.target_root)
+        if not done:
+            logger.warning(f"複寫尚有 {counts[PENDING] + counts[LEASED]} 個檔案未完成，將在下次執行或 --replicate 時繼續。")
+        if counts[FAILED]:
+            logger.error(f"複寫有 {counts[FAILED]} 個檔案多次重試仍失敗 (--replicate --retry-failed 可重新嘗試)。")
+        logger.info(f"複寫已停止，本次複製 {self.copied} 個檔案。")
+        self.outbox.close()
+
+
+def replicator_for(destination_path, user_settings):
+    """A `Replicator` for the run if `replica_destination` is set, else None."""
+    replica = (user_settings.get("replica_destination") or "").strip()
+    if not replica or not destination_path:
+        return None
+    if os.path.abspath(replica) == os.path.abspath(destination_path):
+        logger.error("複寫目的地不可與儲存路徑相同，已停用複寫。")
+        return None
+    return Replicator(destination_path, replica)
+
+
+def submit_run_files(replicator, destination_path, tv_code_sink=None, manifest_path=None):
+    """
+    Queues the files a run rewrites as a whole, once it ends: the output
+    index, the day's TV Code files and the run's changes manifest.
+    """
+    paths = [os.path.join(destination_path, config.OUTPUT_INDEX_FILENAME)]
+    if tv_code_sink is not None:
+        paths += [tv_code_sink.txt_path, tv_code_sink.json_path, tv_code_sink.csv_path]
+    if manifest_path is not None:
+        paths += [manifest_path, os.path.join(os.path.dirname(manifest_path), config.CHANGES_LATEST_FILENAME)]
+    for path in paths:
+        if os.path.isfile(path):
+            replicator.submit(path)
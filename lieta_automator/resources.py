@@ -0,0 +1,80 @@
+import os
+import sys
+
+from . import config
+from .logger import logger
+
+
+def _linux_available_memory():
+    # MemAvailable counts reclaimable page cache, unlike SC_AVPHYS_PAGES (free memory only).
+    with open("/proc/meminfo", "r", encoding="ascii") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+def available_memory_bytes():
+    """
+    Returns the physical memory available to new processes (including
+    reclaimable cache), or None if unknown.
+    """
+    from .supervisor import load_psutil
+    psutil = load_psutil()
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        if sys.platform == "win32":
+            import ctypes # Only needed here; kept out of start-up
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [
+                    ("dwLength", ctypes.c_ulong),
+                    ("dwMemoryLoad", ctypes.c_ulong),
+                    ("ullTotalPhys", ctypes.c_ulonglong),
+                    ("ullAvailPhys", ctypes.c_ulonglong),
+                    ("ullTotalPageFile", ctypes.c_ulonglong),
+                    ("ullAvailPageFile", ctypes.c_ulonglong),
+                    ("ullTotalVirtual", ctypes.c_ulonglong),
+                    ("ullAvailVirtual", ctypes.c_ulonglong),
+                    ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+                ]
+
+            status = MEMORYSTATUSEX()
+            status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return status.ullAvailPhys
+            return None
+        if sys.platform.startswith("linux"):
+            available = _linux_available_memory()
+            if available is not None:
+                return available
+        if hasattr(os, "sysconf") and "SC_AVPHYS_PAGES" in os.sysconf_names:
+            return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+
+def auto_worker_count():
+    """
+    Sizes the worker pool from the machine: one Chrome per spare CPU core,
+    limited by available memory and `config.MAX_WORKERS`.
+    """
+    cpu_limit = max(1, (os.cpu_count() or 2) - 1)
+    memory = available_memory_bytes()
+    memory_limit = config.MAX_WORKERS if memory is None else max(1, memory // (config.MEMORY_PER_WORKER_MB * 1024 * 1024))
+    count = min(config.MAX_WORKERS, cpu_limit, memory_limit)
+    memory_text = f"{memory / 1024 ** 3:.1f} GB" if memory is not None else "未知"
+    logger.info(f"依系統資源決定工作視窗數: {count} (CPU {os.cpu_count()} 核，可用記憶體 {memory_text})。")
+    return count
+
+
+def resolve_worker_count(user_settings):
+    """Returns the configured worker count, or the automatic one when it is 0."""
+    try:
+        configured = int(user_settings.get("worker_count", 0))
+    except (TypeError, ValueError):
+        configured = 0
+    if configured > 0:
+        return min(configured, config.MAX_WORKERS)
+    return auto_worker_count()
@@ -0,0 +1,435 @@
+import os
+import threading
+import time
+
+from . import chrome_launcher, config, progress, tracing
+from .changes import ChangeDetector
+from .concurrency import ConcurrencyController
+from .deadline import DeadlineGuard, parse_deadline
+from .logger import logger
+from .pipeline import PostProcessingPipeline, reset_download_dir
+from .planner import PlanQueue, TimingHistory, plan_run
+from .resources import resolve_worker_count
+from .supervisor import WorkerSupervisor
+from .tickers import TickerSpec, write_ticker_file
+from .tvcode import TvCodeCollector, TvCodeSink, latest_saved_code
+
+
+def initial_worker_count(user_settings, worker_count, model_count):
+    """Returns (workers to use, workers active at the start) for a pool of `worker_count`."""
+    if user_settings.get("adaptive_concurrency", True):
+        # The controller decides how many of these windows actually work.
+        return worker_count, min(config.ADAPTIVE_INITIAL_WORKERS, worker_count)
+    worker_count = min(model_count, worker_count)
+    return worker_count, worker_count
+
+
+def check_data_freshness(ticker, destination_path):
+    """
+    Cheap stand-in for a full run on a non-trading day: fetches the TV Code
+    of one ticker with a single browser and compares it with the last saved
+    one. Returns True when the data changed or cannot be compared, False
+    when it is unchanged.
+    """
+    previous = latest_saved_code(destination_path, ticker)
+    if previous is None:
+        logger.info(f"沒有 {ticker} 先前的 TV Code 可供比對，視為資料已更新。")
+        return True
+
+    pool = WorkerPool(1)
+    slot, scraper = pool.slots[0], pool.scrapers[0]
+    collector = TvCodeCollector()
+    scraper.begin_run(None, None, collector)
+    try:
+        pool.prepare_profiles()
+        pool.start_worker(slot, scraper)
+        if not scraper.select_model("TV Code") or not scraper.process_ticker("TV Code", ticker, destination_path):
+            logger.warning(f"無法取得 {ticker} 的 TV Code，視為資料已更新。")
+            return True
+        current = collector.take(ticker)
+    except Exception as e:
+        logger.warning(f"資料更新檢查失敗，視為資料已更新: {e}")
+        return True
+    finally:
+        pool.shutdown()
+
+    changed = current != previous.strip()
+    logger.info(f"資料更新檢查: {ticker} 的 TV Code {'已變更' if changed else '與上次相同'}。")
+    return changed
+
+
+def start_replicator(destination_path, user_settings, start=True):
+    """
+    Returns the run's `replication.Replicator` (started unless `start` is
+    False), or None when no `replica_destination` is configured.
+    """
+    if not user_settings.get("replica_destination"):
+        return None
+    from .replication import replicator_for # sqlite3 is only loaded when replication is on
+    replicator = replicator_for(destination_path, user_settings)
+    if replicator is not None and start:
+        replicator.start()
+    return replicator
+
+
+def finish_replication(replicator, destination_path, tv_code_sink=None, manifest_path=None):
+    """Queues the run's whole-file outputs and waits (bounded) for the copies to finish."""
+    from .replication import submit_run_files
+    try:
+        submit_run_files(replicator, destination_path, tv_code_sink, manifest_path)
+    finally:
+        replicator.close()
+
+
+class RunResult:
+    """Summary of a finished `AutomationRun`."""
+
+    def __init__(self, total_tasks, failed_tickers, predicted_makespan, actual_makespan, deferred=None):
+        self.total_tasks = total_tasks
+        self.failed_tickers = failed_tickers
+        self.predicted_makespan = predicted_makespan
+        self.actual_makespan = actual_makespan
+        # Labels of the items skipped to meet the run deadline (not counted in total_tasks).
+        self.deferred = deferred or []
+
+
+class WorkerPool:
+    """
+    The Chrome workers (port, profile and scraper) used by runs.
+
+    A one-shot run creates a pool and shuts it down when it finishes. The
+    daemon keeps a single pool alive, so later jobs start on browsers that
+    are already running, connected and logged in.
+    """
+
+    def __init__(self, worker_count, on_login_required=None, slots=None):
+        # `slots` lets a worker process run on the port/profile its coordinator assigned.
+        self.slots = slots or chrome_launcher.allocate_worker_slots(worker_count)
+        from .scraper import LietaScraper # Selenium is only loaded once browsers are needed
+        self.scrapers = [
+            LietaScraper(download_path=None, port=slot['port'], worker_index=slot['index'])
+            for slot in self.slots
+        ]
+        # Called (from a worker thread) when the primary Chrome is not logged in.
+        self.on_login_required = on_login_required
+
+    def __len__(self):
+        return len(self.slots)
+
+    def prepare_profiles(self):
+        # Syncing while another Chrome holds the primary profile open can hit file locks,
+        # so every profile is prepared BEFORE any Chrome instance is launched.
+        logger.info("階段 1: 準備並同步所有 Chrome 設定檔...")
+        for slot in self.slots:
+            chrome_launcher._sync_profile_if_new(slot['user_data_dir'])
+        logger.info("所有設定檔準備完成。")
+
+    @tracing.traced(cat="launcher")
+    def start_worker(self, slot, scraper):
+        """Launches and connects a worker's Chrome unless it is already running."""
+        port = slot['port']
+        if scraper.driver and scraper.is_alive():
+            logger.info(f"[Port {port}] 沿用已連線的瀏覽器。")
+            return
+
+        if not chrome_launcher.launch_chrome_in_debug_mode(port, slot['user_data_dir']):
+            raise Exception(f"[Port {port}] 無法啟動 Chrome 偵錯實例。")
+
+        logger.info(f"[Port {port}] 等待 Chrome 啟動...")
+        tracing.sleep(5)
+
+        if not scraper.setup_driver():
+            raise Exception(f"[Port {port}] 無法連接到 WebDriver。")
+
+        if not scraper.check_login_status():
+            if slot['index'] == 0 and self.on_login_required:
+                self.on_login_required()
+            raise Exception(f"[Port {port}] 使用者未登入。請先手動執行一次程式並登入。")
+
+        logger.info(f"[Port {port}] WebDriver 設定成功，開始執行任務。")
+
+    @tracing.traced(cat="launcher")
+    def restart_worker(self, slot, scraper):
+        port = slot['port']
+        logger.info(f"[Port {port}] 正在重新啟動瀏覽器...")
+        scraper.close_browser()
+        deadline = time.monotonic() + 15
+        while chrome_launcher.is_port_in_use(port) and time.monotonic() < deadline:
+            tracing.sleep(1)
+        self.start_worker(slot, scraper)
+        logger.info(f"[Port {port}] 瀏覽器已重新啟動。")
+
+    def warm_up(self, count):
+        """Starts the first `count` workers ahead of the first job."""
+        for slot, scraper in list(zip(self.slots, self.scrapers))[:count]:
+            try:
+                self.start_worker(slot, scraper)
+            except Exception as e:
+                logger.error(f"[Port {slot['port']}] 預先啟動失敗: {e}")
+
+    def shutdown(self):
+        for scraper in self.scrapers:
+            if scraper.driver:
+                scraper.close_driver()
+
+
+class AutomationRun:
+    """
+    Runs a ticker list against a set of models across one or more Chrome
+    instances. Shared by the GUI and the headless scheduled task.
+
+    The work is split by `planner.plan_run`, so each port receives a balanced
+    mix of (model, ticker) items instead of one whole model. In multi-window
+    mode a `ConcurrencyController` decides how many windows work at once.
+    """
+
+    def __init__(self, tickers, models, destination_path, user_settings, on_login_required=None, pool=None,
+                 on_progress=None, record_history=True):
+        self.tickers = tickers
+        self.models = models
+        self.destination_path = destination_path
+        self.user_settings = user_settings
+        # Called (from a worker thread) when the primary Chrome is not logged in.
+        self.on_login_required = on_login_required
+        # A long-lived pool (daemon mode); otherwise the run creates its own.
+        self.pool = pool
+        # Called (from worker threads) with progress event dicts, see progress.ProgressTracker.
+        self.on_progress = on_progress
+        # False for synthetic runs (soak test, engine benchmark), whose timings
+        # would skew the estimates the planner makes for real runs.
+        self.record_history = record_history
+        # Exposed so the GUI can close the drivers when the window is closed.
+        self.scrapers = []
+        self._deadline_guard = None
+
+    def _progress(self, event, **fields):
+        if self.on_progress is None:
+            return
+        try:
+            self.on_progress({"event": event, **fields})
+        except Exception as e:
+            logger.warning(f"進度回報失敗: {e}")
+
+    def _worker_counts(self):
+        """Returns how many workers to prepare and how many of them start out active."""
+        if self.pool is not None:
+            worker_count = len(self.pool)
+        elif not self.user_settings.get("enable_multi_window", False):
+            return 1, 1
+        else:
+            worker_count = resolve_worker_count(self.user_settings)
+        return initial_worker_count(self.user_settings, worker_count, len(self.models))
+
+    def execute(self):
+        worker_count, initial_workers = self._worker_counts()
+        owns_pool = self.pool is None
+        pool = self.pool or WorkerPool(worker_count, self.on_login_required)
+        self.scrapers.extend(pool.scrapers)
+        slots = pool.slots[:worker_count]
+        ports = [slot['port'] for slot in slots]
+        mode = "多視窗模式" if worker_count > 1 else "單視窗模式"
+        logger.info(f"--- 自動化開始 ({mode}) ---")
+
+        history = TimingHistory.load()
+        plan = plan_run(self.tickers, self.models, ports, history)
+        full_product = len(self.tickers) * len(self.models)
+        if plan.total_items < full_product:
+            logger.info(f"依各 Ticker 指定的模型，本次只需執行 {plan.total_items} 項 (完整組合為 {full_product} 項)。")
+        logger.info(f"執行計畫 (預估總耗時 {plan.predicted_makespan / 60:.1f} 分鐘):\n{plan.describe()}")
+        work_queue = PlanQueue(plan)
+        supervisor = WorkerSupervisor()
+        controller = ConcurrencyController([slot['index'] for slot in slots], initial_workers)
+        if not controller.fixed:
+            logger.info(f"自適應並行控制已啟用: 初始 {controller.limit} 個工作視窗，上限 {controller.max_limit} 個。")
+        deadline = parse_deadline(self.user_settings.get("run_deadline", ""))
+        if deadline is not None:
+            self._deadline_guard = DeadlineGuard(deadline, work_queue, lambda: controller.limit)
+            logger.info(f"完成期限: {deadline:%Y-%m-%d %H:%M}，必要時將延後低優先項目。")
+
+        self._progress("run_started", total=plan.total_items, ports=ports)
+
+        # --- Phase 1: Prepare all profiles BEFORE launching any Chrome instances ---
+        if owns_pool:
+            pool.prepare_profiles()
+
+        # --- Phase 2: Launch Chrome instances and run the planned items ---
+        logger.info("階段 2: 啟動 Chrome 實例並執行自動化任務...")
+        changes = ChangeDetector(self.destination_path) if self.user_settings.get("detect_changes", True) else None
+        replicator = start_replicator(self.destination_path, self.user_settings)
+        pipeline = PostProcessingPipeline(compress=self.user_settings.get("compress_outputs", False), changes=changes,
+                                          replicator=replicator).start()
+        tv_code_sink = TvCodeSink(self.destination_path, changes=changes)
+        elapsed_by_port = {}
+        threads = []
+        try:
+            for slot, scraper in zip(slots, pool.scrapers):
+                download_path = config.get_download_path(
+                    self.destination_path, slot['port'], self.user_settings.get("direct_download", False))
+                reset_download_dir(download_path)
+                scraper.begin_run(download_path, pipeline, tv_code_sink)
+
+                thread = threading.Thread(
+                    target=self._run_worker,
+                    args=(pool, slot, scraper, work_queue, controller, supervisor, elapsed_by_port),
+                    name=f"port-{slot['port']}", daemon=True
+                )
+                threads.append(thread)
+                thread.start()
+                time.sleep(1) # Stagger the launch slightly
+
+            for thread in threads:
+                thread.join()
+            logger.info("--- 所有線程執行完畢 ---")
+        finally:
+            logger.info("正在等待後處理管線完成剩餘檔案...")
+            pipeline.close()
+            tv_code_sink.flush()
+            manifest_path = changes.write_manifest() if changes is not None else None
+            if replicator is not None:
+                finish_replication(replicator, self.destination_path, tv_code_sink, manifest_path)
+            if owns_pool:
+                pool.shutdown()
+            self._progress("run_finished")
+
+        all_failed_tickers = list(pipeline.failed_items)
+        for scraper in pool.scrapers[:worker_count]:
+            all_failed_tickers.extend(scraper.failed_tickers)
+        # Items no worker could take, e.g. because every browser failed to start.
+        all_failed_tickers.extend(item.label for item in work_queue.drain())
+
+        actual_makespan = max(elapsed_by_port.values(), default=0.0)
+        self._log_makespan(plan, elapsed_by_port, actual_makespan)
+        if self.record_history:
+            self._update_history(history, pool.scrapers[:worker_count])
+        deferred = self._deadline_guard.deferred if self._deadline_guard else []
+        if deferred:
+            self._save_deferred(deferred)
+        return RunResult(
+            plan.total_items - len(deferred), all_failed_tickers, plan.predicted_makespan, actual_makespan,
+            deferred=[item.label for item in deferred]
+        )
+
+    def _run_worker(self, pool, slot, scraper, work_queue, controller, supervisor, elapsed_by_port):
+        """
+        Takes items one at a time while the controller allows this worker to
+        run. The browser is only launched once the worker is first needed,
+        and is recycled when the supervisor sees it degrading or it crashes.
+        """
+        index, port = slot['index'], slot['port']
+        started = None
+        try:
+            while controller.wait_for_turn(index, work_queue.has_work):
+                if started is None:
+                    self._progress("worker_state", port=port, state=progress.STARTING)
+                    pool.start_worker(slot, scraper)
+                    supervisor.reset(scraper)
+                    started = time.monotonic()
+
+                item = work_queue.take(port, scraper.current_model)
+                if item is None:
+                    break
+                if scraper.current_model != item.model:
+                    logger.info(f"--- [Port {port}] 切換至模型: {item.model} ---")
+                    if not scraper.select_model(item.model):
+                        scraper.failed_tickers.append(item.label)
+                        requeued = self._recover_crashed_item(pool, slot, scraper, work_queue, supervisor, item)
+                        self._progress("item_finished", port=port, model=item.model, ticker=item.ticker, ok=False, requeued=requeued,
+                                       reason="select_model")
+                        continue
+                self._progress("item_started", port=port, model=item.model, ticker=item.ticker)
+                ok = scraper.process_ticker(item.model, item.ticker, self.destination_path)
+                sample = scraper.timings[-1] if scraper.timings else {}
+                if sample:
+                    controller.record(sample)
+                    if self._deadline_guard:
+                        deferred_before = len(self._deadline_guard.deferred)
+                        self._deadline_guard.record(item, sample)
+                        newly_deferred = len(self._deadline_guard.deferred) - deferred_before
+                        if newly_deferred:
+                            self._progress("items_deferred", count=newly_deferred)
+                requeued = not ok and self._recover_crashed_item(pool, slot, scraper, work_queue, supervisor, item)
+                self._progress("item_finished", port=port, model=item.model, ticker=item.ticker, ok=ok, requeued=requeued,
+                               seconds=sample.get("seconds"), chart_load_seconds=sample.get("chart_load_seconds"),
+                               phases=sample.get("phases"), reason=sample.get("reason"))
+                if requeued:
+                    continue
+
+                action = supervisor.check(scraper)
+                if action == WorkerSupervisor.TAB:
+                    try:
+                        scraper.recycle_tab()
+                    except Exception as e:
+                        logger.warning(f"[Port {port}] 更換分頁失敗，改為重新啟動瀏覽器: {e}")
+                        action = WorkerSupervisor.BROWSER
+                if action == WorkerSupervisor.BROWSER:
+                    self._progress("worker_state", port=port, state=progress.RESTARTING)
+                    pool.restart_worker(slot, scraper)
+                    supervisor.reset(scraper)
+
+        except Exception as e:
+            logger.error(f"[Port {port}] 執行失敗: {e}", exc_info=True)
+        finally:
+            # Whatever this worker leaves behind is picked up by the others.
+            controller.retire(index)
+            self._progress("worker_state", port=port, state=progress.FINISHED)
+            if started is not None:
+                elapsed_by_port[port] = time.monotonic() - started
+                scraper.flush_tv_code(self.destination_path)
+
+    def _recover_crashed_item(self, pool, slot, scraper, work_queue, supervisor, item):
+        """
+        Called right after `item` was recorded as failed. If the failure was
+        caused by the browser dying, puts the item back on this worker's
+        queue (up to MAX_ITEM_ATTEMPTS) and restarts the browser. Returns True
+        when the item was re-queued. Raises if the browser cannot be
+        restarted, which retires the worker; the queued item is then picked
+        up by the others.
+        """
+        if scraper.is_alive():
+            return False
+        item.attempts += 1
+        logger.warning(f"[Port {slot['port']}] 瀏覽器已無回應 (處理 {item.label} 時)。")
+        requeue = item.attempts < config.MAX_ITEM_ATTEMPTS
+        if requeue:
+            if scraper.failed_tickers and scraper.failed_tickers[-1] == item.label:
+                scraper.failed_tickers.pop()
+            work_queue.put_back(slot['port'], item)
+            logger.info(f"[Port {slot['port']}] 已將 {item.label} 放回佇列 (第 {item.attempts} 次中斷)。")
+        pool.restart_worker(slot, scraper)
+        supervisor.reset(scraper)
+        return requeue
+
+    def _log_makespan(self, plan, elapsed_by_port, actual_makespan):
+        for port, elapsed in sorted(elapsed_by_port.items()):
+            logger.info(f"[Port {port}] 預估 {plan.predicted_load[port] / 60:.1f} 分鐘，實際 {elapsed / 60:.1f} 分鐘。")
+        logger.info(
+            f"總耗時 (makespan) 預估 {plan.predicted_makespan / 60:.1f} 分鐘，實際 {actual_makespan / 60:.1f} 分鐘。",
+            extra={"data": {
+                "event": "run_makespan",
+                "predicted_seconds": round(plan.predicted_makespan, 1),
+                "actual_seconds": round(actual_makespan, 1),
+                "ports": len(plan.assignments),
+                "items": plan.total_items,
+            }}
+        )
+
+    def _save_deferred(self, deferred):
+        """Writes the deferred items as a ticker file, ready to be loaded for a catch-up run."""
+        models_by_ticker = {}
+        for item in deferred:
+            priority, models = models_by_ticker.setdefault(item.ticker, (item.priority, []))
+            models.append(item.model)
+        specs = [TickerSpec(ticker, priority, models) for ticker, (priority, models) in models_by_ticker.items()]
+        filename = config.DEFERRED_TICKERS_FILENAME.format(date=time.strftime("%Y-%m-%d"))
+        try:
+            write_ticker_file(os.path.join(self.destination_path, filename), specs)
+        except OSError as e:
+            logger.error(f"無法寫入延後項目清單: {e}")
+
+    def _update_history(self, history, scrapers):
+        try:
+            for scraper in scrapers:
+                history.record_samples(scraper.timings)
+            history.save()
+        except Exception as e:
+            logger.warning(f"無法更新歷史耗時紀錄: {e}")
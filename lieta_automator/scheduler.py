@@ -1,11 +1,24 @@
 # lieta_automator/scheduler.py
+import getpass
 import subprocess
 import sys
 import os
 import ctypes
+import shutil
+from . import config
 from .config import TASK_NAME
 from .logger import logger
 
+# 排程後端：Windows 使用工作排程器，Linux 優先使用 systemd 使用者計時器，其他 (含 macOS) 使用 cron
+SCHTASKS = "schtasks"
+SYSTEMD = "systemd"
+CRON = "cron"
+
+# 用來在 crontab 中辨識本程式所建立的項目
+_CRON_MARKER = f"# {TASK_NAME}"
+_SYSTEMD_UNIT = "lieta-automator"
+_WEEKDAYS = "MON,TUE,WED,THU,FRI"
+
 def is_admin():
     """檢查目前使用者是否具有系統管理員權限"""
     try:
@@ -14,6 +27,32 @@ def is_admin():
         # 非 Windows 系統，或發生其他錯誤
         return False
 
+def get_backend():
+    """
+    決定使用哪一個排程後端。
+    可在 config.SCHEDULE_BACKEND 強制指定，否則依作業系統自動選擇。
+    """
+    if config.SCHEDULE_BACKEND:
+        return config.SCHEDULE_BACKEND
+    if sys.platform == "win32":
+        return SCHTASKS
+    if sys.platform.startswith("linux") and shutil.which("systemctl") and _systemd_user_available():
+        return SYSTEMD
+    return CRON
+
+def _systemd_user_available():
+    """檢查是否能使用 systemd 使用者服務 (例如在沒有登入工作階段的容器中就無法使用)"""
+    try:
+        result = subprocess.run(
+            ["systemctl", "--user", "show-environment"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=5
+        )
+        return result.returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
 def _get_python_executable():
     """取得 Python 解譯器的絕對路徑"""
     # 在 PyInstaller 打包的環境中，sys.executable 是主程式的路徑
@@ -37,107 +76,311 @@ def _get_run_script_path():
         project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         return os.path.join(project_root, "run.py")
 
+def _get_posix_command():
+    """取得 cron / systemd 要執行的完整命令 (POSIX 不會依副檔名執行 .py，需明確指定直譯器)"""
+    if getattr(sys, 'frozen', False):
+        return f'"{sys.executable}" --run-automated'
+    return f'"{_get_python_executable()}" "{_get_run_script_path()}" --run-automated'
+
+def _normalize_times(schedule_times):
+    """接受單一 "HH:MM" 字串或清單，回傳排序且不重複的 "HH:MM" 清單"""
+    if isinstance(schedule_times, str):
+        schedule_times = [schedule_times]
+    normalized = set()
+    for value in schedule_times:
+        hour, minute = (int(part) for part in value.strip().split(":"))
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f"無效的時間: {value}")
+        normalized.add(f"{hour:02d}:{minute:02d}")
+    return sorted(normalized)
+
+def _describe(times, weekdays_only):
+    days = "每個平日" if weekdays_only else "每天"
+    return f"成功設定排程於{days} {', '.join(times)}"
+
 def is_task_scheduled():
     """檢查排程工作是否已經存在"""
+    backend = get_backend()
+    if backend == SCHTASKS:
+        return bool(_schtasks_task_names())
+    if backend == SYSTEMD:
+        return os.path.exists(_systemd_unit_path(".timer"))
     try:
-        # 使用 schtasks 查詢，並將輸出導向 DEVNULL 避免顯示在控制台
-        subprocess.check_call(
-            f'schtasks /Query /TN "{TASK_NAME}"',
-            shell=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
-        return True
-    except subprocess.CalledProcessError:
-        # 如果任務不存在，schtasks 會返回非零的退出碼
+        return any(_CRON_MARKER in line for line in _read_crontab())
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning(f"無法讀取 crontab: {e}")
         return False
 
-def create_or_update_task(schedule_time: str):
+def create_or_update_task(schedule_times, weekdays_only=False):
     """
-    建立或更新 Windows 排程工作。
-    此操作需要系統管理員權限。
+    建立或更新排程工作。
 
-    :param schedule_time: 排程時間，格式為 "HH:MM"
+    :param schedule_times: 排程時間，格式為 "HH:MM"，可為單一字串或多個時段的清單
+    :param weekdays_only: 是否只在週一至週五執行
     :return: (bool, str) 表示成功與否以及對應的訊息
     """
+    try:
+        times = _normalize_times(schedule_times)
+    except ValueError as e:
+        msg = f"排程時間格式錯誤: {e}"
+        logger.error(msg)
+        return False, msg
+    if not times:
+        return False, "未設定任何排程時間。"
+
+    backend = get_backend()
+    logger.info(f"正在以 {backend} 建立或更新排程工作 '{TASK_NAME}'，時間: {', '.join(times)}")
+    if backend == SCHTASKS:
+        return _schtasks_create(times, weekdays_only)
+    if backend == SYSTEMD:
+        return _systemd_create(times, weekdays_only)
+    return _cron_create(times, weekdays_only)
+
+def delete_task():
+    """
+    刪除排程工作。
+
+    :return: (bool, str) 表示成功與否以及對應的訊息
+    """
+    backend = get_backend()
+    if backend == SCHTASKS:
+        return _schtasks_delete()
+    if backend == SYSTEMD:
+        return _systemd_delete()
+    return _cron_delete()
+
+# --- Windows 工作排程器 ---
+
+def _run_schtasks(command):
+    return subprocess.run(
+        command,
+        check=True,
+        shell=True,
+        capture_output=True,
+        text=True,
+        encoding='cp950'
+    )
+
+def _schtasks_error(e):
+    error_message = e.stderr.strip()
+    if not error_message:
+        error_message = e.stdout.strip()
+    return error_message
+
+def _schtasks_task_names():
+    """列出本程式建立的所有排程工作 (第一個時段使用 TASK_NAME，其餘時段加上時間後綴)"""
+    try:
+        result = _run_schtasks('schtasks /Query /FO CSV /NH')
+    except subprocess.CalledProcessError:
+        return []
+    names = []
+    for line in result.stdout.splitlines():
+        name = line.split(",", 1)[0].strip('"').lstrip("\\")
+        if name == TASK_NAME or name.startswith(f"{TASK_NAME}_"):
+            names.append(name)
+    return names
+
+def _schtasks_create(times, weekdays_only):
+    """
+    建立或更新 Windows 排程工作。
+    此操作需要系統管理員權限。schtasks 的命令列只能設定一個觸發時間，
+    所以每個時段各建立一個工作。
+    """
     if not is_admin():
         msg = "需要系統管理員權限才能設定排程。"
         logger.warning(msg)
         return False, msg
 
     executable_path = _get_run_script_path()
-    
+
     # 正確的 /TR 格式應該是 ""C:\path\to\program.exe" --argument1"
     # 將可執行檔路徑和其參數一起作為一個字串傳遞給 /TR
     task_run_command = f'"{executable_path}" --run-automated'
+    schedule = f"/SC WEEKLY /D {_WEEKDAYS}" if weekdays_only else "/SC DAILY"
+
+    wanted = {}
+    for i, schedule_time in enumerate(times):
+        name = TASK_NAME if i == 0 else f"{TASK_NAME}_{schedule_time.replace(':', '')}"
+        wanted[name] = schedule_time
 
-    # 組建命令。使用 shell=True 時，將整個命令組合成一個字串是可靠的方式。
-    # 確保 TASK_NAME 也被引號包圍。
-    command = (
-        f'schtasks /Create /TN "{TASK_NAME}" '
-        f'/TR "{task_run_command}" '
-        f'/SC DAILY /ST {schedule_time} /F /RL HIGHEST'
-    )
-    
     try:
-        logger.info(f"正在建立或更新排程工作 '{TASK_NAME}'，時間: {schedule_time}")
-        logger.debug(f"執行 schtasks 命令: {command}")
-        
-        subprocess.run(
-            command,
-            check=True,
-            shell=True,
-            capture_output=True,
-            text=True,
-            encoding='cp950'
-        )
+        # 移除已不再使用的時段
+        for name in _schtasks_task_names():
+            if name not in wanted:
+                _run_schtasks(f'schtasks /Delete /TN "{name}" /F')
+
+        for name, schedule_time in wanted.items():
+            # 組建命令。使用 shell=True 時，將整個命令組合成一個字串是可靠的方式。
+            # 確保工作名稱也被引號包圍。
+            command = (
+                f'schtasks /Create /TN "{name}" '
+                f'/TR "{task_run_command}" '
+                f'{schedule} /ST {schedule_time} /F /RL HIGHEST'
+            )
+            logger.debug(f"執行 schtasks 命令: {command}")
+            _run_schtasks(command)
         logger.info(f"成功設定排程工作 '{TASK_NAME}'")
-        return True, f"成功設定排程於每天 {schedule_time}"
+        return True, _describe(times, weekdays_only)
     except subprocess.CalledProcessError as e:
-        error_message = e.stderr.strip()
-        if not error_message:
-            error_message = e.stdout.strip()
-        
-        final_msg = f"設定排程失敗: {error_message}"
+        final_msg = f"設定排程失敗: {_schtasks_error(e)}"
         logger.error(final_msg)
         return False, final_msg
 
-
-def delete_task():
+def _schtasks_delete():
     """
     刪除 Windows 排程工作。
     此操作需要系統管理員權限。
-    
-    :return: (bool, str) 表示成功與否以及對應的訊息
     """
     if not is_admin():
         msg = "需要系統管理員權限才能刪除排程。"
         logger.warning(msg)
         return False, msg
 
-    if not is_task_scheduled():
+    names = _schtasks_task_names()
+    if not names:
         logger.info("排程工作不存在，無需刪除。" )
         return True, "排程本來就不存在。"
 
-    command = f'schtasks /Delete /TN "{TASK_NAME}" /F'
-    
     try:
-        logger.info(f"正在刪除排程工作 '{TASK_NAME}'")
-        subprocess.run(
-            command,
-            check=True,
-            shell=True,
-            capture_output=True,
-            text=True,
-            encoding='cp950'
-        )
+        for name in names:
+            logger.info(f"正在刪除排程工作 '{name}'")
+            _run_schtasks(f'schtasks /Delete /TN "{name}" /F')
         logger.info(f"成功刪除排程工作 '{TASK_NAME}'")
         return True, "已成功取消自動排程。"
     except subprocess.CalledProcessError as e:
-        error_message = e.stderr.strip()
-        if not error_message:
-            error_message = e.stdout.strip()
-            
-        final_msg = f"刪除排程失敗: {error_message}"
+        final_msg = f"刪除排程失敗: {_schtasks_error(e)}"
+        logger.error(final_msg)
+        return False, final_msg
+
+# --- systemd 使用者計時器 (Linux) ---
+
+def _systemd_unit_path(suffix):
+    config_home = os.environ.get("XDG_CONFIG_HOME", os.path.join(os.path.expanduser("~"), ".config"))
+    return os.path.join(config_home, "systemd", "user", _SYSTEMD_UNIT + suffix)
+
+def _systemctl(*args):
+    subprocess.run(["systemctl", "--user", *args], check=True, capture_output=True, text=True)
+
+def _ensure_linger():
+    """
+    使用者計時器預設只在使用者登入時執行；啟用 linger 讓無人登入的伺服器也能觸發排程。
+    無法啟用時 (例如沒有權限) 只記錄警告。
+    """
+    user = getpass.getuser()
+    try:
+        result = subprocess.run(["loginctl", "show-user", user, "--property=Linger"], capture_output=True, text=True)
+        if result.returncode == 0 and result.stdout.strip() == "Linger=yes":
+            return
+        subprocess.run(["loginctl", "enable-linger", user], check=True, capture_output=True, text=True)
+        logger.info(f"已為使用者 {user} 啟用 linger，未登入時排程也會執行。")
+    except (OSError, subprocess.CalledProcessError) as e:
+        detail = e.stderr.strip() if isinstance(e, subprocess.CalledProcessError) and e.stderr else str(e)
+        logger.warning(
+            f"無法啟用 linger ({detail})：使用者未登入時排程不會執行。"
+            f"請以系統管理員執行 'sudo loginctl enable-linger {user}'。"
+        )
+
+def _systemd_create(times, weekdays_only):
+    days = "Mon..Fri " if weekdays_only else ""
+    service = (
+        "[Unit]\n"
+        "Description=Lieta Research Automator scheduled run\n\n"
+        "[Service]\n"
+        "Type=oneshot\n"
+        f"WorkingDirectory={config.BASE_DIR}\n"
+        f"ExecStart={_get_posix_command()}\n"
+    )
+    timer = (
+        "[Unit]\n"
+        "Description=Lieta Research Automator schedule\n\n"
+        "[Timer]\n"
+        + "".join(f"OnCalendar={days}*-*-* {t}:00\n" for t in times) +
+        "Persistent=false\n\n"
+        "[Install]\n"
+        "WantedBy=timers.target\n"
+    )
+    try:
+        os.makedirs(os.path.dirname(_systemd_unit_path(".service")), exist_ok=True)
+        with open(_systemd_unit_path(".service"), "w", encoding="utf-8") as f:
+            f.write(service)
+        with open(_systemd_unit_path(".timer"), "w", encoding="utf-8") as f:
+            f.write(timer)
+        _systemctl("daemon-reload")
+        _systemctl("enable", "--now", _SYSTEMD_UNIT + ".timer")
+        logger.info(f"成功設定 systemd 計時器 '{_SYSTEMD_UNIT}.timer'")
+        _ensure_linger()
+        return True, _describe(times, weekdays_only)
+    except (OSError, subprocess.CalledProcessError) as e:
+        detail = e.stderr.strip() if isinstance(e, subprocess.CalledProcessError) and e.stderr else str(e)
+        final_msg = f"設定排程失敗: {detail}"
+        logger.error(final_msg)
+        return False, final_msg
+
+def _systemd_delete():
+    timer_path = _systemd_unit_path(".timer")
+    if not os.path.exists(timer_path):
+        logger.info("排程工作不存在，無需刪除。")
+        return True, "排程本來就不存在。"
+    try:
+        _systemctl("disable", "--now", _SYSTEMD_UNIT + ".timer")
+        for suffix in (".timer", ".service"):
+            if os.path.exists(_systemd_unit_path(suffix)):
+                os.remove(_systemd_unit_path(suffix))
+        _systemctl("daemon-reload")
+        logger.info(f"成功刪除 systemd 計時器 '{_SYSTEMD_UNIT}.timer'")
+        return True, "已成功取消自動排程。"
+    except (OSError, subprocess.CalledProcessError) as e:
+        final_msg = f"刪除排程失敗: {e}"
+        logger.error(final_msg)
+        return False, final_msg
+
+# --- cron (Linux / macOS) ---
+
+def _read_crontab():
+    """
+    讀取目前使用者的 crontab。沒有 crontab 時回傳空清單；其他錯誤 (例如權限不足)
+    拋出例外，避免寫回空白內容而清除使用者原有的排程。
+    """
+    result = subprocess.run(["crontab", "-l"], capture_output=True, text=True)
+    if result.returncode == 0:
+        return result.stdout.splitlines()
+    # 沒有 crontab 時 `crontab -l` 會以非零代碼結束，並顯示 "no crontab for <user>"
+    if "no crontab" in result.stderr.lower():
+        return []
+    raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+
+def _write_crontab(lines):
+    content = "\n".join(lines) + "\n" if lines else ""
+    subprocess.run(["crontab", "-"], input=content, check=True, capture_output=True, text=True)
+
+def _cron_create(times, weekdays_only):
+    days = "1-5" if weekdays_only else "*"
+    command = f'cd "{config.BASE_DIR}" && {_get_posix_command()}'
+    try:
+        lines = [line for line in _read_crontab() if _CRON_MARKER not in line]
+        for schedule_time in times:
+            hour, minute = schedule_time.split(":")
+            lines.append(f"{int(minute)} {int(hour)} * * {days} {command} {_CRON_MARKER}")
+        _write_crontab(lines)
+        logger.info(f"成功設定 crontab 排程 '{TASK_NAME}'")
+        return True, _describe(times, weekdays_only)
+    except (OSError, subprocess.CalledProcessError) as e:
+        detail = e.stderr.strip() if isinstance(e, subprocess.CalledProcessError) and e.stderr else str(e)
+        final_msg = f"設定排程失敗: {detail}"
+        logger.error(final_msg)
+        return False, final_msg
+
+def _cron_delete():
+    try:
+        lines = _read_crontab()
+        remaining = [line for line in lines if _CRON_MARKER not in line]
+        if len(remaining) == len(lines):
+            logger.info("排程工作不存在，無需刪除。")
+            return True, "排程本來就不存在。"
+        _write_crontab(remaining)
+        logger.info(f"成功刪除 crontab 排程 '{TASK_NAME}'")
+        return True, "已成功取消自動排程。"
+    except (OSError, subprocess.CalledProcessError) as e:
+        final_msg = f"刪除排程失敗: {e}"
         logger.error(final_msg)
         return False, final_msg
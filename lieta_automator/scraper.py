@@ -1,8 +1,7 @@
+import json
 import os
-import shutil
 import time
 import traceback
-from datetime import datetime
 
 from selenium import webdriver
 from selenium.common.exceptions import TimeoutException
@@ -12,8 +11,10 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
-from . import config
+from . import config, tracing
 from .logger import logger
+from .pipeline import DownloadJob, PostProcessingPipeline
+from .tvcode import TvCodeSink
 
 
 class LietaScraper:
@@ -22,12 +23,29 @@ class LietaScraper:
     Chrome instance identified by a specific port.
     """
 
-    def __init__(self, download_path, port):
+    def __init__(self, download_path, port, pipeline=None, tv_code_sink=None, worker_index=0):
         self.download_path = download_path
         self.port = port
+        self.worker_index = worker_index
         self.driver = None
         self.failed_tickers = []
+        # Per-ticker timing samples, used by the run planner's cost history.
+        self.timings = []
+        # Without a shared pipeline, jobs are finalised inline on this thread.
+        self.pipeline = pipeline
+        # Shared across scrapers so concurrent TV Code results land in one file.
+        self.tv_code_sink = tv_code_sink
+        self._unflushed_tv_code = []
+        # The model currently shown in the selector, or None if unknown.
+        self.current_model = None
+        # True while the tab is known to show the loaded platform page of a
+        # logged-in session; cleared after errors so the next step re-navigates.
+        self.on_platform_page = False
+        self._first_submit_pending = True
+        # Enables Chrome's performance log so `replay.HarRecorder` can read network events.
+        self.capture_network = False
 
+    @tracing.traced("connect_driver", cat="scraper")
     def setup_driver(self):
         """
         Sets up the Selenium WebDriver by connecting to an existing Chrome instance
@@ -37,13 +55,14 @@ class LietaScraper:
             logger.info(f"[Port {self.port}] 正在連接到 Chrome 瀏覽器...")
             chrome_options = Options()
             chrome_options.add_experimental_option("debuggerAddress", f"127.0.0.1:{self.port}")
+            if self.capture_network:
+                chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
             service = ChromeService()
-            self.driver = webdriver.Chrome(service=service, options=chrome_options)
+            self.driver = tracing.instrument_driver(webdriver.Chrome(service=service, options=chrome_options))
 
             # --- Set window position and size to avoid overlapping issues ---
             try:
-                base_port = config.REMOTE_DEBUGGING_PORTS[0]
-                window_index = self.port - base_port
+                window_index = self.worker_index
                 cascade_offset = 50
                 pos_x = window_index * cascade_offset
                 pos_y = window_index * cascade_offset
@@ -61,44 +80,147 @@ class LietaScraper:
             logger.error(f"[Port {self.port}] 無法連接到 Chrome 瀏覽器: {e}", exc_info=True)
             return False
 
+    @tracing.traced(cat="scraper")
     def check_login_status(self):
         """
-        Checks if the user is logged in by verifying the URL.
+        Checks if the user is logged in. A tab already on the platform page is
+        checked from the DOM without reloading; otherwise the platform is
+        opened and the check finishes as soon as the model selector shows or
+        the session is redirected elsewhere.
         """
         try:
             logger.info(f"[Port {self.port}] 正在檢查登入狀態...")
+            if self._platform_page_loaded():
+                logger.info(f"[Port {self.port}] 分頁已在平台頁面上，使用者已登入。")
+                self.on_platform_page = True
+                return True
             self.driver.get(config.LIETA_AUTOMATION_URL)
-            time.sleep(3)
+            try:
+                WebDriverWait(self.driver, config.LOGIN_CHECK_TIMEOUT, poll_frequency=0.25).until(
+                    lambda d: not self._on_platform_url() or d.find_elements(By.CSS_SELECTOR, 'button[role="combobox"]'))
+            except TimeoutException:
+                pass # Neither yet: decided by the URL alone, as before.
             current_url = self.driver.current_url
             logger.info(f"[Port {self.port}] 目前網址為: {current_url}")
-            if self.driver.current_url == config.LIETA_AUTOMATION_URL:
+            if self._on_platform_url():
                 logger.info(f"[Port {self.port}] 網址符合預期，使用者已登入。")
+                self.on_platform_page = True
                 return True
             else:
                 logger.warning(f"[Port {self.port}] 網址不符合預期 ({current_url})，使用者可能尚未登入。")
+                self.on_platform_page = False
                 return False
         except Exception as e:
             logger.error(f"[Port {self.port}] 檢查登入狀態時發生未知錯誤: {e}", exc_info=True)
+            self.on_platform_page = False
             return False
 
+    def _on_platform_url(self):
+        # The page may add a query or fragment; a login redirect changes the path.
+        return self.driver.current_url.startswith(config.LIETA_AUTOMATION_URL)
+
+    def _platform_page_loaded(self):
+        """True if the tab shows the platform with its model selector, without touching the page."""
+        try:
+            return self._on_platform_url() and bool(self.driver.find_elements(By.CSS_SELECTOR, 'button[role="combobox"]'))
+        except Exception:
+            return False
+
+    def _shown_model(self):
+        """The text of the model selector, or None if it cannot be read."""
+        try:
+            return self.driver.find_element(By.CSS_SELECTOR, 'button[role="combobox"]').text
+        except Exception:
+            return None
+
+    def invalidate_page_state(self):
+        """Forgets the page and model state, so the next `select_model` reloads the platform."""
+        self.on_platform_page = False
+        self.current_model = None
+
+    def begin_run(self, download_path, pipeline=None, tv_code_sink=None):
+        """Resets per-run state so a connected scraper can be reused by another run."""
+        self.download_path = download_path
+        self.pipeline = pipeline
+        self.tv_code_sink = tv_code_sink
+        self.failed_tickers = []
+        self.timings = []
+        self._unflushed_tv_code = []
+
     def run_automation(self, tickers, model, destination_path):
         """Main automation loop for a single model."""
         self.failed_tickers = []
         logger.info(f"--- [Port {self.port}] 開始處理模型: {model} ---")
 
-        try:
-            logger.info(f"[Port {self.port}] 導航至 Lieta 平台: {config.LIETA_AUTOMATION_URL}")
-            self.driver.get(config.LIETA_AUTOMATION_URL)
-            wait = WebDriverWait(self.driver, config.SELENIUM_TIMEOUT)
-            wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, 'button[role="combobox"]')))
-            logger.info(f"[Port {self.port}] 模型選擇器按鈕已找到。")
-        except Exception as e:
-            logger.error(f"[Port {self.port}] 無法載入 Lieta 平台或找不到初始模型選擇器: {e}", exc_info=True)
+        if not self.select_model(model):
+            logger.error(f"[Port {self.port}] 無法選擇模型 {model}，將跳過此模型的所有 Ticker。")
             self.failed_tickers.extend([f"{ticker} ({model})" for ticker in tickers])
             return self.failed_tickers
 
+        # --- Process tickers for the selected model ---
+        total_tickers = len(tickers)
+        for i, ticker in enumerate(tickers):
+            logger.info(f"({i+1}/{total_tickers}) [Port:{self.port}|{model}] 處理中: {ticker}")
+            self.process_ticker(model, ticker, destination_path)
+
+        if model == "TV Code":
+            self.flush_tv_code(destination_path)
+
+        logger.info(f"--- [Port {self.port}] 模型 {model} 處理完畢 ---")
+        return self.failed_tickers
+
+    def start_network_capture(self):
+        """Enables network events; needs `capture_network` set before `setup_driver()`."""
+        self.driver.execute_cdp_cmd("Network.enable", {})
+        self.driver.get_log("performance") # Discard events from before the capture.
+
+    def network_events(self):
+        """Yields the (method, params) of the Network.* events logged since the last call."""
+        for log_entry in self.driver.get_log("performance"):
+            try:
+                message = json.loads(log_entry["message"])["message"]
+            except (KeyError, ValueError):
+                continue
+            if message.get("method", "").startswith("Network."):
+                yield message["method"], message.get("params", {})
+
+    def response_body(self, request_id):
+        return self.driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+
+    @tracing.traced(cat="scraper")
+    def select_model(self, model):
+        """
+        Switches the model selector to `model`, opening the platform first
+        unless the tab is already on it. Does nothing if `model` is already
+        selected. Returns True on success.
+        """
+        if self.on_platform_page and self._platform_page_loaded():
+            if self.current_model == model:
+                return True
+            # Already on the platform: no reload, and no reselection if the selector shows the model.
+            shown = self._shown_model()
+            if shown is not None and model in shown:
+                logger.info(f"[Port {self.port}] 模型選擇器已是 {model}，略過重新選擇。")
+                self.current_model = model
+                return True
+        else:
+            self.on_platform_page = False
+        self.current_model = None
+        if not self.on_platform_page:
+            try:
+                logger.info(f"[Port {self.port}] 導航至 Lieta 平台: {config.LIETA_AUTOMATION_URL}")
+                self.driver.get(config.LIETA_AUTOMATION_URL)
+                wait = WebDriverWait(self.driver, config.SELENIUM_TIMEOUT)
+                wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, 'button[role="combobox"]')))
+                logger.info(f"[Port {self.port}] 模型選擇器按鈕已找到。")
+                self.on_platform_page = True
+            except Exception as e:
+                if not self._on_platform_url():
+                    logger.error(f"[Port {self.port}] 登入狀態可能已失效，平台頁面被導向 {self.driver.current_url}。")
+                logger.error(f"[Port {self.port}] 無法載入 Lieta 平台或找不到初始模型選擇器: {e}", exc_info=True)
+                return False
+
         # --- Select the model ---
-        selection_successful = False
         try:
             for attempt in range(2):
                 logger.info(f"[Port {self.port}] 第 {attempt + 1} 次嘗試選擇模型: {model}")
@@ -113,126 +235,212 @@ class LietaScraper:
                 try:
                     wait.until(EC.text_to_be_present_in_element((By.CSS_SELECTOR, 'button[role="combobox"]'), model))
                     logger.info(f"[Port {self.port}] 驗證成功: 目前模型已切換為 {model}")
-                    selection_successful = True
-                    break
+                    self.current_model = model
+                    self._first_submit_pending = True
+                    return True
                 except Exception:
                     logger.warning(f"[Port {self.port}] 第 {attempt + 1} 次嘗試驗證失敗。")
-                    if attempt == 0: time.sleep(3)
+                    if attempt == 0: tracing.sleep(3)
 
-            if not selection_successful:
-                raise Exception("重試後仍無法成功選擇模型。")
+            raise Exception("重試後仍無法成功選擇模型。")
 
         except Exception as e:
-            logger.error(f"[Port {self.port}] 無法選擇模型 {model}，將跳過此模型的所有 Ticker。原因: {e}", exc_info=True)
-            self.failed_tickers.extend([f"{ticker} ({model})" for ticker in tickers])
-            return self.failed_tickers
+            logger.error(f"[Port {self.port}] 無法選擇模型 {model}。原因: {e}", exc_info=True)
+            self.on_platform_page = False
+            return False
 
-        # --- Process tickers for the selected model ---
-        if model == "TV Code":
-            self._process_tv_code(tickers, destination_path)
-        else:
-            self._process_html_model(model, tickers, destination_path)
+    def process_ticker(self, model, ticker, destination_path):
+        """
+        Processes one ticker for the currently selected model.
+        Returns True on success; failures are also added to `failed_tickers`.
+        """
+        with tracing.span("process_ticker", cat="scraper", model=model, ticker=ticker):
+            if model == "TV Code":
+                return self._process_tv_code_ticker(ticker, destination_path)
+            return self._process_html_ticker(model, ticker, destination_path)
 
-        logger.info(f"--- [Port {self.port}] 模型 {model} 處理完畢 ---")
-        return self.failed_tickers
+    def flush_tv_code(self, destination_path):
+        """Checkpoints the TV Code sink, marking the unsaved tickers failed on error."""
+        sink = self._get_tv_code_sink(destination_path)
+        try:
+            sink.flush()
+        except Exception as e:
+            logger.error(f"[Port {self.port}] 寫入 TV Code 檔案失敗: {e}", exc_info=True)
+            self.failed_tickers.extend(f"{ticker} (TV Code)" for ticker in self._unflushed_tv_code)
+        self._unflushed_tv_code = []
+
+    def _get_tv_code_sink(self, destination_path):
+        if self.tv_code_sink is None:
+            self.tv_code_sink = TvCodeSink(destination_path)
+        return self.tv_code_sink
+
+    @tracing.traced("submit", cat="scraper")
+    def _submit_ticker(self, ticker, wait):
+        """Types the ticker into the search box and submits it."""
+        ticker_input = wait.until(EC.visibility_of_element_located((By.CSS_SELECTOR, 'input[placeholder="Ticker"]')))
+        ticker_input.clear()
+        ticker_input.send_keys(ticker)
+        if self._first_submit_pending:
+            logger.info("為第一個 Ticker 增加 1 秒延遲...")
+            tracing.sleep(1)
+        submit_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, 'button[type="submit"]')))
+        submit_button.click()
+        self._first_submit_pending = False
 
-    def _process_html_model(self, model, tickers, destination_path):
-        """Processes models that download an HTML file."""
+    def _process_html_ticker(self, model, ticker, destination_path):
+        """Processes one ticker of a model that downloads an HTML file."""
         wait = WebDriverWait(self.driver, config.SELENIUM_TIMEOUT)
-        total_tickers = len(tickers)
-        for i, ticker in enumerate(tickers):
-            logger.info(f"({i+1}/{total_tickers}) [Port:{self.port}|{model}] 處理中: {ticker}")
-            try:
-                chart_loaded = False
-                for attempt in range(2):
-                    logger.info(f"[Port {self.port}] 第 {attempt + 1} 次嘗試提交 {ticker}...")
-                    ticker_input = wait.until(EC.visibility_of_element_located((By.CSS_SELECTOR, 'input[placeholder="Ticker"]')))
-                    ticker_input.clear()
-                    ticker_input.send_keys(ticker)
-                    if i == 0:
-                        logger.info("為第一個 Ticker 增加 1 秒延遲...")
-                        time.sleep(1)
-                    submit_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, 'button[type="submit"]')))
-                    submit_button.click()
-                    try:
-                        logger.info(f"[Port {self.port}] 正在等待 {ticker} 的圖表資料 (最多 90 秒)...")
-                        long_wait = WebDriverWait(self.driver, 90, poll_frequency=1)
+        started = time.monotonic()
+        load_seconds, timeouts = None, 0
+        phases, phase = {}, "submit"
+        try:
+            chart_loaded = False
+            for attempt in range(2):
+                logger.info(f"[Port {self.port}] 第 {attempt + 1} 次嘗試提交 {ticker}...")
+                phase = "submit"
+                phase_started = time.monotonic()
+                self._submit_ticker(ticker, wait)
+                submitted = time.monotonic()
+                phases["submit"] = phases.get("submit", 0.0) + submitted - phase_started
+                phase = "chart_load"
+                try:
+                    logger.info(f"[Port {self.port}] 正在等待 {ticker} 的圖表資料 (最多 90 秒)...")
+                    long_wait = WebDriverWait(self.driver, 90, poll_frequency=1)
+                    with tracing.span("chart_load", cat="scraper"):
                         long_wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, 'svg.main-svg')))
-                        logger.info(f"[Port {self.port}] 圖表已載入，準備下載。")
-                        chart_loaded = True
-                        break
-                    except Exception:
-                        logger.warning(f"[Port {self.port}] 第 {attempt+1} 次提交在 90 秒後超時。")
-                        if attempt == 0: logger.info("正在準備重試...")
-                if not chart_loaded:
-                    raise Exception("重試後仍然無法載入圖表。")
-
-                # Ensure the unique download path exists and set download behavior
-                os.makedirs(self.download_path, exist_ok=True)
-                self.driver.execute_cdp_cmd("Page.setDownloadBehavior", {"behavior": "allow", "downloadPath": self.download_path})
-                
-                files_before_download = set(os.listdir(self.download_path))
-                download_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(., '下載')]")))
-                download_button.click()
-                downloaded_file_path = self._wait_for_new_file(files_before_download, ".html")
-                if not downloaded_file_path:
-                    raise Exception("下載超時或未找到新的 .html 檔案。")
-                self._wait_for_download_complete(downloaded_file_path)
-                target_dir = os.path.join(destination_path, model, ticker.upper())
-                os.makedirs(target_dir, exist_ok=True)
-                timestamp = datetime.now().strftime("%Y-%m-%d_%H;%M")
-                new_filename = f"{timestamp}_{ticker.upper()}_{model}.html"
-                new_filepath = os.path.join(target_dir, new_filename)
-                shutil.move(downloaded_file_path, new_filepath)
-                logger.info(f"成功: [Port:{self.port}|{model}] {new_filename} 已儲存。")
-            except Exception as e:
-                logger.error(f"失敗: [Port:{self.port}|{model}] - {ticker}. 原因: {str(e).splitlines()[0]}", exc_info=True)
-                self.failed_tickers.append(f"{ticker} ({model})")
+                    load_seconds = time.monotonic() - submitted
+                    logger.info(f"[Port {self.port}] 圖表已載入，準備下載。")
+                    chart_loaded = True
+                    break
+                except Exception:
+                    timeouts += 1
+                    logger.warning(f"[Port {self.port}] 第 {attempt+1} 次提交在 90 秒後超時。")
+                    if attempt == 0: logger.info("正在準備重試...")
+            if not chart_loaded:
+                raise Exception("重試後仍然無法載入圖表。")
+
+            # Ensure the unique download path exists and set download behavior
+            phase = "download"
+            phase_started = time.monotonic()
+            os.makedirs(self.download_path, exist_ok=True)
+            self.driver.execute_cdp_cmd("Page.setDownloadBehavior", {"behavior": "allow", "downloadPath": self.download_path})
+            
+            files_before_download = set(os.listdir(self.download_path))
+            download_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(., '下載')]")))
+            download_button.click()
+            downloaded_file_path = self._wait_for_new_file(files_before_download, ".html")
+            if not downloaded_file_path:
+                raise Exception("下載超時或未找到新的 .html 檔案。")
+            self._wait_for_download_complete(downloaded_file_path)
+            phases["download"] = time.monotonic() - phase_started
+            phase = "finalise"
+            self._finalise(DownloadJob(downloaded_file_path, destination_path, model, ticker, port=self.port))
+            self._record_timing(model, ticker, started, load_seconds, timeouts, ok=True, phases=phases)
+            return True
+        except Exception as e:
+            logger.error(f"失敗: [Port:{self.port}|{model}] - {ticker}. 原因: {str(e).splitlines()[0]}", exc_info=True)
+            self.failed_tickers.append(f"{ticker} ({model})")
+            self._after_failure()
+            self._record_timing(model, ticker, started, load_seconds, timeouts, ok=False, phases=phases, reason=phase)
+            return False
 
-    def _process_tv_code(self, tickers, destination_path):
-        """Processes the 'TV Code' model which scrapes text."""
+    def _process_tv_code_ticker(self, ticker, destination_path):
+        """Processes one ticker of the 'TV Code' model, which scrapes text."""
         wait = WebDriverWait(self.driver, config.SELENIUM_TIMEOUT)
-        target_dir = os.path.join(destination_path, "TV Code")
-        os.makedirs(target_dir, exist_ok=True)
-        timestamp = datetime.now().strftime("%Y%m%d")
-        output_filepath = os.path.join(target_dir, f"{timestamp}_TV Code.txt")
-        for i, ticker in enumerate(tickers):
-            logger.info(f"({i+1}/{len(tickers)}) [Port:{self.port}|TV Code] 處理中: {ticker}")
-            try:
-                text_loaded = False
-                for attempt in range(2):
-                    logger.info(f"[Port {self.port}] 第 {attempt + 1} 次嘗試提交 {ticker}...")
-                    ticker_input = wait.until(EC.visibility_of_element_located((By.CSS_SELECTOR, 'input[placeholder="Ticker"]')))
-                    ticker_input.clear()
-                    ticker_input.send_keys(ticker)
-                    if i == 0:
-                        logger.info("為第一個 Ticker 增加 1 秒延遲...")
-                        time.sleep(1)
-                    submit_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, 'button[type="submit"]')))
-                    submit_button.click()
-                    try:
-                        logger.info(f"[Port {self.port}] 正在等待 {ticker} 的 TV Code (最多 90 秒)...")
-                        long_wait = WebDriverWait(self.driver, 90, poll_frequency=1)
-                        ticker_upper = ticker.upper()
+        sink = self._get_tv_code_sink(destination_path)
+        started = time.monotonic()
+        load_seconds, timeouts = None, 0
+        phases, phase = {}, "submit"
+        try:
+            text_loaded = False
+            for attempt in range(2):
+                logger.info(f"[Port {self.port}] 第 {attempt + 1} 次嘗試提交 {ticker}...")
+                phase = "submit"
+                phase_started = time.monotonic()
+                self._submit_ticker(ticker, wait)
+                submitted = time.monotonic()
+                phases["submit"] = phases.get("submit", 0.0) + submitted - phase_started
+                phase = "chart_load"
+                try:
+                    logger.info(f"[Port {self.port}] 正在等待 {ticker} 的 TV Code (最多 90 秒)...")
+                    long_wait = WebDriverWait(self.driver, 90, poll_frequency=1)
+                    ticker_upper = ticker.upper()
+                    with tracing.span("chart_load", cat="scraper"):
                         long_wait.until(EC.text_to_be_present_in_element((By.XPATH, "//p"), f"{ticker_upper}:"))
-                        logger.info(f"[Port {self.port}] 成功取得 {ticker} 的 TV Code。")
-                        text_loaded = True
-                        break
-                    except Exception:
-                        logger.warning(f"[Port {self.port}] 第 {attempt+1} 次提交在 90 秒後超時。")
-                        if attempt == 0: logger.info("正在準備重試...")
-                if not text_loaded:
-                    raise Exception("重試後仍然無法取得 TV Code。")
-                ticker_upper = ticker.upper()
-                p_element = self.driver.find_element(By.XPATH, f"//p[contains(text(), '{ticker_upper}:')] ")
-                code_text = p_element.text
-                with open(output_filepath, "a", encoding="utf-8") as f:
-                    f.write(code_text + "\n")
-                logger.info(f"成功: [Port:{self.port}|TV Code] for {ticker.upper()} 已儲存。")
-            except Exception as e:
-                logger.error(f"失敗: [Port:{self.port}|TV Code] - {ticker}. 原因: {str(e).splitlines()[0]}", exc_info=True)
-                self.failed_tickers.append(f"{ticker} (TV Code)")
+                    load_seconds = time.monotonic() - submitted
+                    logger.info(f"[Port {self.port}] 成功取得 {ticker} 的 TV Code。")
+                    text_loaded = True
+                    break
+                except Exception:
+                    timeouts += 1
+                    logger.warning(f"[Port {self.port}] 第 {attempt+1} 次提交在 90 秒後超時。")
+                    if attempt == 0: logger.info("正在準備重試...")
+            if not text_loaded:
+                raise Exception("重試後仍然無法取得 TV Code。")
+            phase = "extract"
+            phase_started = time.monotonic()
+            ticker_upper = ticker.upper()
+            p_element = self.driver.find_element(By.XPATH, f"//p[contains(text(), '{ticker_upper}:')] ")
+            code_text = p_element.text
+            sink.add(ticker, code_text)
+            self._unflushed_tv_code.append(ticker)
+            phases["extract"] = time.monotonic() - phase_started
+            logger.info(f"成功: [Port:{self.port}|TV Code] for {ticker.upper()} 已取得。")
+            self._record_timing("TV Code", ticker, started, load_seconds, timeouts, ok=True, phases=phases)
+            return True
+        except Exception as e:
+            logger.error(f"失敗: [Port:{self.port}|TV Code] - {ticker}. 原因: {str(e).splitlines()[0]}", exc_info=True)
+            self.failed_tickers.append(f"{ticker} (TV Code)")
+            self._after_failure()
+            self._record_timing("TV Code", ticker, started, load_seconds, timeouts, ok=False, phases=phases, reason=phase)
+            return False
+
+    def _after_failure(self):
+        # The page may be stuck mid-request or the session may have expired:
+        # the next item reloads the platform and selects its model again.
+        try:
+            if not self._on_platform_url():
+                logger.warning(f"[Port {self.port}] 已離開平台頁面 ({self.driver.current_url})，登入狀態可能已失效。")
+        except Exception:
+            pass
+        self.invalidate_page_state()
 
+    def _record_timing(self, model, ticker, started, load_seconds, timeouts, ok, phases=None, reason=None):
+        """
+        Keeps a per-ticker timing sample and emits it as a structured log record.
+        `phases` holds the seconds spent per step; `reason` is the step a failure happened in.
+        """
+        sample = {
+            "event": "ticker_timing",
+            "port": self.port,
+            "model": model,
+            "ticker": ticker.upper(),
+            "seconds": round(time.monotonic() - started, 3),
+            "chart_load_seconds": round(load_seconds, 3) if load_seconds is not None else None,
+            "timeouts": timeouts,
+            "ok": ok,
+        }
+        if load_seconds is not None:
+            phases = dict(phases or {}, chart_load=load_seconds)
+        if phases:
+            sample["phases"] = {name: round(seconds, 3) for name, seconds in phases.items()}
+        if reason is not None:
+            sample["reason"] = reason
+        self.timings.append(sample)
+        logger.info(f"[Port {self.port}] {ticker.upper()} ({model}) 耗時 {sample['seconds']:.1f} 秒。", extra={"data": sample})
+
+    @tracing.traced(cat="scraper")
+    def _finalise(self, job):
+        """Hands a finished result to the post-processing pipeline."""
+        if self.pipeline:
+            self.pipeline.submit(job)
+            logger.info(f"[Port {self.port}] {job.label} 已交給後處理管線。")
+        else:
+            inline = PostProcessingPipeline()
+            inline.run_job(job)
+            self.failed_tickers.extend(inline.failed_items)
+
+    @tracing.traced(cat="scraper")
     def _wait_for_new_file(self, files_before, extension, timeout=90):
         """Waits for a new file with a specific extension to appear."""
         timeout_end = time.time() + timeout
@@ -243,9 +451,10 @@ class LietaScraper:
                 for file in new_files:
                     if file.endswith(extension):
                         return os.path.join(self.download_path, file)
-            time.sleep(1)
+            tracing.sleep(1)
         return None
 
+    @tracing.traced(cat="scraper")
     def _wait_for_download_complete(self, filepath, timeout=90):
         """Waits for a file to be fully downloaded by checking if the file size is stable."""
         seconds = 0
@@ -255,15 +464,59 @@ class LietaScraper:
                 try:
                     current_size = os.path.getsize(filepath)
                     if current_size == last_size and current_size > 0:
-                        time.sleep(1)
+                        tracing.sleep(1)
                         return True
                     last_size = current_size
                 except OSError:
                     pass
-            time.sleep(1)
+            tracing.sleep(1)
             seconds += 1
         raise Exception(f"Download timed out for {os.path.basename(filepath)}")
 
+    def is_alive(self):
+        """Returns False if the browser or its WebDriver session is gone."""
+        if not self.driver:
+            return False
+        try:
+            _ = self.driver.window_handles
+            return True
+        except Exception:
+            return False
+
+    def js_heap_bytes(self):
+        """Returns the current page's used JS heap size via CDP, or None."""
+        try:
+            self.driver.execute_cdp_cmd("Performance.enable", {})
+            metrics = self.driver.execute_cdp_cmd("Performance.getMetrics", {})
+            for metric in metrics.get("metrics", []):
+                if metric.get("name") == "JSHeapUsedSize":
+                    return metric.get("value")
+        except Exception as e:
+            logger.debug(f"[Port {self.port}] 無法取得 JS 記憶體用量: {e}")
+        return None
+
+    @tracing.traced(cat="scraper")
+    def recycle_tab(self):
+        """Replaces the working tab with a fresh one to release renderer memory."""
+        old_handle = self.driver.current_window_handle
+        self.driver.switch_to.new_window("tab")
+        new_handle = self.driver.current_window_handle
+        self.driver.switch_to.window(old_handle)
+        self.driver.close()
+        self.driver.switch_to.window(new_handle)
+        self.invalidate_page_state()
+        logger.info(f"[Port {self.port}] 已更換為新的分頁。")
+
+    def close_browser(self):
+        """Asks Chrome itself to exit, then drops the WebDriver session."""
+        if self.driver:
+            try:
+                self.driver.execute_cdp_cmd("Browser.close", {})
+            except Exception:
+                pass # The browser may already be gone.
+        self.close_driver()
+        self.invalidate_page_state()
+
     def close_driver(self):
         """Closes the WebDriver."""
         if self.driver:
@@ -16,9 +16,24 @@ def load_settings():
         "last_destination_path": "",
         "last_selected_models": ["Gamma", "Term", "Smile", "TV Code"],
         "enable_multi_window": False,
+        "compress_outputs": False,
+        "direct_download": False,
+        "detect_changes": True, # Compare outputs with the previous version and write a changes manifest per run
+        "replica_destination": "", # Second folder (e.g. a network share) every output is copied to; empty = off
+        "adaptive_concurrency": True,
+        "worker_count": 0, # 0 = size the pool from available CPU/RAM
+        "use_daemon": False, # Send runs to a running `--daemon` instead of launching Chrome
+        "scraper_engine": "selenium", # "selenium", or "cdp" to drive Chrome over the DevTools protocol
+        "cdp_tabs": 0, # Tabs per model of the CDP engine; 0 = CDP_TABS_PER_BROWSER
         "schedule_enabled": False,
         "schedule_time_hour": "17", # Default hour
-        "schedule_time_minute": "00"  # Default minute
+        "schedule_time_minute": "00",  # Default minute
+        "schedule_extra_times": "", # Additional "HH:MM" slots, comma-separated
+        "schedule_weekdays_only": False,
+        "market_exchanges": ["NYSE"], # Trading calendars checked by the scheduled run
+        "non_trading_day_action": "check", # "skip", "check" (freshness check of one ticker) or "run"
+        "freshness_ticker": "", # Ticker used by the freshness check; empty = first ticker in the file
+        "run_deadline": "" # "HH:MM" the run must finish by; low-priority items are deferred to meet it
     }
     
     if os.path.exists(SETTINGS_FILE):
@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from . import config
+from . import logger as logger_module
+from .logger import TkinterLogHandler, logger
+from .runner import AutomationRun
+from .supervisor import chrome_process_rss, load_psutil
+
+# Measured series and the config budget (MB per 1,000 items) each one is held to.
+_BUDGETS = {
+    "python_heap": "SOAK_BUDGET_PYTHON_HEAP_MB",
+    "python_rss": "SOAK_BUDGET_PYTHON_RSS_MB",
+    "chrome_rss": "SOAK_BUDGET_CHROME_RSS_MB",
+}
+
+
+def synthetic_tickers(count):
+    """Made-up tickers for soak runs; the replay server answers them with recorded responses."""
+    return [f"SOAK{i:05d}" for i in range(1, count + 1)]
+
+
+def _log_file_size():
+    # Rotated parts are compressed and no longer grow; only the active file is measured.
+    try:
+        return os.path.getsize(logger_module.log_file_path)
+    except (OSError, TypeError):
+        return None
+
+
+def growth_per_1000(samples, key):
+    """
+    Least-squares slope of `key` (bytes) against processed items, in MB per
+    1,000 items. Returns None with fewer than three usable samples.
+    """
+    points = [(s["items"], s[key]) for s in samples if s.get(key) is not None]
+    if len(points) < 3:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if var_x == 0:
+        return None
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+    return slope * 1000 / 1024 ** 2
+
+
+class MemorySampler:
+    """
+    Samples, every `SOAK_SAMPLE_SECONDS`, the Python heap (tracemalloc), the
+    RSS of this process and of every Chrome worker (psutil, optional), the
+    size of the run's log file and the number of items processed so far.
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        psutil = load_psutil()
+        self._process = psutil.Process() if psutil is not None else None
+
+    def start(self):
+        self._started = time.monotonic()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    def items_done(self):
+        return sum(len(scraper.timings) for scraper in self.run.scrapers)
+
+    def sample(self):
+        chrome = [chrome_process_rss(scraper.port) for scraper in self.run.scrapers]
+        chrome = [rss for rss in chrome if rss is not None]
+        self.samples.append({
+            "elapsed": round(time.monotonic() - self._started, 1),
+            "items": self.items_done(),
+            "python_heap": tracemalloc.get_traced_memory()[0],
+            "python_rss": self._process.memory_info().rss if self._process else None,
+            "chrome_rss": sum(chrome) if chrome else None,
+            "log_bytes": _log_file_size(),
+        })
+
+    def _loop(self):
+        while not self._stop.wait(config.SOAK_SAMPLE_SECONDS):
+            self.sample()
+
+
+def _drain_gui_queue(log_queue, stop):
+    # Stands in for the GUI's polling loop so records do not pile up in the queue.
+    while not stop.is_set():
+        try:
+            log_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+
+
+def run_soak_test(ticker_count, models, user_settings, destination_path=None):
+    """
+    Runs `ticker_count` synthetic tickers against the configured (stand-in)
+    site while sampling memory, then checks each series' growth per 1,000
+    items past the warm-up against its budget. Writes a JSON report next to
+    the logs and returns True when every measured series is within budget.
+    """
+    tickers = synthetic_tickers(ticker_count)
+    own_destination = destination_path is None
+    destination_path = destination_path or tempfile.mkdtemp(prefix="lieta_soak_")
+    logger.info(f"--- 壓力測試開始: {ticker_count} 個 Tickers x {len(models)} 個模型，目標 {config.LIETA_BASE_URL} ---")
+
+    # The GUI handler path is exercised too; the tk.Text widget itself needs a display and is not measured.
+    gui_queue = queue.Queue()
+    gui_handler = TkinterLogHandler(gui_queue)
+    logging.getLogger().addHandler(gui_handler)
+    drain_stop = threading.Event()
+    threading.Thread(target=_drain_gui_queue, args=(gui_queue, drain_stop), daemon=True).start()
+
+    tracemalloc.start()
+    # Synthetic outputs must never be mirrored onto the real replica, nor their
+    # replay latencies recorded as the models' real cost.
+    run = AutomationRun(tickers, models, destination_path, dict(user_settings, replica_destination=""),
+                        record_history=False)
+    sampler = MemorySampler(run).start()
+    baseline_snapshot = None
+    result = None
+    watcher_stop = threading.Event()
+
+    def take_baseline():
+        nonlocal baseline_snapshot
+        while not watcher_stop.wait(1):
+            if sampler.items_done() >= config.SOAK_WARMUP_TICKERS:
+                baseline_snapshot = tracemalloc.take_snapshot()
+                return
+
+    threading.Thread(target=take_baseline, daemon=True).start()
+    try:
+        result = run.execute()
+    finally:
+        watcher_stop.set()
+        sampler.stop()
+        final_snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        drain_stop.set()
+        logging.getLogger().removeHandler(gui_handler)
+        if own_destination:
+            shutil.rmtree(destination_path, ignore_errors=True)
+
+    measured = [s for s in sampler.samples if s["items"] >= config.SOAK_WARMUP_TICKERS]
+    verdicts = {}
+    passed = True
+    for key, budget_name in _BUDGETS.items():
+        growth = growth_per_1000(measured, key)
+        budget = getattr(config, budget_name)
+        ok = growth is None or growth <= budget
+        passed = passed and ok
+        verdicts[key] = {"growth_mb_per_1000": growth, "budget_mb_per_1000": budget, "ok": ok}
+        if growth is None:
+            logger.warning(f"壓力測試: {key} 樣本不足，無法評估 (需安裝 psutil 或延長測試)。")
+        else:
+            status = "通過" if ok else "超出預算"
+            logger.info(f"壓力測試: {key} 每 1000 項增加 {growth:.2f} MB (預算 {budget} MB) - {status}")
+    log_growth = growth_per_1000(measured, "log_bytes")
+    if log_growth is not None:
+        logger.info(f"壓力測試: 日誌檔每 1000 項增加 {log_growth:.2f} MB。")
+
+    top_growth = []
+    if baseline_snapshot is not None:
+        for stat in final_snapshot.compare_to(baseline_snapshot, "lineno")[:10]:
+            top_growth.append({"location": str(stat.traceback), "size_diff": stat.size_diff, "count_diff": stat.count_diff})
+        logger.info("Python 記憶體增加最多的位置:\n" + "\n".join(
+            f"  {entry['size_diff'] / 1024:+.1f} KB  {entry['location']}" for entry in top_growth))
+
+    report_path = os.path.join(config.BASE_DIR, f"soak_report_{datetime.now():%Y%m%d%H%M%S}.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "ticker_count": ticker_count,
+            "models": models,
+            "base_url": config.LIETA_BASE_URL,
+            "items_processed": sampler.items_done(),
+            "failed": len(result.failed_tickers) if result else None,
+            "passed": passed,
+            "verdicts": verdicts,
+            "log_growth_mb_per_1000": log_growth,
+            "top_python_growth": top_growth,
+            "samples": sampler.samples,
+        }, f, ensure_ascii=False, indent=2)
+    logger.info(f"--- 壓力測試{'通過' if passed else '失敗'}，報告: {report_path} ---")
+    return passed
@@ -0,0 +1,83 @@
+import subprocess
+import sys
+import time
+
+from . import config
+from .logger import logger
+
+# What the GUI imports before its window appears.
+STARTUP_IMPORTS = "import lieta_automator.main, lieta_automator.gui"
+
+
+def _run_importtime(code):
+    """Runs `code` in a fresh interpreter with -X importtime; returns (entries, wall seconds)."""
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=config.BASE_DIR, capture_output=True, text=True, check=True,
+    )
+    wall = time.perf_counter() - started
+    entries = []
+    # Lines look like "import time:       123 |        456 |   package.module",
+    # with two spaces of indentation per nesting level before the name.
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        entries.append({"module": name.strip(), "level": level, "self_us": int(self_us), "cumulative_us": int(cumulative_us)})
+    return entries, wall
+
+
+def measure_startup():
+    """
+    Measures the imports of `STARTUP_IMPORTS` beyond a bare interpreter.
+    Returns a dict with the total import time, the slowest top-level
+    imports, any forbidden modules that were loaded and the wall-clock
+    time of both interpreters.
+    """
+    baseline, baseline_wall = _run_importtime("pass")
+    preloaded = {entry["module"] for entry in baseline}
+    entries, wall = _run_importtime(STARTUP_IMPORTS)
+    own = [entry for entry in entries if entry["module"] not in preloaded]
+    top_level = [entry for entry in own if entry["level"] == 0]
+    loaded = {entry["module"] for entry in own}
+    forbidden = sorted(
+        name for name in loaded
+        if any(name == banned or name.startswith(banned + ".") for banned in config.STARTUP_FORBIDDEN_IMPORTS)
+    )
+    return {
+        "import_ms": sum(entry["cumulative_us"] for entry in top_level) / 1000,
+        "slowest": sorted(own, key=lambda entry: -entry["self_us"])[:15],
+        "forbidden": forbidden,
+        "wall_ms": wall * 1000,
+        "baseline_wall_ms": baseline_wall * 1000,
+    }
+
+
+def run_startup_benchmark():
+    """
+    `--startup-benchmark`: logs and prints the start-up import report.
+    Returns True when the import time is within `STARTUP_IMPORT_BUDGET_MS`
+    and no module of `STARTUP_FORBIDDEN_IMPORTS` was loaded.
+    """
+    if getattr(sys, 'frozen', False):
+        logger.error("打包後的執行檔無法使用 -X importtime，請以原始碼執行啟動效能測試。")
+        return False
+    result = measure_startup()
+    budget = config.STARTUP_IMPORT_BUDGET_MS
+    passed = result["import_ms"] <= budget and not result["forbidden"]
+    lines = [
+        f"啟動匯入耗時 {result['import_ms']:.0f} ms (預算 {budget} ms)，"
+        f"程序總耗時 {result['wall_ms']:.0f} ms (空白直譯器 {result['baseline_wall_ms']:.0f} ms)",
+        "自身耗時最多的模組:",
+    ]
+    lines += [f"  {entry['self_us'] / 1000:7.1f} ms  {entry['module']}" for entry in result["slowest"]]
+    if result["forbidden"]:
+        lines.append("啟動時不應載入的模組: " + ", ".join(result["forbidden"]))
+    lines.append("結果: " + ("通過" if passed else "未通過"))
+    report = "\n".join(lines)
+    print(report)
+    logger.info(report, extra={"data": {"event": "startup_benchmark", "import_ms": round(result["import_ms"], 1),
+                                        "budget_ms": budget, "forbidden": result["forbidden"], "passed": passed}})
+    return passed
@@ -0,0 +1,146 @@
+import statistics
+import threading
+
+from . import config
+from .logger import logger
+
+_psutil = False # Not imported yet; None once known to be missing
+
+
+def load_psutil():
+    """
+    Returns the optional `psutil` module, or None when it is not installed
+    (then only the JS heap is tracked). It is imported on first use to keep
+    start-up light.
+    """
+    global _psutil
+    if _psutil is False:
+        try:
+            import psutil
+            _psutil = psutil
+        except ImportError:
+            _psutil = None
+    return _psutil
+
+
+def chrome_process_rss(port):
+    """
+    Returns the combined RSS in bytes of the Chrome instance listening on
+    `port` (browser process plus its renderers), or None if unavailable.
+    Requires the optional `psutil` package.
+    """
+    psutil = load_psutil()
+    if psutil is None:
+        return None
+    try:
+        browser = None
+        for conn in psutil.net_connections(kind="tcp"):
+            if conn.laddr and conn.laddr.port == port and conn.status == psutil.CONN_LISTEN and conn.pid:
+                browser = psutil.Process(conn.pid)
+                break
+        if browser is None:
+            return None
+        total = browser.memory_info().rss
+        for child in browser.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return total
+    except (psutil.Error, OSError):
+        return None
+
+
+class WorkerSupervisor:
+    """
+    Watches each worker between tickers and decides when its browser should
+    be recycled before it degrades:
+
+    - Chrome RSS above `RECYCLE_RSS_MB` (when psutil is available) or a
+      sustained latency slowdown of this worker alone (compared with the
+      other workers of the pool) -> restart the browser;
+    - page JS heap above `RECYCLE_JS_HEAP_MB` -> replace the tab, which
+      releases the renderer without a new login check.
+
+    Checks run every `RECYCLE_CHECK_EVERY` items to keep the CDP overhead low.
+    """
+
+    TAB = "tab"
+    BROWSER = "browser"
+
+    def __init__(self, peer_ratio=None):
+        # Optional callable(port) replacing the in-process peer comparison,
+        # for workers running in separate processes (`--coordinator`).
+        self.peer_ratio = peer_ratio
+        self._lock = threading.Lock()
+        self._items_since_check = {}
+        self._first_sample = {}
+        # Recent median chart-load time of each port, as of its last check.
+        self._recent_latency = {}
+
+    def reset(self, scraper):
+        """Starts a fresh baseline, e.g. after the worker's browser was recycled."""
+        with self._lock:
+            self._items_since_check[scraper.port] = 0
+            self._first_sample[scraper.port] = len(scraper.timings)
+            self._recent_latency.pop(scraper.port, None)
+
+    def check(self, scraper):
+        """Returns TAB, BROWSER or None for the worker behind `scraper`."""
+        with self._lock:
+            count = self._items_since_check.get(scraper.port, 0) + 1
+            self._items_since_check[scraper.port] = count
+            if count < config.RECYCLE_CHECK_EVERY:
+                return None
+            self._items_since_check[scraper.port] = 0
+            first_sample = self._first_sample.setdefault(scraper.port, 0)
+
+        rss = chrome_process_rss(scraper.port)
+        if rss is not None and rss > config.RECYCLE_RSS_MB * 1024 * 1024:
+            logger.warning(f"[Port {scraper.port}] Chrome 記憶體 {rss / 1024 ** 2:.0f} MB 超過上限，將重新啟動瀏覽器。")
+            return self.BROWSER
+
+        slowdown = self._latency_slowdown(scraper.port, scraper.timings[first_sample:])
+        if slowdown is not None and slowdown > config.RECYCLE_LATENCY_RATIO:
+            peer_ratio = (self.peer_ratio or self._peer_ratio)(scraper.port)
+            if peer_ratio is None or peer_ratio > config.RECYCLE_PEER_LATENCY_RATIO:
+                logger.warning(f"[Port {scraper.port}] 圖表載入時間已變為初期的 {slowdown:.1f} 倍，將重新啟動瀏覽器。")
+                return self.BROWSER
+            logger.info(f"[Port {scraper.port}] 圖表載入變慢 {slowdown:.1f} 倍，但其他工作視窗同樣變慢 (後端壅塞)，不重新啟動瀏覽器。")
+
+        heap = scraper.js_heap_bytes()
+        if heap is not None and heap > config.RECYCLE_JS_HEAP_MB * 1024 * 1024:
+            logger.warning(f"[Port {scraper.port}] 頁面 JS 記憶體 {heap / 1024 ** 2:.0f} MB 超過上限，將更換分頁。")
+            return self.TAB
+        return None
+
+    def _latency_slowdown(self, port, samples):
+        """Ratio of the recent median chart-load time to the early median."""
+        latencies = [s["chart_load_seconds"] for s in samples if s.get("chart_load_seconds") is not None]
+        window = config.RECYCLE_LATENCY_WINDOW
+        if len(latencies) >= window:
+            with self._lock:
+                self._recent_latency[port] = statistics.median(latencies[-window:])
+        if len(latencies) < window * 2:
+            return None
+        baseline = statistics.median(latencies[:window])
+        recent = statistics.median(latencies[-window:])
+        return recent / baseline if baseline > 0 else None
+
+    def _peer_ratio(self, port):
+        """
+        Ratio of this port's recent latency to the median of the other
+        ports', or None when no other port has been measured (one worker).
+        """
+        with self._lock:
+            own = self._recent_latency.get(port)
+            peers = [latency for other, latency in self._recent_latency.items() if other != port]
+        return latency_ratio(own, peers)
+
+
+def latency_ratio(own, peers):
+    """Ratio of a worker's recent latency to the median of its peers', or None."""
+    if own is None or not peers:
+        return None
+    peer_median = statistics.median(peers)
+    return own / peer_median if peer_median > 0 else None
@@ -0,0 +1,199 @@
+import csv
+import json
+import os
+import re
+
+from . import config
+from .logger import logger
+
+# Priority of tickers that do not declare one. Higher values run first.
+DEFAULT_PRIORITY = 0
+
+
+class TickerSpec:
+    """
+    One line of a ticker file: the ticker, its priority (higher runs first)
+    and, optionally, the only models it needs (None = every selected model).
+    """
+
+    def __init__(self, ticker, priority=DEFAULT_PRIORITY, models=None):
+        self.ticker = ticker.strip().upper()
+        self.priority = priority
+        self.models = [canonical_model(m) for m in models] if models else None
+
+    def wants(self, model):
+        return self.models is None or model in self.models
+
+    def to_dict(self):
+        return {"ticker": self.ticker, "priority": self.priority, "models": self.models}
+
+    @classmethod
+    def from_value(cls, value):
+        """Builds a spec from a plain ticker string or a `to_dict()` dict."""
+        if isinstance(value, TickerSpec):
+            return value
+        if isinstance(value, str):
+            return cls(value)
+        return cls(value["ticker"], int(value.get("priority", DEFAULT_PRIORITY)), value.get("models"))
+
+    def to_line(self):
+        """Formats the spec as a line of a `.txt` ticker file."""
+        if self.models:
+            return f"{self.ticker} | {self.priority} | {', '.join(self.models)}"
+        if self.priority != DEFAULT_PRIORITY:
+            return f"{self.ticker} | {self.priority}"
+        return self.ticker
+
+    def __repr__(self):
+        return f"TickerSpec({self.to_line()!r})"
+
+
+def _model_key(name):
+    return re.sub(r"\s+", "", str(name)).lower()
+
+
+def canonical_model(name):
+    """Returns the platform's spelling of a model name ("gamma", "tvcode" -> "Gamma", "TV Code"); unknown names as given."""
+    name = str(name).strip()
+    return next((model for model in config.MODELS if _model_key(model) == _model_key(name)), name)
+
+
+def unknown_models(specs):
+    """Per-ticker model names that are not platform models, {name: [tickers]}."""
+    unknown = {}
+    for spec in specs:
+        for model in spec.models or ():
+            if model not in config.MODELS:
+                unknown.setdefault(model, []).append(spec.ticker)
+    return unknown
+
+
+def normalize(tickers):
+    """Turns a list of ticker strings and/or specs into `TickerSpec`s."""
+    return [TickerSpec.from_value(t) for t in tickers]
+
+
+def parse_txt_line(line):
+    """
+    Parses one line of a `.txt` ticker file:
+
+        AAPL                      every selected model, default priority
+        NVDA | 10                 priority 10
+        TSLA | 5 | Gamma, Smile   priority 5, only Gamma and Smile
+
+    Blank lines and lines starting with '#' return None.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    fields = [field.strip() for field in line.split("|")]
+    priority = int(fields[1]) if len(fields) > 1 and fields[1] else DEFAULT_PRIORITY
+    models = [m.strip() for m in fields[2].split(",") if m.strip()] if len(fields) > 2 else None
+    return TickerSpec(fields[0], priority, models)
+
+
+def _split_models(value):
+    """Model lists in CSV/JSON may be separated by ',' ';' or '|'."""
+    if not value:
+        return None
+    if isinstance(value, list):
+        return [str(m).strip() for m in value if str(m).strip()] or None
+    return [m.strip() for m in re.split(r"[,;|]", value) if m.strip()] or None
+
+
+def _load_txt(path):
+    specs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            try:
+                spec = parse_txt_line(line)
+            except ValueError as e:
+                raise ValueError(f"{os.path.basename(path)} 第 {line_number} 行格式錯誤: {line.strip()}") from e
+            if spec is not None:
+                specs.append(spec)
+    return specs
+
+
+def _load_csv(path):
+    """
+    CSV with a header row; only `ticker` is required:
+
+        ticker,priority,models
+        AAPL,,
+        SPY,10,"Gamma;Smile"
+    """
+    specs = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        fields = {name.strip().lower(): name for name in reader.fieldnames or []}
+        if "ticker" not in fields:
+            raise ValueError(f"{os.path.basename(path)} 缺少 ticker 欄位。")
+        for line_number, row in enumerate(reader, start=2):
+            ticker = (row.get(fields["ticker"]) or "").strip()
+            if not ticker or ticker.startswith("#"):
+                continue
+            try:
+                priority_text = (row.get(fields.get("priority", ""), "") or "").strip()
+                priority = int(priority_text) if priority_text else DEFAULT_PRIORITY
+            except ValueError as e:
+                raise ValueError(f"{os.path.basename(path)} 第 {line_number} 行的 priority 不是整數。") from e
+            specs.append(TickerSpec(ticker, priority, _split_models(row.get(fields.get("models", ""), ""))))
+    return specs
+
+
+def _load_json(path):
+    """
+    A JSON list (or {"tickers": [...]}) of ticker strings or objects:
+
+        [
+            "AAPL",
+            {"ticker": "SPY", "priority": 10, "models": ["Gamma", "Smile"]}
+        ]
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("tickers", [])
+    if not isinstance(data, list):
+        raise ValueError(f"{os.path.basename(path)} 必須是 Ticker 清單。")
+    specs = []
+    for entry in data:
+        if isinstance(entry, dict):
+            entry = dict(entry, models=_split_models(entry.get("models")))
+        specs.append(TickerSpec.from_value(entry))
+    return specs
+
+
+# Ticker file formats by extension; anything else is read as plain text.
+_LOADERS = {".csv": _load_csv, ".json": _load_json}
+
+
+def load_ticker_file(path):
+    """
+    Reads a `.txt`, `.csv` or `.json` ticker file into a list of
+    `TickerSpec`s. Raises ValueError on malformed content.
+    """
+    loader = _LOADERS.get(os.path.splitext(path)[1].lower(), _load_txt)
+    try:
+        specs = loader(path)
+    except (KeyError, TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f"{os.path.basename(path)} 格式錯誤: {e}") from e
+    for model, tickers in unknown_models(specs).items():
+        logger.warning(
+            f"{os.path.basename(path)}: 未知的模型名稱 '{model}' (可用: {', '.join(config.MODELS)})，"
+            f"{', '.join(tickers[:5])}{' 等' if len(tickers) > 5 else ''} 不會產生此模型的項目。"
+        )
+    return specs
+
+
+def count_items(specs, models):
+    """Number of (model, ticker) items the specs produce for the selected models."""
+    return sum(1 for spec in specs for model in models if spec.wants(model))
+
+
+def write_ticker_file(path, specs):
+    """Writes specs in the `.txt` format, e.g. to save the items a run deferred."""
+    with open(path, "w", encoding="utf-8") as f:
+        for spec in specs:
+            f.write(spec.to_line() + "\n")
+    logger.info(f"已寫入 {len(specs)} 個 Tickers 至 {path}。")
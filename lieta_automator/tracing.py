@@ -0,0 +1,260 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from . import config
+from . import logger as logger_module
+from .logger import logger
+
+# The active recorder while `--profile` is on; spans are no-ops otherwise.
+_recorder = None
+_sampler = None
+sampling = False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("recorder", "name", "cat", "args", "started")
+
+    def __init__(self, recorder, name, cat, args):
+        self.recorder = recorder
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args = dict(self.args or {}, error=exc_type.__name__)
+        self.recorder.add(self.name, self.cat, self.started, time.perf_counter_ns(), self.args)
+        return False
+
+
+class TraceRecorder:
+    """
+    Collects completed spans as Chrome trace events ("X" phase). Each thread
+    becomes a lane named after the thread, so every worker (`port-9222`, ...),
+    pipeline thread and the GUI thread gets its own row in Perfetto or
+    chrome://tracing.
+    """
+
+    def __init__(self, max_events=None):
+        self.max_events = max_events or config.PROFILE_MAX_EVENTS
+        self.events = []
+        self.dropped = 0
+        self._thread_names = {}
+        # Timestamps are wall-clock based, so traces of the `--coordinator` worker
+        # processes line up with the coordinator's when their events are combined.
+        self._origin = time.perf_counter_ns()
+        self._epoch_us = time.time_ns() / 1000
+
+    def add(self, name, cat, started_ns, ended_ns, args=None):
+        if len(self.events) >= self.max_events:
+            self.dropped += 1
+            return
+        tid = threading.get_ident()
+        if tid not in self._thread_names:
+            self._thread_names[tid] = threading.current_thread().name
+        event = {
+            "name": name, "cat": cat, "ph": "X", "pid": os.getpid(), "tid": tid,
+            "ts": self._epoch_us + (started_ns - self._origin) / 1000, "dur": (ended_ns - started_ns) / 1000,
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event) # list.append is atomic, so worker threads need no lock
+
+    def to_json(self):
+        pid = os.getpid()
+        metadata = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "Lieta Automator"}}]
+        for tid, name in list(self._thread_names.items()):
+            metadata.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+            # Keep worker lanes together and in port order.
+            order = int(name.split("-", 1)[1]) if name.startswith("port-") and name[5:].isdigit() else 0
+            metadata.append({"name": "thread_sort_index", "ph": "M", "pid": pid, "tid": tid, "args": {"sort_index": order}})
+        return {"traceEvents": metadata + list(self.events), "displayTimeUnit": "ms",
+                "otherData": {"dropped_events": self.dropped}}
+
+
+class StackSampler:
+    """
+    Samples the Python stack of every thread every `PROFILE_SAMPLE_INTERVAL_MS`.
+    Unlike cProfile, which only sees the thread it was enabled on, this covers
+    the worker, pipeline and GUI threads alike, and counts time spent waiting
+    (WebDriver HTTP calls, sleeps, disk I/O) as well as time on the CPU.
+    """
+
+    def __init__(self, interval_ms=None):
+        self.interval = (interval_ms or config.PROFILE_SAMPLE_INTERVAL_MS) / 1000
+        self.samples = 0
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _loop(self):
+        # Neither this thread nor the log file writer, which mostly waits for records.
+        listener = getattr(logger_module._listener, "_thread", None)
+        skipped = {threading.get_ident(), getattr(listener, "ident", None)}
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid in skipped:
+                    continue
+                functions = []
+                while frame is not None:
+                    code = frame.f_code
+                    functions.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if not functions:
+                    continue
+                self.samples += 1
+                self.self_counts[functions[0]] += 1
+                for function in set(functions):
+                    self.total_counts[function] += 1
+                self.stacks[";".join([names.get(tid, str(tid))] + functions[::-1])] += 1
+
+    def report(self, top=None):
+        """The hottest functions by own and by cumulative samples, as text."""
+        top = top or config.PROFILE_REPORT_TOP
+        if not self.samples:
+            return "沒有取樣資料。"
+        lines = [f"取樣 {self.samples} 次 (每 {self.interval * 1000:.0f} ms，所有線程)", "", "=== 自身時間最多的函式 ==="]
+        for function, count in self.self_counts.most_common(top):
+            lines.append(f"{count / self.samples:7.1%} {count:>8}  {function}")
+        lines += ["", "=== 累計時間最多的函式 (含呼叫的函式) ==="]
+        for function, count in self.total_counts.most_common(top):
+            lines.append(f"{count / self.samples:7.1%} {count:>8}  {function}")
+        return "\n".join(lines)
+
+    def folded(self):
+        """Stacks in the collapsed format read by flamegraph.pl and speedscope."""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+
+def enabled():
+    return _recorder is not None
+
+
+def span(name, cat="app", **args):
+    """
+    Times the enclosed block as a span on the current thread's lane:
+
+        with tracing.span("download", cat="scraper", ticker=ticker): ...
+
+    Costs one global lookup when profiling is off.
+    """
+    recorder = _recorder
+    if recorder is None:
+        return _NULL_SPAN
+    return _Span(recorder, name, cat, args or None)
+
+
+def traced(name=None, cat="app"):
+    """Decorator form of `span`, named after the function unless `name` is given."""
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return func(*args, **kwargs)
+            with span(label, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def sleep(seconds):
+    """`time.sleep` that shows up as a "sleep" span in the trace."""
+    with span("sleep", cat="sleep", seconds=seconds):
+        time.sleep(seconds)
+
+
+def instrument_driver(driver):
+    """Records every WebDriver command (one HTTP round trip to chromedriver) of `driver` as a span."""
+    if _recorder is None:
+        return driver
+    execute = driver.execute
+
+    def traced_execute(driver_command, params=None):
+        with span(driver_command, cat="webdriver"):
+            return execute(driver_command, params)
+
+    driver.execute = traced_execute
+    return driver
+
+
+def start(sample=False):
+    """Starts recording spans (`--profile`) and, with `sample`, the stack sampler."""
+    global _recorder, _sampler, sampling
+    _recorder = TraceRecorder()
+    _sampler = StackSampler().start() if sample else None
+    sampling = sample
+    logger.info("效能分析已啟用" + ("，並取樣所有線程的呼叫堆疊。" if sample else "。"))
+
+
+def stop(output_dir=None):
+    """
+    Stops profiling and writes trace_<time>_<pid>.json (Chrome trace-event
+    format) and, if the sampler ran, hot_functions_<time>_<pid>.txt and
+    stacks_<time>_<pid>.folded.
+    Returns the paths written.
+    """
+    global _recorder, _sampler
+    recorder, sampler = _recorder, _sampler
+    _recorder = _sampler = None
+    if recorder is None:
+        return []
+    output_dir = output_dir or config.PROFILE_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = f"{datetime.now():%Y%m%d%H%M%S}_{os.getpid()}" # Worker processes finish at the same time
+    paths = []
+
+    trace_path = os.path.join(output_dir, f"trace_{stamp}.json")
+    with open(trace_path, "w", encoding="utf-8") as f:
+        json.dump(recorder.to_json(), f)
+    paths.append(trace_path)
+    if recorder.dropped:
+        logger.warning(f"效能分析: 超過 {recorder.max_events} 個事件，略過了 {recorder.dropped} 個。")
+
+    if sampler is not None:
+        sampler.stop()
+        report = sampler.report()
+        report_path = os.path.join(output_dir, f"hot_functions_{stamp}.txt")
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+        folded_path = os.path.join(output_dir, f"stacks_{stamp}.folded")
+        with open(folded_path, "w", encoding="utf-8") as f:
+            f.write(sampler.folded())
+        paths += [report_path, folded_path]
+        logger.info("效能分析熱點函式:\n" + "\n".join(report.splitlines()[:config.PROFILE_REPORT_TOP + 3]))
+
+    logger.info("效能分析結果 (追蹤檔可在 https://ui.perfetto.dev 開啟): " + ", ".join(paths))
+    return paths
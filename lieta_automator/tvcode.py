@@ -0,0 +1,170 @@
+import csv
+import json
+import os
+import threading
+from datetime import datetime
+
+from . import config
+from .logger import logger
+
+
+class TvCodeSink:
+    """
+    Collects TV Code results from every scraper of a run.
+
+    Results are buffered in memory keyed by ticker, so re-running a ticker on
+    the same day replaces its line instead of appending a duplicate. At each
+    checkpoint the complete set is written to `{date}_TV Code.txt` plus
+    structured `.json` and `.csv` versions, each through a temp file and an
+    atomic replace, so readers never observe a half-written file.
+    """
+
+    def __init__(self, destination_path, flush_every=None, changes=None):
+        self.target_dir = os.path.join(destination_path, "TV Code")
+        date_stamp = datetime.now().strftime("%Y%m%d")
+        self.base_path = os.path.join(self.target_dir, f"{date_stamp}_TV Code")
+        self.flush_every = flush_every or config.TV_CODE_FLUSH_EVERY
+        # A `changes.ChangeDetector`: each line is compared with the ticker's previous one.
+        self.changes = changes
+        self._lock = threading.Lock()
+        self._entries = None  # Loaded lazily from today's existing output.
+        self._previous_day = None  # Entries of the latest earlier day, loaded on first comparison.
+        self._unflushed = 0
+
+    @property
+    def txt_path(self):
+        return self.base_path + ".txt"
+
+    @property
+    def json_path(self):
+        return self.base_path + ".json"
+
+    @property
+    def csv_path(self):
+        return self.base_path + ".csv"
+
+    def add(self, ticker, code_text):
+        """Records the TV Code for a ticker, flushing when a checkpoint is reached."""
+        with self._lock:
+            self._load_existing()
+            if self.changes is not None:
+                previous = self._entries.get(ticker.upper()) or self._load_previous_day().get(ticker.upper())
+                self.changes.record_tv_code(ticker, previous["code"] if previous else None, code_text)
+            self._entries[ticker.upper()] = {
+                "ticker": ticker.upper(),
+                "code": code_text.strip(),
+                "updated_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            self._unflushed += 1
+            if self._unflushed >= self.flush_every:
+                self._flush_locked()
+
+    def flush(self):
+        """Writes all buffered results to disk if anything changed."""
+        with self._lock:
+            if self._unflushed:
+                self._flush_locked()
+
+    def _load_existing(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        try:
+            if os.path.exists(self.json_path):
+                with open(self.json_path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            elif os.path.exists(self.txt_path):
+                # Files written before the structured output existed.
+                with open(self.txt_path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        line = line.strip()
+                        if ":" in line:
+                            ticker = line.split(":", 1)[0].strip().upper()
+                            self._entries[ticker] = {"ticker": ticker, "code": line, "updated_at": None}
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning(f"無法讀取既有的 TV Code 檔案，將重新建立: {e}")
+            self._entries = {}
+
+    def _load_previous_day(self):
+        if self._previous_day is None:
+            self._previous_day = {}
+            today = os.path.basename(self.json_path)
+            try:
+                earlier = sorted(name for name in os.listdir(self.target_dir) if name.endswith("_TV Code.json") and name < today)
+                if earlier:
+                    with open(os.path.join(self.target_dir, earlier[-1]), "r", encoding="utf-8") as f:
+                        self._previous_day = json.load(f)
+            except (json.JSONDecodeError, OSError) as e:
+                if os.path.isdir(self.target_dir):
+                    logger.warning(f"無法讀取先前的 TV Code 檔案，將視為新資料: {e}")
+        return self._previous_day
+
+    def _flush_locked(self):
+        os.makedirs(self.target_dir, exist_ok=True)
+        entries = [self._entries[t] for t in sorted(self._entries)]
+
+        _write_atomically(self.txt_path, lambda f: f.writelines(e["code"] + "\n" for e in entries))
+        _write_atomically(self.json_path, lambda f: json.dump(self._entries, f, indent=2, ensure_ascii=False))
+
+        def write_csv(f):
+            writer = csv.DictWriter(f, fieldnames=["ticker", "code", "updated_at"])
+            writer.writeheader()
+            writer.writerows(entries)
+        _write_atomically(self.csv_path, write_csv, newline="")
+
+        self._unflushed = 0
+        logger.info(f"TV Code 已寫入 {os.path.basename(self.txt_path)} ({len(entries)} 個 Tickers)。")
+
+
+def _write_atomically(path, write, newline=None):
+    """Writes a file via a temp file in the same folder and an atomic replace."""
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8", newline=newline) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class TvCodeCollector:
+    """
+    Stands in for `TvCodeSink` when the codes must not be written to the
+    day's TV Code files: in a worker process (several processes must not
+    rewrite the same files, so codes travel back through the work queue)
+    and for the non-trading-day freshness check.
+    """
+
+    def __init__(self):
+        self.codes = {}
+
+    def add(self, ticker, code_text):
+        self.codes[ticker.upper()] = code_text.strip()
+
+    def flush(self):
+        pass
+
+    def take(self, ticker):
+        return self.codes.pop(ticker.upper(), None)
+
+
+def latest_saved_code(destination_path, ticker):
+    """Returns the most recently saved TV Code of `ticker`, or None if there is none."""
+    target_dir = os.path.join(destination_path, "TV Code")
+    if not os.path.isdir(target_dir):
+        return None
+    ticker = ticker.upper()
+    for filename in sorted(os.listdir(target_dir), reverse=True):
+        if not filename.endswith("_TV Code.json"):
+            continue
+        try:
+            with open(os.path.join(target_dir, filename), "r", encoding="utf-8") as f:
+                entry = json.load(f).get(ticker)
+        except (json.JSONDecodeError, OSError):
+            continue
+        if entry:
+            return entry["code"]
+    return None
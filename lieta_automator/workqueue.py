@@ -0,0 +1,274 @@
+import json
+import sqlite3
+import threading
+import time
+
+from . import config
+from .planner import WorkItem
+
+# Item states.
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    destination_path TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    model TEXT NOT NULL,
+    ticker TEXT NOT NULL,
+    cost REAL NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    seconds REAL,
+    error TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS items_by_status ON items(run_id, status);
+-- Workers whose lease ran out, noted when the item is taken back so the
+-- coordinator can still find (and kill) them after another worker's claim.
+CREATE TABLE IF NOT EXISTS stuck_workers (
+    run_id INTEGER NOT NULL,
+    worker TEXT NOT NULL,
+    noticed_at REAL NOT NULL
+);
+"""
+
+
+class QueuedItem(WorkItem):
+    """A `WorkItem` claimed from the shared queue."""
+
+    def __init__(self, item_id, run_id, model, ticker, cost, priority, attempts, worker):
+        super().__init__(model, ticker, cost, priority)
+        self.item_id = item_id
+        self.run_id = run_id
+        self.attempts = attempts
+        # Updates from a worker whose lease was taken over are ignored.
+        self.worker = worker
+
+
+class SQLiteWorkQueue:
+    """
+    A (model, ticker) work queue shared by worker processes through one
+    SQLite file.
+
+    Workers `claim` an item, which leases it for `QUEUE_LEASE_SECONDS`, and
+    report it with `complete` or hand it back with `release`. A lease that
+    runs out (the worker crashed or hung) makes the item claimable again,
+    until it has been attempted `MAX_ITEM_ATTEMPTS` times.
+
+    Every state change happens in an IMMEDIATE transaction, so several
+    processes can use the same file safely. Each thread gets its own
+    connection.
+    """
+
+    def __init__(self, path=None, lease_seconds=None):
+        self.path = path or config.WORK_QUEUE_FILE
+        self.lease_seconds = lease_seconds or config.QUEUE_LEASE_SECONDS
+        self._local = threading.local()
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            # WAL lets the coordinator read progress while workers write.
+            # It needs a local disk; on a network share SQLite falls back to its default journal.
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # --- Coordinator side ---
+
+    def create_run(self, items, destination_path, user_settings):
+        """Stores a run and its `WorkItem`s; returns the run id."""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO runs (destination_path, settings, created_at) VALUES (?, ?, ?)",
+                (destination_path, json.dumps(user_settings, ensure_ascii=False), time.time())
+            )
+            run_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO items (run_id, model, ticker, cost, priority, status) VALUES (?, ?, ?, ?, ?, ?)",
+                [(run_id, item.model, item.ticker, item.cost, item.priority, PENDING) for item in items]
+            )
+        return run_id
+
+    def get_run(self, run_id):
+        """Returns (destination_path, user_settings) of a run, or None."""
+        row = self._connection().execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        return row["destination_path"], json.loads(row["settings"])
+
+    def latest_open_run(self):
+        """Returns the id of the oldest run that still has unfinished items, or None."""
+        row = self._connection().execute(
+            "SELECT MIN(run_id) AS run_id FROM items WHERE status IN (?, ?)", (PENDING, LEASED)
+        ).fetchone()
+        return row["run_id"]
+
+    def progress(self, run_id):
+        """Returns the number of items per state."""
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        for row in self._connection().execute(
+                "SELECT status, COUNT(*) AS n FROM items WHERE run_id = ? GROUP BY status", (run_id,)):
+            counts[row["status"]] = row["n"]
+        return counts
+
+    def is_finished(self, run_id):
+        counts = self.progress(run_id)
+        return counts[PENDING] == 0 and counts[LEASED] == 0
+
+    def expired_workers(self, run_id):
+        """
+        Workers holding a lease that has run out, or whose expired lease was
+        taken back since the last call, i.e. probably stuck. Each worker
+        taken back is reported once.
+        """
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT worker FROM items WHERE run_id = ? AND status = ? AND lease_expires < ? "
+                "UNION SELECT worker FROM stuck_workers WHERE run_id = ?",
+                (run_id, LEASED, time.time(), run_id)
+            ).fetchall()
+            conn.execute("DELETE FROM stuck_workers WHERE run_id = ?", (run_id,))
+        return [row["worker"] for row in rows]
+
+    def failed_labels(self, run_id):
+        rows = self._connection().execute(
+            "SELECT model, ticker FROM items WHERE run_id = ? AND status != ? ORDER BY id", (run_id, DONE)
+        )
+        return [f"{row['ticker']} ({row['model']})" for row in rows]
+
+    def results(self, run_id, model):
+        """Returns [(ticker, result)] for the finished items of `model` that carried a result."""
+        rows = self._connection().execute(
+            "SELECT ticker, result FROM items WHERE run_id = ? AND model = ? AND status = ? AND result IS NOT NULL ORDER BY id",
+            (run_id, model, DONE)
+        )
+        return [(row["ticker"], row["result"]) for row in rows]
+
+    def timings(self, run_id):
+        """Timing samples of finished items, in the format `TimingHistory.record_samples` takes."""
+        rows = self._connection().execute(
+            "SELECT model, ticker, seconds FROM items WHERE run_id = ? AND status = ? AND seconds IS NOT NULL",
+            (run_id, DONE)
+        )
+        return [{"model": row["model"], "ticker": row["ticker"], "seconds": row["seconds"]} for row in rows]
+
+    def recent_seconds(self, run_id, per_worker):
+        """Item durations of the last `per_worker` finished items of each worker, {worker: [seconds]}."""
+        rows = self._connection().execute(
+            "SELECT worker, seconds FROM items WHERE run_id = ? AND status = ? AND seconds IS NOT NULL "
+            "AND worker IS NOT NULL ORDER BY id DESC LIMIT 1000",
+            (run_id, DONE)
+        )
+        recent = {}
+        for row in rows:
+            samples = recent.setdefault(row["worker"], [])
+            if len(samples) < per_worker:
+                samples.append(row["seconds"])
+        return recent
+
+    # --- Worker side ---
+
+    def claim(self, worker, run_id, current_model=None):
+        """
+        Leases the next item of `run_id` to `worker`: the highest priority
+        first, then the model the worker has selected, then the most
+        expensive item. Returns a
+        `QueuedItem`, or None when nothing is claimable right now.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire_leases(conn, run_id, now)
+            row = conn.execute(
+                "SELECT * FROM items WHERE run_id = ? AND status = ? "
+                "ORDER BY priority DESC, (model = ?) DESC, cost DESC, id LIMIT 1",
+                (run_id, PENDING, current_model)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE items SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                (LEASED, worker, now + self.lease_seconds, row["id"])
+            )
+        return QueuedItem(row["id"], run_id, row["model"], row["ticker"], row["cost"], row["priority"], row["attempts"] + 1, worker)
+
+    def complete(self, item, ok, seconds=None, error=None, result=None):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE items SET status = ?, lease_expires = NULL, seconds = ?, error = ?, result = ? "
+                "WHERE id = ? AND status = ? AND worker = ?",
+                (DONE if ok else FAILED, seconds, error, result, item.item_id, LEASED, item.worker)
+            )
+
+    def release(self, item):
+        """Hands a leased item back, e.g. because the worker's browser crashed."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE items SET status = ?, worker = NULL, lease_expires = NULL WHERE id = ? AND status = ? AND worker = ?",
+                (PENDING, item.item_id, LEASED, item.worker)
+            )
+
+    def mark_failed(self, run_id, model, ticker, error):
+        """Fails a finished item after the fact (its post-processing failed)."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE items SET status = ?, error = ? WHERE run_id = ? AND model = ? AND ticker = ? AND status = ?",
+                (FAILED, error, run_id, model, ticker, DONE)
+            )
+
+    def _expire_leases(self, conn, run_id, now):
+        conn.execute(
+            "INSERT INTO stuck_workers (run_id, worker, noticed_at) "
+            "SELECT DISTINCT run_id, worker, ? FROM items WHERE run_id = ? AND status = ? AND lease_expires < ? "
+            "AND worker IS NOT NULL",
+            (now, run_id, LEASED, now)
+        )
+        conn.execute(
+            "UPDATE items SET status = ?, worker = NULL, lease_expires = NULL "
+            "WHERE run_id = ? AND status = ? AND lease_expires < ? AND attempts < ?",
+            (PENDING, run_id, LEASED, now, config.MAX_ITEM_ATTEMPTS)
+        )
+        conn.execute(
+            "UPDATE items SET status = ?, error = ? "
+            "WHERE run_id = ? AND status = ? AND lease_expires < ?",
+            (FAILED, "lease expired", run_id, LEASED, now)
+        )
+
+
+class _Transaction:
+    """`with` block running its statements in one IMMEDIATE transaction."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
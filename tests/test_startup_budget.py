@@ -0,0 +1,10 @@
+from lieta_automator import config
+from lieta_automator.startup_benchmark import measure_startup
+
+
+def test_startup_imports_within_budget():
+    result = measure_startup()
+    assert not result["forbidden"], f"modules loaded at start-up: {result['forbidden']}"
+    assert result["import_ms"] <= config.STARTUP_IMPORT_BUDGET_MS, (
+        f"start-up imports took {result['import_ms']:.0f} ms (budget {config.STARTUP_IMPORT_BUDGET_MS} ms)"
+    )